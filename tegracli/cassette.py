@@ -0,0 +1,290 @@
+"""Record Telegram responses and replay them offline.
+
+A ``RecordingClient`` writes every request it sends, together with Telegram's response
+or error and the time it took, to a cassette. A ``ReplayClient`` answers the same
+requests from a cassette without connecting to Telegram, thus runs can be reproduced,
+profiled and benchmarked offline.
+
+Requests are matched by their serialized TL bytes, responses are stored as TL bytes as
+well. Identical requests are answered in the order they were recorded. The cassette
+also holds the entities cached by the recording session, which replays need to
+resolve members to input peers without requests. Cassettes are gzip-compressed.
+"""
+import asyncio
+import gzip
+import json
+import struct
+import time
+from collections import deque
+from pathlib import Path
+from typing import IO, Any, Deque, Dict, List, NamedTuple, Optional
+
+import telethon
+from loguru import logger as log
+from telethon import TelegramClient
+from telethon.extensions import BinaryReader
+from telethon.sessions import MemorySession, Session, SQLiteSession
+from telethon.tl.tlobject import TLObject
+
+RESULT = 0
+ERROR = 1
+ENTITIES = 2
+_HEADER = struct.Struct("<BdII")
+"""Entry header: kind, seconds until the response arrived, request and payload size."""
+_VECTOR = 0x1CB5C415
+_BOOLS = {True: 0x997275B5, False: 0xBC799737}
+
+
+class CassetteMiss(LookupError):
+    """A request was not recorded in the cassette."""
+
+
+class Entry(NamedTuple):
+    """A recorded response."""
+
+    kind: int
+    delay: float
+    payload: bytes
+
+
+def encode_result(result: Any) -> Optional[bytes]:
+    """Serialize a response to TL bytes, None if it is of an unsupported type."""
+    if isinstance(result, bool):
+        return struct.pack("<I", _BOOLS[result])
+    if isinstance(result, TLObject):
+        return bytes(result)
+    if isinstance(result, list) and all(isinstance(x, TLObject) for x in result):
+        return struct.pack("<Ii", _VECTOR, len(result)) + b"".join(
+            bytes(item) for item in result
+        )
+    return None
+
+
+def encode_error(error: telethon.errors.RPCError) -> bytes:
+    """Serialize an RPC error to its class name and arguments."""
+    _, args = error.__reduce__()
+    return json.dumps([type(error).__name__, list(args[1:])]).encode("utf8")
+
+
+def decode_error(payload: bytes, request: TLObject) -> telethon.errors.RPCError:
+    """Reconstruct an RPC error serialized by ``encode_error``."""
+    name, args = json.loads(payload)
+    error_class = getattr(telethon.errors, name, telethon.errors.RPCError)
+    return error_class(request, *args)
+
+
+class Cassette:
+    """Recorded requests and responses.
+
+    Args:
+        path: the cassette file.
+        entries: recorded responses by serialized request.
+        entities: entity rows of the recording session.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        entries: Optional[Dict[bytes, Deque[Entry]]] = None,
+        entities: Optional[List[tuple]] = None,
+    ) -> None:
+        self.path = path
+        self.entries = entries or {}
+        self.entities = entities or []
+        self._file: Optional[IO[bytes]] = None
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        """Read a cassette, a truncated final entry is ignored."""
+        entries: Dict[bytes, Deque[Entry]] = {}
+        entities: List[tuple] = []
+        with gzip.open(path, "rb") as file:
+            while True:
+                try:
+                    header = file.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    kind, delay, request_size, payload_size = _HEADER.unpack(header)
+                    request = file.read(request_size)
+                    payload = file.read(payload_size)
+                except EOFError:
+                    log.warning(f"{path} is truncated, replaying the complete part.")
+                    break
+                if len(payload) < payload_size:
+                    break
+                if kind == ENTITIES:
+                    entities.extend(tuple(row) for row in json.loads(payload))
+                    continue
+                entries.setdefault(request, deque()).append(Entry(kind, delay, payload))
+        return cls(path, entries, entities)
+
+    def start(self, session: Session) -> None:
+        """Start recording into the cassette's file, replacing its contents.
+
+        Args:
+            session: the recording client's session, its cached entities are stored.
+        """
+        self._file = gzip.open(self.path, "wb")  # pylint: disable=consider-using-with
+        payload = json.dumps(session_entities(session)).encode("utf8")
+        self._write(ENTITIES, 0.0, b"", payload)
+
+    def record(self, request: bytes, kind: int, delay: float, payload: bytes) -> None:
+        """Append a response to the cassette."""
+        if self._file is not None:
+            self._write(kind, delay, request, payload)
+
+    def _write(self, kind: int, delay: float, request: bytes, payload: bytes) -> None:
+        assert self._file is not None
+        self._file.write(_HEADER.pack(kind, delay, len(request), len(payload)))
+        self._file.write(request)
+        self._file.write(payload)
+
+    def next(self, request: bytes) -> Entry:
+        """Take the next recorded response to a request."""
+        entries = self.entries.get(request)
+        if not entries:
+            raise CassetteMiss("Request not found in the cassette.")
+        return entries.popleft()
+
+    def close(self) -> None:
+        """Finish recording."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def request_key(request: TLObject) -> bytes:
+    """Serialize a request to match it, regardless of whether updates are received."""
+    if isinstance(request, telethon.functions.InvokeWithoutUpdatesRequest):
+        request = request.query
+    return bytes(request)
+
+
+def session_entities(session: Session) -> List[tuple]:
+    """Get the rows of the entities cached in a session."""
+    if isinstance(session, SQLiteSession):
+        # pylint: disable=protected-access
+        cursor = session._cursor()
+        try:
+            return cursor.execute(
+                "SELECT id, hash, username, phone, name FROM entities"
+            ).fetchall()
+        finally:
+            cursor.close()
+    return list(getattr(session, "_entities", []))
+
+
+class _RecordingSender:  # pylint: disable=too-few-public-methods
+    """Wrap a sender to record the responses to the requests sent through it."""
+
+    def __init__(self, sender, cassette: Cassette) -> None:
+        self.sender = sender
+        self.cassette = cassette
+
+    def send(self, request, ordered=False):
+        """Send a request and record its response once it arrives."""
+        futures = self.sender.send(request, ordered=ordered)
+        if isinstance(futures, list):
+            return [
+                self._record(single, future) for single, future in zip(request, futures)
+            ]
+        return self._record(request, futures)
+
+    def _record(self, request, future) -> asyncio.Future:
+        async def _await():
+            start = time.monotonic()
+            key = request_key(request)
+            try:
+                result = await future
+            except telethon.errors.RPCError as error:
+                delay = time.monotonic() - start
+                self.cassette.record(key, ERROR, delay, encode_error(error))
+                raise
+            payload = encode_result(result)
+            if payload is None:
+                log.warning(f"Cannot record the response to {type(request).__name__}.")
+            else:
+                delay = time.monotonic() - start
+                self.cassette.record(key, RESULT, delay, payload)
+            return result
+
+        return asyncio.ensure_future(_await())
+
+
+class _ReplaySender:
+    """Stand-in for a sender answering requests from a cassette."""
+
+    def __init__(self, cassette: Cassette, speed: float) -> None:
+        self.cassette = cassette
+        self.speed = speed
+        self.connected = False
+
+    def is_connected(self) -> bool:
+        """Mimic MTProtoSender.is_connected."""
+        return self.connected
+
+    async def disconnect(self) -> None:
+        """Mimic MTProtoSender.disconnect."""
+        self.connected = False
+
+    def send(self, request, ordered=False):  # pylint: disable=unused-argument
+        """Answer a request with its next recorded response."""
+        if isinstance(request, list):
+            return [self._replay(single) for single in request]
+        return self._replay(request)
+
+    def _replay(self, request) -> asyncio.Future:
+        entry = self.cassette.next(request_key(request))
+
+        async def _await():
+            if self.speed > 0:
+                await asyncio.sleep(entry.delay / self.speed)
+            if entry.kind == ERROR:
+                raise decode_error(entry.payload, request)
+            return BinaryReader(entry.payload).tgread_object()
+
+        return asyncio.ensure_future(_await())
+
+
+class RecordingClient(TelegramClient):
+    """TelegramClient recording all responses into a cassette.
+
+    Recording starts with ``record``, which should be called before connecting.
+    """
+
+    cassette: Optional[Cassette] = None
+
+    def record(self, cassette: Cassette) -> None:
+        """Record into ``cassette``."""
+        cassette.start(self.session)
+        self.cassette = cassette
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        if self.cassette is not None:
+            sender = _RecordingSender(sender, self.cassette)
+        return await super()._call(
+            sender,
+            request,
+            ordered=ordered,
+            flood_sleep_threshold=flood_sleep_threshold,
+        )
+
+
+class ReplayClient(TelegramClient):
+    """TelegramClient answering all requests from a cassette.
+
+    Args:
+        cassette: the recorded responses.
+        speed: factor the recorded response times are divided by, 0 to not wait.
+    """
+
+    def __init__(self, cassette: Cassette, speed: float = 1.0) -> None:
+        session = MemorySession()
+        session._entities.update(cassette.entities)  # pylint: disable=protected-access
+        super().__init__(session, 1, "replay")
+        self._sender = _ReplaySender(cassette, speed)
+
+    async def connect(self) -> None:
+        # pylint: disable=attribute-defined-outside-init
+        self._loop = asyncio.get_running_loop()
+        self._sender.connected = True
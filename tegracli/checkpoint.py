@@ -0,0 +1,82 @@
+"""Checkpoints for resumable hydrations.
+
+A checkpoint is a JSONL file with one record per completed chunk of message ids,
+listing the ids that were retrieved and the ids Telegram did not return a message for.
+Once loaded, the ids are kept in compact ``IdSet``s per channel.
+"""
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import ujson
+
+from .idset import IdSet
+
+CHUNK_SIZE = 100
+"""Number of message ids requested at once, the maximum Telegram accepts."""
+
+# pylint: disable=c-extension-no-member
+
+
+class HydrateCheckpoint:
+    """Keep track of message ids that were already hydrated.
+
+    Args:
+        path: path of the checkpoint file, if None nothing is persisted.
+    """
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self.path = path
+        self.done: Dict[str, IdSet] = {}
+        self.missing: Dict[str, IdSet] = {}
+        if path is not None and path.exists():
+            with path.open("r", encoding="utf8") as file:
+                for line in file:
+                    if line.strip():
+                        record = ujson.loads(line)
+                        self._add(record["channel"], record["done"], record["missing"])
+
+    @property
+    def resumed(self) -> bool:
+        """Whether any chunk was completed before."""
+        return bool(self.done or self.missing)
+
+    def _add(self, channel: str, done: List[int], missing: List[int]) -> None:
+        self.done.setdefault(channel, IdSet()).update(done)
+        self.missing.setdefault(channel, IdSet()).update(missing)
+
+    def pending(self, channel: str, post_ids: Sequence[int]) -> array:
+        """Filter out ids already hydrated or known to be missing.
+
+        Args:
+            channel: the channel the ids belong to.
+            post_ids: the requested ids.
+
+        Returns:
+            array : sorted and deduplicated ids still to hydrate.
+        """
+        done = self.done.get(channel, IdSet())
+        missing = self.missing.get(channel, IdSet())
+        return missing.difference(done.difference(post_ids))
+
+    def mark_done(self, channel: str, post_ids: List[int], missing: List[int]) -> None:
+        """Record a completed chunk.
+
+        Args:
+            channel: the channel the ids belong to.
+            post_ids: all ids of the chunk.
+            missing: ids Telegram did not return a message for.
+        """
+        missing = list(missing)
+        done = sorted(set(post_ids) - set(missing))
+        self._add(channel, done, missing)
+        if self.path is not None:
+            with self.path.open("a", encoding="utf8") as file:
+                ujson.dump({"channel": channel, "done": done, "missing": missing}, file)
+                file.write("\n")
+
+
+def chunked(post_ids: Sequence[int], size: int = CHUNK_SIZE) -> Iterator[List[int]]:
+    """Split ids into lists of at most ``size`` ids."""
+    for start in range(0, len(post_ids), size):
+        yield list(post_ids[start : start + size])
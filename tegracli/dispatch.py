@@ -1,14 +1,15 @@
 """Dispatch functions that request data from Telethon and MTProto."""
+import asyncio
 import datetime
 import sys
 import time
+from contextlib import AsyncExitStack
 from functools import partial
 from io import TextIOWrapper
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import telethon
-import ujson
 from loguru import logger as log
 from telethon import TelegramClient
 from telethon.errors import (
@@ -19,55 +20,182 @@ from telethon.errors import (
     UsernameNotOccupiedError,
 )
 
-from .types import MessageHandler
+from .checkpoint import chunked
+from .encoding import EncodingPool, encode_message
+from .fileio import QueuedWriter, opened, run_io
+from .gaps import Runs
+from .pacing import paced, pacer_for
+from .profiling import span, timed
+from .sink import Sink
+from .storage import JSONLStorage, MessageWriter, Storage, as_writer
+from .types import ChunkHandler, MessageHandler
 from .utilities import str_dict
 
 # pylint: disable=I1101  # c-extensions-no-member; we know it's there and that's why we don't
 # want to see it
 
+BACKFILL_BY_IDS = 300
+"""Gaps smaller than this are requested by their ids rather than by an id range."""
+RESOLVE_BATCH_SIZE = 100
+"""Number of IDs resolved with a single request."""
+BATCH_SIZE = 100
+"""Number of messages passed to chunk handlers at once, Telegram returns 100 per request."""
 
-async def dispatch_iter_messages(
-    client: TelegramClient, params: Dict, callback: MessageHandler
-) -> None:
-    """Dispatch a TG-method with callback.
+
+async def dispatch_iter_chunks(
+    client: TelegramClient,
+    params: Dict,
+    callback: ChunkHandler,
+    batch_size: int = BATCH_SIZE,
+) -> bool:
+    """Dispatch a TG-method, passing the messages to the callback in chunks.
+
+    Requests are paced by the client's ``Pacer``, which starts without pauses and
+    backs off as flood waits occur. Messages received before an error are passed to
+    the callback as well.
 
     Args:
         client: the client to use.
         params: the parameters to pass to the method.
-        callback: the callback to pass data to.
+        callback: the callback to pass lists of messages to.
+        batch_size: maximal number of messages per list.
+
+    Returns:
+        bool : False if the retrieval was aborted by an error.
     """
+    pacer = pacer_for(client)
+    batch: List[telethon.types.Message] = []
+
+    async def _flush():
+        nonlocal batch
+        chunk, batch = batch, []
+        if chunk:
+            await callback(chunk)
+
     try:
-        async for message in client.iter_messages(wait_time=10, **params):
-            await callback(message)
+        try:
+            async for message in timed(
+                paced(
+                    client.iter_messages(wait_time=pacer.wait, **params), pacer, client
+                ),
+                "fetch",
+            ):
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    await _flush()
+        finally:
+            await _flush()
     except UserDeactivatedError:
         log.error("User account has been deactivated by Telegram. Stopping now.")
         sys.exit(127)
     except UsernameNotOccupiedError:
         log.error(f"Entity {params['entity']} does not exist. Skipping.")
+        return False
     except ChannelPrivateError:
         log.error(f"Entity {params['entity']} is private. Skipping.")
+        return False
     except RPCError as err:
         log.error(f"RPCError occurred: {err}")
+        return False
+    return True
+
+
+async def dispatch_iter_messages(
+    client: TelegramClient, params: Dict, callback: MessageHandler
+) -> bool:
+    """Dispatch a TG-method with callback.
+
+    Args:
+        client: the client to use.
+        params: the parameters to pass to the method.
+        callback: the callback to pass data to.
+
+    Returns:
+        bool : False if the retrieval was aborted by an error.
+    """
 
+    async def _each(messages: List[telethon.types.Message]):
+        for message in messages:
+            await callback(message)
+
+    return await dispatch_iter_chunks(client, params, _each)
 
-async def dispatch_get(users, client: TelegramClient, params: Dict):
-    """Get the message history of a specified set of users."""
+
+async def dispatch_get(  # pylint: disable=too-many-arguments
+    users,
+    client: TelegramClient,
+    params: Dict,
+    pool: Optional[EncodingPool] = None,
+    fields: Optional[List[str]] = None,
+    inject_user: bool = True,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    sink: Optional[Sink] = None,
+):
+    """Get the message history of a specified set of users.
+
+    Args:
+        users: ids or handles of the users to get.
+        client: the client to use.
+        params: the parameters to pass to ``iter_messages``.
+        pool: encode messages in this pool instead of the event loop.
+        fields: dotted paths of the fields to keep, None to keep all fields.
+        inject_user: add the user's profile to each message, otherwise it is
+            stored once in ``profiles.jsonl``.
+        since: only get messages sent at or after this date.
+        until: only get messages sent before this date.
+        sink: stream messages to this sink instead of ``<id>.jsonl`` files.
+    """
+    profiles = JSONLStorage(Path())
     for user in users:
         done = False
         while done is False:
             try:
                 if str.isnumeric(user):
                     user = int(user)
-                other = await client.get_entity(user)  # see https://limits.tginfo.me/en
+                with span("entity"):
+                    other = await client.get_entity(
+                        user
+                    )  # see https://limits.tginfo.me/en
                 o_dict = str_dict(other.to_dict())
                 _params = params.copy()
                 _params["entity"] = other
-                with Path(f"{other.id}.jsonl").open("a", encoding="utf8") as file:
-                    await dispatch_iter_messages(
-                        client,
-                        _params,
-                        partial(handle_message, file=file, injects={"user": o_dict}),
+                bounds = await resolve_date_bounds(client, other, since, until)
+                if bounds is None:
+                    log.info(f"{user} has no messages in the requested period.")
+                    done = True
+                    continue
+                if "min_id" in bounds:
+                    _params["min_id"] = max(bounds["min_id"], _params.get("min_id", 0))
+                if "max_id" in bounds:
+                    _params["max_id"] = min(
+                        bounds["max_id"], _params.get("max_id") or sys.maxsize
+                    )
+                injects = {"user": o_dict} if inject_user else None
+                if (
+                    not inject_user
+                    and await run_io(profiles.get_profile, str(other.id)) is None
+                ):
+                    await run_io(profiles.add_profile, o_dict)
+                async with AsyncExitStack() as stack:
+                    writer = await _open_output(
+                        stack, Path(f"{other.id}.jsonl"), sink, "get", str(other.id)
                     )
+                    handler = (
+                        None if pool is None else pool.handler(writer, injects, fields)
+                    )
+                    callback = (
+                        partial(
+                            handle_messages, file=writer, injects=injects, fields=fields
+                        )
+                        if handler is None
+                        else handler.extend
+                    )
+                    try:
+                        await dispatch_iter_chunks(client, _params, callback)
+                    finally:
+                        if handler is not None:
+                            await handler.flush()
             except FloodWaitError as err:
                 delta = datetime.timedelta(seconds=err.seconds)
                 log.error(f"FloodWaitError occurred. Waiting for {delta} to resume.")
@@ -80,33 +208,174 @@ async def dispatch_get(users, client: TelegramClient, params: Dict):
             done = True
 
 
+async def _open_output(
+    stack: AsyncExitStack, path: Path, sink: Optional[Sink], source: str, member: str
+) -> MessageWriter:
+    """Open the output of a member, a file or a sink, written in the I/O executor."""
+    if sink is not None:
+        writer = QueuedWriter(sink.writer(source, member))
+    else:
+        file = await stack.enter_async_context(opened(path.open, "a", encoding="utf8"))
+        writer = QueuedWriter(as_writer(file))
+    stack.push_async_callback(writer.aclose)
+    return writer
+
+
+async def resolve_date(
+    client: TelegramClient, entity, date: datetime.datetime
+) -> Optional[int]:
+    """Find the id of the last message sent before a date.
+
+    Args:
+        client: the client to use.
+        entity: the chat to look into.
+        date: the date.
+
+    Returns:
+        Optional[int] : the message's id, None if there is no message before ``date``.
+    """
+    async for message in timed(
+        client.iter_messages(entity, offset_date=date, limit=1), "fetch"
+    ):
+        return message.id
+    return None
+
+
+async def resolve_date_bounds(
+    client: TelegramClient,
+    entity,
+    since: Optional[datetime.datetime],
+    until: Optional[datetime.datetime],
+) -> Optional[Dict[str, int]]:
+    """Translate a period into ``min_id``/``max_id`` parameters for ``iter_messages``.
+
+    Telegram then only returns messages within the period and stops as soon as it is
+    left, rather than every message before or after an ``offset_date``.
+
+    Args:
+        client: the client to use.
+        entity: the chat to look into.
+        since: start of the period, inclusive.
+        until: end of the period, exclusive.
+
+    Returns:
+        Optional[Dict[str, int]] : the parameters, None if the period has no messages.
+    """
+    bounds: Dict[str, int] = {}
+    if until is not None:
+        last_id = await resolve_date(client, entity, until)
+        if last_id is None:
+            return None
+        bounds["max_id"] = last_id + 1
+    if since is not None:
+        before_id = await resolve_date(client, entity, since)
+        if before_id is not None:
+            bounds["min_id"] = before_id
+    if bounds.get("min_id", 0) + 1 >= bounds.get("max_id", sys.maxsize):
+        return None
+    return bounds
+
+
 async def dispatch_hydrate(
     channel: str,
-    post_ids: List[str],
-    output_file: TextIOWrapper,
+    post_ids: List[int],
+    output_file: Union[TextIOWrapper, MessageWriter],
     client: TelegramClient,
-):
-    """Dispatch a hydration by channel_id/post_id."""
-    await dispatch_iter_messages(
-        client,
-        {"entity": channel, "ids": post_ids},
-        partial(handle_message, file=output_file, injects=None),
+) -> Optional[List[int]]:
+    """Dispatch a hydration by channel_id/post_id.
+
+    Returns:
+        Optional[List[int]] : ids Telegram returned no message for,
+            None if the hydration was aborted by an error.
+    """
+    missing: List[int] = []
+    requested = iter(post_ids)
+
+    async def _handle(message: Optional[telethon.types.Message]):
+        # messages are returned in the order of the requested ids
+        post_id = next(requested, None)
+        if message is None:
+            log.debug(f"Message {channel}/{post_id} is not available.")
+            missing.append(post_id)  # type: ignore
+            return
+        await handle_message(message, file=output_file, injects=None)
+
+    success = await dispatch_iter_messages(
+        client, {"entity": channel, "ids": post_ids}, _handle
     )
+    return missing if success else None
+
+
+async def dispatch_backfill(
+    client: TelegramClient,
+    entity: telethon.types.TypeInputPeer,
+    gaps: Runs,
+    callback: MessageHandler,
+) -> Optional[List[int]]:
+    """Retrieve the messages missing in a history.
+
+    Small gaps are requested by their ids, large gaps by ``min_id``/``max_id``.
+
+    Args:
+        client: the client to use.
+        entity: the entity whose history is backfilled.
+        gaps: runs of missing ids.
+        callback: the callback to pass data to.
+
+    Returns:
+        Optional[List[int]] : the ids retrieved, None if aborted by an error.
+    """
+    received: List[int] = []
+
+    async def _handle(message: Optional[telethon.types.Message]):
+        if message is None:
+            return
+        received.append(message.id)
+        await callback(message)
+
+    for first, last in gaps:
+        if last - first < BACKFILL_BY_IDS:
+            requests = [
+                {"entity": entity, "ids": chunk}
+                for chunk in chunked(list(range(first, last + 1)))
+            ]
+        else:
+            requests = [
+                {
+                    "entity": entity,
+                    "min_id": first - 1,
+                    "max_id": last + 1,
+                    "reverse": True,
+                }
+            ]
+        for params in requests:
+            if not await dispatch_iter_messages(client, params, _handle):
+                return None
+    return received
+
 
+async def dispatch_search(
+    queries: List[str], client: TelegramClient, sink: Optional[Sink] = None
+):
+    """Dispatch a global search.
 
-async def dispatch_search(queries: List[str], client: TelegramClient):
-    """Dispatch a global search."""
+    Args:
+        queries: the search terms.
+        client: the client to use.
+        sink: stream messages to this sink instead of ``<query>.jsonl`` files.
+    """
     local_account = await client.get_me()
     log.info(f"Using telegram account of {local_account.username}")
     for query in queries:
         try:
-            async for message in client.iter_messages(None, search=query, limit=15):
-                with Path(f"{query}.jsonl").open("a", encoding="utf8") as file:
-                    m_dict = message.to_dict()
-                    ujson.dump(  # pylint: disable=c-extension-no-member
-                        str_dict(m_dict), file
-                    )
-                    file.write("\n")
+            async with AsyncExitStack() as stack:
+                writer = await _open_output(
+                    stack, Path(f"{query}.jsonl"), sink, "search", query
+                )
+                async for message in timed(
+                    client.iter_messages(None, search=query, limit=15), "fetch"
+                ):
+                    await handle_message(message, writer, injects=None)
         except ValueError as error:
             log.error(f"No dice for {query}, because {error}")
             continue
@@ -114,27 +383,128 @@ async def dispatch_search(queries: List[str], client: TelegramClient):
 
 async def handle_message(
     message: Optional[telethon.types.Message],
-    file: TextIOWrapper,
+    file: Union[TextIOWrapper, MessageWriter],
     injects: Optional[Dict],
+    fields: Optional[List[str]] = None,
 ):
     """Accept incoming messages and log them to disk.
 
     Args:
         message: incoming single message.
-        file: opened file to dump the message's json into.
+        file: opened file or storage writer to dump the message's json into.
         injects: additional data to inject into the message.
+        fields: dotted paths of the fields to keep, None to keep all fields.
     """
     if message is None:
         log.error("Message is None. Skipping.")
         return
 
-    m_dict = str_dict(message.to_dict())
-    if injects is not None:
-        for key, value in injects.items():
-            m_dict[key] = value
+    writer = as_writer(file)
+    with span("serialize"):
+        encoded = encode_message(message.to_dict(), injects, fields)
+    with span("write"):
+        writer.write_encoded(*encoded)
+    await writer.drain()
+
+
+async def handle_messages(
+    messages: List[telethon.types.Message],
+    file: Union[TextIOWrapper, MessageWriter],
+    injects: Optional[Dict],
+    fields: Optional[List[str]] = None,
+):
+    """Accept a chunk of incoming messages and log them to disk.
+
+    Args:
+        messages: incoming messages.
+        file: opened file or storage writer to dump the messages' json into.
+        injects: additional data to inject into each message.
+        fields: dotted paths of the fields to keep, None to keep all fields.
+    """
+    with span("serialize"):
+        encoded = [
+            encode_message(message.to_dict(), injects, fields)
+            for message in messages
+            if message is not None
+        ]
+    if len(encoded) < len(messages):
+        log.error(f"{len(messages) - len(encoded)} messages are None. Skipping.")
+    writer = as_writer(file)
+    with span("write"):
+        writer.write_many(encoded)
+    await writer.drain()
+
 
-    ujson.dump(m_dict, file, ensure_ascii=True)
-    file.write("\n")
+async def dispatch_resolve(
+    client: TelegramClient,
+    accounts: List[str],
+    concurrency: int = 4,
+    batch_size: int = RESOLVE_BATCH_SIZE,
+) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """Resolve accounts to their profiles.
+
+    IDs are requested in batches, handles one by one, at most ``concurrency``
+    requests at once. Resolving stops at the first FloodWaitError the client does not
+    sleep through, accounts not resolved by then are neither returned as profile
+    nor as failure.
+
+    Args:
+        client: the client to use.
+        accounts: normalized handles and IDs.
+        concurrency: number of requests sent at once.
+        batch_size: number of IDs requested at once.
+
+    Returns:
+        Tuple[Dict[str, Dict], Dict[str, str]] : profiles by account and the reasons
+            why accounts could not be resolved by account.
+    """
+    profiles: Dict[str, Dict] = {}
+    failures: Dict[str, str] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    flooded = False
+
+    async def _attempt(batch: List[str]) -> bool:
+        """Resolve a batch, False if it failed as a whole."""
+        nonlocal flooded
+        if flooded:
+            return True
+        try:
+            with span("entity"):
+                entities = await client.get_entity(
+                    [
+                        int(account) if account.isdigit() else account
+                        for account in batch
+                    ]
+                )
+        except (FloodWaitError, telethon.errors.FloodError) as error:
+            log.warning(f"Stopped resolving accounts due to {error}")
+            flooded = True
+            return True
+        except (ValueError, RPCError) as error:
+            if len(batch) > 1:
+                return False
+            failures[batch[0]] = (
+                (error.message or "RPCError")
+                if isinstance(error, RPCError)
+                else "ValueError"
+            )
+            return True
+        for account, entity in zip(batch, entities):
+            profiles[account] = str_dict(entity.to_dict())
+        return True
+
+    async def _resolve(batch: List[str]):
+        async with semaphore:
+            if not await _attempt(batch):
+                # a single account fails the whole batch, resolve them one by one
+                for account in batch:
+                    await _attempt([account])
+
+    ids = [account for account in accounts if account.isdigit()]
+    batches = [[account] for account in accounts if not account.isdigit()]
+    batches.extend(chunked(ids, batch_size))
+    await asyncio.gather(*(_resolve(batch) for batch in batches))
+    return profiles, failures
 
 
 async def get_input_entity(
@@ -149,11 +519,15 @@ async def get_input_entity(
     Returns:
         Optional[telethon.types.TypeInputPeer] : returns the requested entity or None
     """
-    return await client.get_input_entity(member_id)
+    with span("entity"):
+        return await client.get_input_entity(member_id)
 
 
 async def get_profile(
-    client: TelegramClient, member: str, group_name: str
+    client: TelegramClient,
+    member: str,
+    group_name: str,
+    storage: Optional[Storage] = None,
 ) -> Optional[Dict[str, str]]:
     """Returns a Dict from the requested entity.
 
@@ -161,12 +535,13 @@ async def get_profile(
         client: signed in TG client.
         member: id/handle/URL of the entity to request.
         group_name: name of the group to save the profile to.
+        storage: the group's storage backend, defaults to the group's profiles.jsonl.
     """
     _member = int(member) if str.isnumeric(member) else member
-    profile = await client.get_entity(_member)
+    with span("entity"):
+        profile = await client.get_entity(_member)
     p_dict: Dict[str, str] = str_dict(profile.to_dict())
-    with (Path(group_name) / "profiles.jsonl").open("a") as profiles:
-        ujson.dump(p_dict, profiles)
-        profiles.write("\n")
+    with span("write"):
+        await run_io((storage or JSONLStorage(Path(group_name))).add_profile, p_dict)
 
     return p_dict
@@ -0,0 +1,175 @@
+"""Encode messages to JSON in a pool of worker processes.
+
+Converting messages with ``to_dict``, ``str_dict`` and ``ujson`` is CPU-bound and
+blocks the event loop. An ``EncodingPool`` sends the messages' raw TL bytes to worker
+processes in batches and writes the encoded messages in the order they were received.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional
+
+import telethon
+import ujson
+from loguru import logger as log
+from telethon.extensions import BinaryReader
+
+from .fields import project
+from .profiling import span
+from .storage import EncodedMessage, MessageWriter
+from .utilities import str_dict
+
+# pylint: disable=c-extension-no-member
+
+
+def encode_message(
+    m_dict: Dict, injects: Optional[Dict], fields: Optional[List[str]] = None
+) -> EncodedMessage:
+    """Convert and encode a message dict to JSON.
+
+    Args:
+        m_dict: the message, as returned by ``to_dict``.
+        injects: additional data to inject into the message.
+        fields: dotted paths of the fields to keep, None to keep all fields.
+
+    Returns:
+        EncodedMessage : the message's id, date and JSON.
+    """
+    m_dict = str_dict(project(m_dict, fields))
+    if injects is not None:
+        for key, value in injects.items():
+            m_dict[key] = value
+    return (
+        int(m_dict["id"]),
+        m_dict.get("date"),
+        ujson.dumps(m_dict, ensure_ascii=True),
+    )
+
+
+def encode_batch(
+    batch: List[bytes], injects: Optional[Dict], fields: Optional[List[str]] = None
+) -> List[EncodedMessage]:
+    """Decode a batch of raw TL messages and encode them to JSON.
+
+    Args:
+        batch: the messages' raw TL bytes.
+        injects: additional data to inject into each message.
+        fields: dotted paths of the fields to keep, None to keep all fields.
+
+    Returns:
+        List[EncodedMessage] : the encoded messages in the order of ``batch``.
+    """
+    return [
+        encode_message(BinaryReader(data).tgread_object().to_dict(), injects, fields)
+        for data in batch
+    ]
+
+
+class EncodingPool:
+    """Pool of workers encoding messages.
+
+    Args:
+        workers: number of worker processes.
+        batch_size: number of messages sent to a worker at once.
+        threads: use threads instead of processes.
+    """
+
+    def __init__(self, workers: int, batch_size: int = 100, threads: bool = False):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor: Executor = (
+            ThreadPoolExecutor(workers) if threads else ProcessPoolExecutor(workers)
+        )
+
+    def handler(
+        self,
+        file: MessageWriter,
+        injects: Optional[Dict] = None,
+        fields: Optional[List[str]] = None,
+    ) -> "PooledHandler":
+        """Create a message handler writing to ``file``.
+
+        Args:
+            file: the writer to write encoded messages to.
+            injects: additional data to inject into each message.
+            fields: dotted paths of the fields to keep, None to keep all fields.
+
+        Returns:
+            PooledHandler : the handler, must be flushed when done.
+        """
+        return PooledHandler(self, file, injects, fields)
+
+    def shutdown(self) -> None:
+        """Stop the workers."""
+        self.executor.shutdown()
+
+    def __enter__(self) -> "EncodingPool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+
+class PooledHandler:
+    """Message handler that encodes messages in an ``EncodingPool``.
+
+    At most two batches per worker are in flight, further messages wait for the
+    oldest batch to be written, which applies backpressure to the retrieval.
+    """
+
+    def __init__(
+        self,
+        pool: EncodingPool,
+        file: MessageWriter,
+        injects: Optional[Dict],
+        fields: Optional[List[str]],
+    ) -> None:
+        self.pool = pool
+        self.file = file
+        self.injects = injects
+        self.fields = fields
+        self._batch: List[bytes] = []
+        self._pending: Deque[asyncio.Future] = deque()
+
+    async def __call__(self, message: Optional[telethon.types.Message]) -> None:
+        await self.extend([message])
+
+    async def extend(self, messages: List[Optional[telethon.types.Message]]) -> None:
+        """Handle a chunk of messages."""
+        for message in messages:
+            if message is None:
+                log.error("Message is None. Skipping.")
+                continue
+            self._batch.append(bytes(message))
+            if len(self._batch) >= self.pool.batch_size:
+                self._submit()
+        while len(self._pending) > 2 * self.pool.workers:
+            await self._write_oldest()
+
+    def _submit(self) -> None:
+        if not self._batch:
+            return
+        loop = asyncio.get_event_loop()
+        self._pending.append(
+            loop.run_in_executor(
+                self.pool.executor,
+                encode_batch,
+                self._batch,
+                self.injects,
+                self.fields,
+            )
+        )
+        self._batch = []
+
+    async def _write_oldest(self) -> None:
+        with span("serialize"):
+            batch = await self._pending.popleft()
+        with span("write"):
+            self.file.write_many(batch)
+        await self.file.drain()
+
+    async def flush(self) -> None:
+        """Encode and write all remaining messages."""
+        self._submit()
+        while self._pending:
+            await self._write_oldest()
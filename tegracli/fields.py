@@ -0,0 +1,94 @@
+"""Select the fields of messages to store.
+
+Fields are given as dotted paths into the message dict, e.g. ``replies.replies``.
+If a path runs into a list, the rest of the path is applied to each of its elements.
+Instead of paths, one of the predefined profiles in ``PROFILES`` can be used.
+"""
+from typing import Any, Dict, List, Optional
+
+MINIMAL = ["_", "id", "peer_id", "date", "message", "from_id"]
+RESEARCH = [
+    *MINIMAL,
+    "post",
+    "pinned",
+    "fwd_from",
+    "reply_to",
+    "media._",
+    "entities",
+    "views",
+    "forwards",
+    "replies.replies",
+    "edit_date",
+    "post_author",
+    "grouped_id",
+    "reactions",
+]
+
+PROFILES: Dict[str, Optional[List[str]]] = {
+    "minimal": MINIMAL,
+    "research": RESEARCH,
+    "full": None,
+}
+"""Predefined field selections, ``full`` keeps the entire message."""
+
+
+def parse_fields(spec: Optional[str]) -> Optional[List[str]]:
+    """Parse a field specification.
+
+    Args:
+        spec: name of a profile or comma-separated dotted paths.
+
+    Returns:
+        Optional[List[str]] : the selected paths, None to keep all fields.
+    """
+    if spec is None:
+        return None
+    if spec in PROFILES:
+        return PROFILES[spec]
+    fields = [field.strip() for field in spec.split(",") if field.strip()]
+    if "id" not in fields:
+        # the id is required to resume and deduplicate
+        fields.insert(0, "id")
+    return fields
+
+
+def _select(data: Any, path: List[str]) -> Any:
+    if isinstance(data, list):
+        return [_select(item, path) for item in data]
+    if not path or not isinstance(data, dict):
+        return data
+    key, *rest = path
+    if key not in data:
+        return {}
+    return {key: _select(data[key], rest)}
+
+
+def _merge(target: Dict, source: Dict) -> None:
+    for key, value in source.items():
+        present = target.get(key)
+        if isinstance(value, dict) and isinstance(present, dict):
+            _merge(present, value)
+        elif isinstance(value, list) and isinstance(present, list):
+            for present_item, item in zip(present, value):
+                if isinstance(present_item, dict) and isinstance(item, dict):
+                    _merge(present_item, item)
+        else:
+            target[key] = value
+
+
+def project(m_dict: Dict, fields: Optional[List[str]]) -> Dict:
+    """Reduce a message dict to the selected fields.
+
+    Args:
+        m_dict: the message dict.
+        fields: dotted paths of the fields to keep, None to keep all fields.
+
+    Returns:
+        Dict : the reduced message dict.
+    """
+    if fields is None:
+        return m_dict
+    result: Dict = {}
+    for field in fields:
+        _merge(result, _select(m_dict, field.split(".")))
+    return result
@@ -0,0 +1,177 @@
+"""Perform file I/O in threads so slow disks do not stall the event loop.
+
+Writes to a slow disk, e.g. an archive on NFS, block the thread issuing them. On the
+event loop thread that pauses every request in flight. Opening files, writing,
+flushing and scanning them is thus handed to a small executor of I/O threads while
+the event loop keeps on retrieving messages.
+
+Operations on the same file go through a ``FileQueue``, which runs them one after
+another in the order they were submitted. Operations on different files run
+concurrently.
+"""
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Deque,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .storage import EncodedMessage, MessageWriter
+
+T = TypeVar("T")
+
+IO_THREADS = 4
+"""Number of threads performing file I/O."""
+MAX_PENDING = 16
+"""Number of writes a ``QueuedWriter`` buffers before its producer has to wait."""
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    """Get the I/O executor, it is started on first use."""
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="tegracli-io")
+        return _executor
+
+
+def in_event_loop() -> bool:
+    """Check whether an event loop is running in this thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+async def run_io(function: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking I/O function in the I/O executor and wait for its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), partial(function, *args, **kwargs))
+
+
+@asynccontextmanager
+async def opened(
+    factory: Callable[..., ContextManager[T]], *args, **kwargs
+) -> AsyncIterator[T]:
+    """Create, enter and exit a context manager, e.g. a file, in the I/O executor.
+
+    Args:
+        factory: creates the context manager, e.g. ``Path.open``.
+        args: positional arguments of ``factory``.
+        kwargs: keyword arguments of ``factory``.
+    """
+    context = await run_io(factory, *args, **kwargs)
+    value = await run_io(context.__enter__)
+    try:
+        yield value
+    except BaseException as error:
+        if not await run_io(context.__exit__, type(error), error, error.__traceback__):
+            raise
+    else:
+        await run_io(context.__exit__, None, None, None)
+
+
+class FileQueue:
+    """Run the operations on a file in the I/O executor, one after another."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Deque[Tuple[Callable[[], object], Future]] = deque()
+        self._scheduled = False
+
+    def submit(self, function: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        """Queue an operation.
+
+        Returns:
+            Future : resolves to the operation's result once it ran.
+        """
+        future: "Future[T]" = Future()
+        with self._lock:
+            self._operations.append((partial(function, *args, **kwargs), future))
+            if not self._scheduled:
+                self._scheduled = True
+                executor().submit(self._drain)
+        return future
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                if not self._operations:
+                    self._scheduled = False
+                    return
+                operation, future = self._operations.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(operation())
+            except BaseException as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+
+
+class QueuedWriter(MessageWriter):
+    """Write messages in the I/O executor, in the order they were written.
+
+    Writes return immediately, ``drain`` waits while too many are pending. A write
+    that failed is raised by the next call. ``close`` waits for all writes and closes
+    the wrapped writer.
+
+    Args:
+        writer: the writer to write to.
+        max_pending: number of writes buffered before ``drain`` waits.
+    """
+
+    def __init__(self, writer: MessageWriter, max_pending: int = MAX_PENDING) -> None:
+        self.writer = writer
+        self.max_pending = max_pending
+        self._queue = FileQueue()
+        self._pending: Deque["Future[None]"] = deque()
+
+    def _submit(self, function: Callable[..., None], *args) -> None:
+        self._raise_failed()
+        self._pending.append(self._queue.submit(function, *args))
+
+    def _raise_failed(self) -> None:
+        while self._pending and self._pending[0].done():
+            self._pending.popleft().result()
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        self._submit(self.writer.write_encoded, message_id, date, data)
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        self._submit(self.writer.write_many, list(messages))
+
+    def flush(self) -> None:
+        self._submit(self.writer.flush)
+
+    async def drain(self) -> None:
+        while len(self._pending) > self.max_pending:
+            await asyncio.wrap_future(self._pending.popleft())
+
+    async def join(self) -> None:
+        """Wait for all pending writes."""
+        while self._pending:
+            await asyncio.wrap_future(self._pending.popleft())
+
+    async def aclose(self) -> None:
+        """Wait for all writes and close the wrapped writer without blocking."""
+        self._submit(self.writer.close)
+        await self.join()
+
+    def close(self) -> None:
+        self._submit(self.writer.close)
+        while self._pending:
+            self._pending.popleft().result()
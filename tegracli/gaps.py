@@ -0,0 +1,63 @@
+"""Handle sets of message ids as runs of consecutive ids.
+
+A run is a ``[first, last]`` pair, both inclusive. Lists of runs are kept sorted
+and disjoint, which makes them a compact representation of mostly complete histories.
+"""
+from typing import Iterable, List, Optional
+
+from .idset import IdSet
+
+Runs = List[List[int]]
+
+
+def id_runs(ids: Iterable[int]) -> Runs:
+    """Compress ids, e.g. an ``IdSet``, into sorted, disjoint runs."""
+    return (ids if isinstance(ids, IdSet) else IdSet(ids)).runs()
+
+
+def merge_runs(left: Runs, right: Runs) -> Runs:
+    """Unite two lists of runs."""
+    merged: Runs = []
+    for first, last in sorted([*left, *right]):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def subtract_runs(runs: Runs, remove: Runs) -> Runs:
+    """Remove all ids in ``remove`` from ``runs``."""
+    result: Runs = []
+    for first, last in runs:
+        for r_first, r_last in remove:
+            if r_last < first or r_first > last:
+                continue
+            if r_first > first:
+                result.append([first, r_first - 1])
+            first = r_last + 1
+            if first > last:
+                break
+        if first <= last:
+            result.append([first, last])
+    return result
+
+
+def find_gaps(ids: Iterable[int], known_missing: Optional[Runs] = None) -> Runs:
+    """Find the runs of ids missing between the lowest and highest id.
+
+    Args:
+        ids: the ids present.
+        known_missing: runs of ids known to be unavailable, these are not reported.
+
+    Returns:
+        Runs : the missing ids.
+    """
+    runs = id_runs(ids)
+    gaps = [[prev[1] + 1, succ[0] - 1] for prev, succ in zip(runs, runs[1:])]
+    return subtract_runs(gaps, known_missing or [])
+
+
+def count_ids(runs: Runs) -> int:
+    """Count the ids in a list of runs."""
+    return sum(last - first + 1 for first, last in runs)
@@ -1,35 +1,252 @@
 """Tegracli
 Philipp Kessling, Leibniz-HBI, 2022
 """
+import os
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Optional
 
-import ujson
 import yaml
 
+from .fileio import FileQueue, in_event_loop
+from .gaps import Runs, merge_runs
+from .profiling import span
+from .scheduler import update_statistics
+from .storage import PROF_FILE_NAME, JSONLStorage, Storage, get_storage
+
+try:
+    from yaml import CDumper as Dumper
+    from yaml import CFullLoader as FullLoader
+except ImportError:  # libyaml is not available
+    from yaml import Dumper, FullLoader  # type: ignore
+
 CONF_FILE_NAME = "tegracli_group.conf.yml"
-PROF_FILE_NAME = "profiles.jsonl"
+CHECKPOINT_INTERVAL = 30
+"""Minimal number of seconds between two checkpoints of a group's configuration."""
+
+ACTIVE = "active"
+UNREACHABLE = "unreachable"
+
+
+def _public_state(record: Dict) -> Dict:
+    """Strip the fields already stored in ``members``/``unreachable_members``."""
+    return {
+        key: value
+        for key, value in record.items()
+        if key not in ("status", "reason") and value is not None
+    }
 
 
 class Group(yaml.YAMLObject):
     """Manage group settings and members"""
 
     yaml_tag = "!tegracli.group.Group"
+    yaml_loader = [yaml.Loader, yaml.FullLoader, yaml.UnsafeLoader, FullLoader]
 
-    def __init__(self, members: List[str], name: str, params: Dict) -> None:
+    def __init__(
+        self,
+        members: List[str],
+        name: str,
+        params: Dict,
+        backend: str = JSONLStorage.backend,
+        fields: Optional[str] = None,
+        until: Optional[datetime] = None,
+        quota: Optional[Dict[str, int]] = None,
+    ) -> None:
         super().__init__()
 
-        self.members = members or []
-        self.unreachable_members: List[Dict[str, str]] = []
+        self._index: Dict[str, Dict] = {
+            str(member): {"status": ACTIVE, "reason": None} for member in members or []
+        }
         self.name = name or "new_group"
         self.params = params or {}
         self.error_state = {}
+        self.backend = backend
+        self.fields = fields
+        self.until = until
+        self.quota = quota
 
         if not self._group_dir.exists():
             self._group_dir.mkdir()
-        if not self._profiles_path.exists():
-            self._profiles_path.touch()
+        self.storage.prepare()
+
+    def __getstate__(self) -> Dict:
+        """Return the attributes to serialize, omitting private runtime state.
+
+        Members are written as the ``members`` and ``unreachable_members`` lists
+        older versions expect, additional per-member state goes to ``member_state``.
+        """
+        state = {
+            key: value
+            for key, value in self.__dict__.items()
+            if not key.startswith("_")
+        }
+        state["members"] = self.members
+        state["unreachable_members"] = self.unreachable_members
+        state["member_state"] = {
+            member: extra
+            for member, extra in (
+                (member, _public_state(record))
+                for member, record in self._index.items()
+            )
+            if extra
+        }
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        """Restore from YAML, filling in attributes missing in older configurations."""
+        state = dict(state)
+        members = state.pop("members", None) or []
+        unreachable = state.pop("unreachable_members", None) or []
+        member_state = state.pop("member_state", None) or {}
+        self.__dict__.update(state)
+        self.__dict__.setdefault("error_state", {})
+        self.__dict__.setdefault("backend", JSONLStorage.backend)
+        self.__dict__.setdefault("fields", None)
+        self.__dict__.setdefault("until", None)
+        self.__dict__.setdefault("quota", None)
+
+        self._index = {}
+        for member in members:
+            # versions <= 0.2.6 could put unreachable records back into members
+            if isinstance(member, dict):
+                member = member["member"]
+            self._index[str(member)] = {"status": ACTIVE, "reason": None}
+        for entry in unreachable:
+            self._index[str(entry["member"])] = {
+                "status": UNREACHABLE,
+                "reason": entry.get("reason"),
+            }
+        for member, extra in member_state.items():
+            if member in self._index:
+                self._index[member].update(extra)
+
+    @property
+    def members(self) -> List[str]:
+        """Active members in insertion order."""
+        return [
+            member
+            for member, record in self._index.items()
+            if record["status"] == ACTIVE
+        ]
+
+    @property
+    def unreachable_members(self) -> List[Dict[str, str]]:
+        """Unreachable members and the reason why they were not reachable."""
+        return [
+            {"member": member, "reason": record["reason"]}
+            for member, record in self._index.items()
+            if record["status"] == UNREACHABLE
+        ]
+
+    def add_member(self, member: str) -> None:
+        """add a member unless it is part of the group already"""
+        if member not in self._index:
+            self._index[member] = {"status": ACTIVE, "reason": None}
+            self.mark_dirty()
+
+    def add_members(self, members: List[str]) -> None:
+        """add members unless they are part of the group already"""
+        for member in members:
+            self.add_member(member)
+
+    def get_member_state(self, member: str) -> Optional[Dict]:
+        """get the state record of a member, None if it is not part of the group"""
+        return self._index.get(member)
+
+    def is_active(self, member: str) -> bool:
+        """check whether a member is part of the group and not unreachable"""
+        record = self._index.get(member)
+        return record is not None and record["status"] == ACTIVE
+
+    @classmethod
+    def load(cls, path: Path, autosave: bool = True) -> "Group":
+        """Load a group configuration, using libyaml if available.
+
+        Args:
+            path: path of the configuration file.
+            autosave: checkpoint changes to disk, otherwise they are only written by
+                an explicit ``dump``.
+
+        Returns:
+            Group : the loaded group.
+        """
+        with path.open("r", encoding="utf8") as file:
+            group: Group = yaml.load(file, Loader=FullLoader)  # nosec
+        # pylint: disable=protected-access
+        group._last_dump = time.monotonic()
+        group._autosave = autosave
+        return group
+
+    def export_member(self, member: str, name: Optional[str] = None) -> Optional[Dict]:
+        """get a member's state to be merged into another instance of this group
+
+        params:
+          member: str:
+            the member as it is named in the other instance
+          name: str:
+            the member's name here, if it was renamed to its id
+
+        returns:
+          the state for ``merge_member_state``, None if the member is unknown
+        """
+        name = name or member
+        if name not in self._index:
+            return None
+        return {
+            "member": member,
+            "name": name,
+            "record": dict(self._index[name]),
+            "error_state": dict(self.error_state or {}),
+        }
+
+    def merge_member_state(self, state: Dict) -> None:
+        """take over a member's state exported by another instance of this group
+
+        The member's record replaces the one loaded here, if the other instance
+        replaced the member's handle by its id, the handle is replaced here as well.
+        Error states are merged keeping the later end of each. Merging a state
+        twice has no further effect.
+
+        params:
+          state: Dict:
+            the state returned by ``export_member``
+        """
+        member, name = state["member"], state["name"]
+        if name != member:
+            self.update_member(member, name)
+        self._index[name] = dict(state["record"])
+        for slot, error in (state.get("error_state") or {}).items():
+            present = (self.error_state or {}).get(slot) or {}
+            if error and error.get("endtime", 0) > present.get("endtime", 0):
+                self.error_state = dict(self.error_state or {}, **{slot: error})
+        self.mark_dirty()
+
+    def merge_member(
+        self, other: "Group", member: str, name: Optional[str] = None
+    ) -> None:
+        """take over a member's state from another instance of this group
+
+        params:
+          other: Group:
+            the instance the member was retrieved with
+          member: str:
+            the member to take over, as it is named here
+          name: str:
+            the member's name in the other instance, if it was renamed there
+        """
+        state = other.export_member(member, name)
+        if state is not None:
+            self.merge_member_state(state)
+
+    @property
+    def storage(self) -> Storage:
+        """The storage backend holding the group's messages and profiles."""
+        if getattr(self, "_storage", None) is None:
+            # pylint: disable-next=attribute-defined-outside-init
+            self._storage = get_storage(self._group_dir, self.backend)
+        return self._storage
 
     @property
     def _group_dir(self) -> Path:
@@ -60,7 +277,7 @@ class Group(yaml.YAMLObject):
         if not self.error_state:
             self.error_state = {}
         self.error_state[slot] = {"endtime": error_period_end.timestamp()}
-        self.dump()
+        self.mark_dirty()
 
     def get_member_profile(self, member: str) -> Optional[Dict[str, str]]:
         """loads a user profile from disk
@@ -74,18 +291,7 @@ class Group(yaml.YAMLObject):
         -------
         Dict or None : user profile. if none is found returns None
         """
-        _member = (
-            int(member) if str.isnumeric(member) else member
-        )  # cast id to int, so telethon
-        # retrieves it from it's DB rather then bothering telegram's API.
-        with self._profiles_path.open("r") as profiles:
-            for line in profiles:
-                record: Dict[str, str] = ujson.loads(
-                    line
-                )  # pylint: disable=c-extension-no-member
-                if record.get("id") == _member or record.get("username") == _member:
-                    return record
-        return None
+        return self.storage.get_profile(member)
 
     def update_member(self, member: str, new_value: str):
         """update the entry for a member
@@ -99,12 +305,19 @@ class Group(yaml.YAMLObject):
         returns:
           Nothing, nada, nope.
         """
-        try:
-            index = self.members.index(member)
-        except ValueError:
+        if member not in self._index:
             # nothing to do, just quit
             return
-        self.members[index] = new_value
+        record = dict(self._index.get(new_value, {}), **self._index[member])
+        # rebuild the index in place, the member keeps its position
+        entries = [
+            (new_value, record) if key == member else (key, value)
+            for key, value in self._index.items()
+            if key != new_value or key == member
+        ]
+        self._index.clear()
+        self._index.update(entries)
+        self.mark_dirty()
 
     def get_params(self, **kwargs) -> Dict:
         """return an pimped params dict"""
@@ -112,31 +325,136 @@ class Group(yaml.YAMLObject):
 
     def get_last_message_for(self, member: str) -> Optional[int]:
         """retrieves the last message for a member"""
-        member_path = self._group_dir / (member + ".jsonl")
-        if member_path.exists():
-            with member_path.open("r") as file:
-                ids = [
-                    int(
-                        ujson.loads(line)["id"]
-                    )  # pylint: disable=c-extension-no-member
-                    for line in file
-                ]
-                if len(ids) != 0:
-                    return max(ids)
-        return None
+        with span("resume"):
+            return self.storage.last_message_id(member)
 
     def retry_all_unreachable(self):
         """put all unreachable accounts back into the active members"""
-        self.members = [*self.members, *self.unreachable_members]
-        self.unreachable_members = []
+        for record in self._index.values():
+            if record["status"] == UNREACHABLE:
+                record["status"] = ACTIVE
+                record["reason"] = None
+        self.mark_dirty()
 
     def mark_member_unreachable(self, member: str, reason: str) -> None:
         """move a member to the unreachable list"""
-        if member in self.members:
-            self.members.remove(member)
-            self.unreachable_members.append({"member": member, "reason": reason})
-
-    def dump(self):
-        """dump the configuration to disk"""
-        with self._conf_path.open("w") as conf_file:
-            yaml.dump(self, conf_file)
+        if self.is_active(member):
+            self._index[member].update(status=UNREACHABLE, reason=reason)
+            self.mark_dirty()
+
+    def mark_member_run(self, member: str) -> None:
+        """record the time a member's messages were last requested"""
+        if member in self._index:
+            self._index[member]["last_run"] = datetime.now().timestamp()
+            self.mark_dirty()
+
+    def set_member_value(self, member: str, key: str, value) -> None:
+        """store an additional value in a member's state"""
+        if member in self._index:
+            self._index[member][key] = value
+            self.mark_dirty()
+
+    def set_quota(
+        self, quota: Optional[Dict[str, int]], member: Optional[str] = None
+    ) -> None:
+        """set the quota of all members or of a single member
+
+        params:
+          quota: Dict[str, int]:
+            maximal number of ``messages`` and ``requests`` per member and run,
+            None to remove the quota
+          member: str:
+            the member with a quota of its own, None for the group's quota
+        """
+        if member is None:
+            self.quota = quota or None
+            self.mark_dirty()
+        else:
+            self.set_member_value(member, "quota", quota or None)
+
+    def get_missing_ids(self, member: str) -> Runs:
+        """get the runs of ids known to be unavailable for a member"""
+        return self._index.get(member, {}).get("missing") or []
+
+    def add_missing_ids(self, member: str, runs: Runs) -> None:
+        """record runs of ids Telegram returned no messages for"""
+        if member in self._index and runs:
+            record = self._index[member]
+            record["missing"] = merge_runs(record.get("missing") or [], runs)
+            self.mark_dirty()
+
+    def record_member_result(self, member: str, messages: int, success: bool) -> None:
+        """record the outcome of a member's retrieval for scheduling
+
+        params:
+          member: str:
+            the member that was retrieved
+          messages: int:
+            number of messages retrieved
+          success: bool:
+            whether the retrieval finished without errors
+        """
+        if member in self._index:
+            update_statistics(self._index[member], messages, success)
+            self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """flag the in-memory state as changed and checkpoint it if it is due"""
+        self._dirty = True  # pylint: disable=attribute-defined-outside-init
+        if getattr(self, "_autosave", True):
+            self.checkpoint()
+
+    def checkpoint(self, force: bool = False) -> None:
+        """dump the configuration if it changed and the last dump is old enough
+
+        params:
+          force: bool:
+            dump any pending changes regardless of the checkpoint interval
+        """
+        if not getattr(self, "_dirty", False):
+            if force and getattr(self, "_written", None) is not None:
+                # raises if the last dump written in the background failed
+                self._written.result()
+            return
+        elapsed = time.monotonic() - getattr(self, "_last_dump", 0.0)
+        if force or elapsed >= CHECKPOINT_INTERVAL:
+            # checkpoints taken while messages are retrieved are written in the
+            # background, so a slow disk does not hold up the requests in flight
+            self.dump(wait=force or not in_event_loop())
+
+    def dump(self, wait: bool = True):
+        """dump the configuration to disk
+
+        The configuration is written to a temporary file first, which then replaces
+        the configuration, so an interrupted dump never leaves a truncated file.
+        Dumps are written in the I/O executor in the order they were taken.
+
+        params:
+          wait: bool:
+            block until the configuration is written
+        """
+        with span("persist"):
+            written = self._io_queue.submit(self._write, yaml.dump(self, Dumper=Dumper))
+            self._written = written  # pylint: disable=attribute-defined-outside-init
+            if wait:
+                written.result()
+        self._dirty = False  # pylint: disable=attribute-defined-outside-init
+        # pylint: disable-next=attribute-defined-outside-init
+        self._last_dump = time.monotonic()
+
+    @property
+    def _io_queue(self) -> FileQueue:
+        if getattr(self, "_file_queue", None) is None:
+            self._file_queue = (  # pylint: disable=attribute-defined-outside-init
+                FileQueue()
+            )
+        return self._file_queue
+
+    def _write(self, text: str) -> None:
+        temp_path = self._conf_path.with_suffix(".yml.tmp")
+        with temp_path.open("w", encoding="utf8") as conf_file:
+            conf_file.write(text)
+        os.replace(temp_path, self._conf_path)
+
+
+yaml.add_representer(Group, Group.to_yaml, Dumper=Dumper)
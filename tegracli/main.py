@@ -3,12 +3,18 @@
 2022, Philipp Kessling, Leibniz-Institute for Media Research
 """
 # import atexit
-import re
+import asyncio
+import cProfile
+import json
 import sys
-from datetime import datetime
+import time
+from array import array
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime, timezone
 from functools import partial
 from pathlib import Path
-from typing import List, Tuple
+from typing import ContextManager, Dict, List, Optional, Tuple
 
 import click
 import telethon
@@ -16,17 +22,57 @@ import yaml
 from loguru import logger as log
 from telethon import TelegramClient
 
+from . import profiling
+from .checkpoint import HydrateCheckpoint, chunked
 from .dispatch import (
+    dispatch_backfill,
     dispatch_get,
     dispatch_hydrate,
-    dispatch_iter_messages,
+    dispatch_iter_chunks,
+    dispatch_resolve,
     dispatch_search,
     get_input_entity,
     get_profile,
     handle_message,
+    handle_messages,
+    resolve_date,
+)
+from .encoding import EncodingPool
+from .fields import parse_fields
+from .fileio import QueuedWriter, opened, run_io
+from .gaps import count_ids, find_gaps, id_runs, subtract_runs
+from .group import CONF_FILE_NAME, Group
+from .idset import TYPECODE
+from .merge import RUN_SIZE, file_lines, merge_messages
+from .scheduler import ROUND_SIZE, budgets, schedule
+from .sink import Sink, TeeWriter, open_sink
+from .storage import (
+    BACKENDS,
+    JSONLStorage,
+    JSONLWriter,
+    LockedError,
+    MessageWriter,
+    ShardedJSONLWriter,
+    SQLiteStorage,
+    get_storage,
+    locked,
+    migrate,
+)
+from .utilities import (
+    ensure_authentication,
+    flood_sleep_threshold,
+    get_client,
+    normalize_accounts,
+)
+from .workqueue import (
+    DEFAULT_LEASE,
+    JOURNAL_BATCH,
+    LOCK_FILE_NAME,
+    QUEUE_FILE_NAME,
+    Heartbeat,
+    WorkQueue,
+    worker_name,
 )
-from .group import Group
-from .utilities import ensure_authentication, get_client
 
 # atexit.register(lambda: log.debug("Terminating."))
 
@@ -68,9 +114,47 @@ log_levels = {
 @click.option(
     "--serialize", "-s", help="Serialize output to JSON.", is_flag=True, default=False
 )
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False),
+    help="Record all responses from Telegram into this cassette file.",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Answer all requests from this cassette file instead of Telegram.",
+)
+@click.option(
+    "--replay-speed",
+    type=float,
+    default=1.0,
+    help="Speed-up of recorded response times when replaying, 0 to not wait. "
+    + "Defaults to 1.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Print the time spent per stage of the run to STDERR at exit.",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    help="Additionally run cProfile and write its stats to this file, implies "
+    + "--profile.",
+)
 @click.pass_context
-def cli(
-    ctx: click.Context, debug: bool, verbose: int, log_file: click.File, serialize: bool
+def cli(  # pylint: disable=too-many-arguments
+    ctx: click.Context,
+    debug: bool,
+    verbose: int,
+    log_file: click.File,
+    serialize: bool,
+    record: Optional[str],
+    replay: Optional[str],
+    replay_speed: float,
+    profile: bool,
+    profile_output: Optional[str],
 ) -> None:
     """Tegracli!! Retrieve messages from *Te*le*gra*m with a *CLI*!"""
     log.remove()
@@ -85,6 +169,9 @@ def cli(
     if ctx.obj is None:
         ctx.obj = {}
 
+    if profile or profile_output is not None:
+        _start_profiling(ctx, profile_output)
+
     if not CONFIGURATION_PATH.exists() and not ctx.invoked_subcommand == "configure":
         log.error("Configuration not found. Terminating!")
         sys.exit(127)
@@ -97,10 +184,59 @@ def cli(
         with CONFIGURATION_PATH.open("r", encoding="UTF-8") as config_file:
             config = yaml.safe_load(config_file)
         ctx.obj["credentials"] = config
-        client = get_client(config)
+        if record is not None or replay is not None:
+            client = _cassette_client(ctx, config, record, replay, replay_speed)
+        else:
+            client = get_client(config, ctx.invoked_subcommand)
         ctx.obj["client"] = client
 
 
+def _start_profiling(ctx: click.Context, output: Optional[str]) -> None:
+    """Profile the run's stages and print a summary when the command is done."""
+    profiler = profiling.enable()
+    cprofile = None
+    if output is not None:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    def _report():
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(output)
+        profiling.disable()
+        click.echo(profiler.summary(), err=True)
+
+    ctx.call_on_close(_report)
+
+
+def _cassette_client(
+    ctx: click.Context,
+    config: Dict,
+    record: Optional[str],
+    replay: Optional[str],
+    replay_speed: float,
+) -> TelegramClient:
+    """Create a client recording into or replaying from a cassette."""
+    # only imported here, as it subclasses the TelegramClient
+    from .cassette import (  # pylint: disable=import-outside-toplevel
+        Cassette,
+        RecordingClient,
+        ReplayClient,
+    )
+
+    if replay is not None:
+        client = ReplayClient(Cassette.load(Path(replay)), speed=replay_speed)
+        client.flood_sleep_threshold = flood_sleep_threshold(
+            config.get("client") or {}, ctx.invoked_subcommand
+        )
+        return client
+    cassette = Cassette(Path(record))
+    client = get_client(config, ctx.invoked_subcommand, client_class=RecordingClient)
+    client.record(cassette)
+    ctx.call_on_close(cassette.close)
+    return client
+
+
 @cli.command()
 def configure():
     """Configure tegracli."""
@@ -115,30 +251,73 @@ def configure():
 
 
 @cli.command()
+@click.option(
+    "--checkpoint",
+    "-c",
+    type=click.Path(dir_okay=False),
+    help="Record completed ids in this file and skip them when restarted.",
+)
+@click.option(
+    "--shard_size",
+    "-s",
+    type=int,
+    help="Split the output into files of this many messages, named after OUTPUT_FILE.",
+)
 @click.argument("input_file", type=click.File("r", encoding="utf-8"), default="-")
-@click.argument("output_file", type=click.File("w", encoding="utf-8"), default="-")
+@click.argument(
+    "output_file", type=click.Path(dir_okay=False, allow_dash=True), default="-"
+)
 @click.pass_context
-def hydrate(ctx: click.Context, input_file: click.File, output_file: click.File):
-    """Hydrate a file with messages-ids."""
-    client = get_client(ctx.obj["credentials"])
+def hydrate(
+    ctx: click.Context,
+    checkpoint: Optional[str],
+    shard_size: Optional[int],
+    input_file: click.File,
+    output_file: str,
+):
+    """Hydrate a file with messages-ids.
+
+    With a checkpoint an interrupted hydration can be restarted with the same
+    arguments, it then appends to OUTPUT_FILE and skips all ids retrieved before as
+    well as ids Telegram did not return a message for.
+    """
+    client = ctx.obj["client"]
 
-    channel_registry = {}
+    channel_registry: Dict[str, array] = {}
     for message_id in input_file:
+        if not message_id.strip():
+            continue
         channel, post_id = message_id.split("/")
+        channel_registry.setdefault(channel, array(TYPECODE)).append(int(post_id))
 
-        post_id = int(post_id)
-        if post_id is None:
-            continue
-        if channel not in channel_registry:
-            channel_registry[channel] = [post_id]
-        else:
-            channel_registry[channel].append(post_id)
-    with client:
-        with click.progressbar(channel_registry.items()) as channel_iter:
-            for channel, post_ids in channel_iter:
-                client.loop.run_until_complete(
-                    dispatch_hydrate(channel, post_ids, output_file, client)
-                )
+    progress = HydrateCheckpoint(Path(checkpoint) if checkpoint else None)
+    if shard_size is not None and output_file == "-":
+        log.error("Sharding requires an OUTPUT_FILE. Aborting.")
+        sys.exit(127)
+    if shard_size is not None:
+        writer = ShardedJSONLWriter(Path(output_file), shard_size)
+    else:
+        mode = "a" if progress.resumed else "w"
+        output = click.open_file(output_file, mode, encoding="utf-8")
+        writer = JSONLWriter(output)
+        ctx.call_on_close(output.close)
+    writer = QueuedWriter(writer)
+
+    try:
+        with client:
+            with click.progressbar(channel_registry.items()) as channel_iter:
+                for channel, post_ids in channel_iter:
+                    for chunk in chunked(progress.pending(channel, post_ids)):
+                        missing = client.loop.run_until_complete(
+                            dispatch_hydrate(channel, chunk, writer, client)
+                        )
+                        # the chunk is only marked done once it is on disk
+                        writer.flush()
+                        client.loop.run_until_complete(writer.join())
+                        if missing is not None:
+                            progress.mark_done(channel, chunk, missing)
+    finally:
+        writer.close()
 
 
 @cli.command()
@@ -151,6 +330,18 @@ def hydrate(ctx: click.Context, input_file: click.File, output_file: click.File)
     type=click.DateTime(["%Y-%m-%d"]),
     help="Offset retrieval to specific date in YYYY-MM-DD format.",
 )
+@click.option(
+    "--since",
+    "-S",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only messages sent on or after this date in YYYY-MM-DD format.",
+)
+@click.option(
+    "--until",
+    "-U",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="Only messages sent before this date in YYYY-MM-DD format.",
+)
 @click.option(
     "--offset_id", "-o", type=int, help="Offset retrieval to a specific post number."
 )
@@ -171,12 +362,39 @@ def hydrate(ctx: click.Context, input_file: click.File, output_file: click.File)
 @click.option(
     "--reply_to", "-r", type=int, help="Only messages replied to specific post id."
 )
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    default=0,
+    help="Number of processes encoding messages. Defaults to 0, encoding inline.",
+)
+@click.option(
+    "--fields",
+    "-F",
+    help="Fields to store, either a profile (minimal, research, full) or "
+    + "comma-separated dotted paths like replies.replies. Defaults to full.",
+)
+@click.option(
+    "--inject_user/--no_inject_user",
+    default=True,
+    help="Add the channel's profile to each message or store it once in "
+    + "profiles.jsonl. Defaults to inject.",
+)
+@click.option(
+    "--sink",
+    type=str,
+    help="Stream messages as NDJSON to - (stdout), a named pipe, unix:PATH or "
+    + "tcp:HOST:PORT instead of writing files.",
+)
 @click.argument("channels", nargs=-1)
 @click.pass_context
 def get(  # pylint: disable=too-many-arguments
     ctx: click.Context,
     limit: int,
     offset_date: datetime,
+    since: Optional[datetime],
+    until: Optional[datetime],
     offset_id: int,
     min_id: int,
     max_id: int,
@@ -184,10 +402,14 @@ def get(  # pylint: disable=too-many-arguments
     from_user: str,
     reverse: bool,
     reply_to: int,
+    workers: int,
+    fields: Optional[str],
+    inject_user: bool,
+    sink: Optional[str],
     channels: List[str],
 ) -> None:
     """Get messages for the specified channels by either ID or username."""
-    client = get_client(ctx.obj["credentials"])
+    client = ctx.obj["client"]
 
     params = {}
     if limit is not None:
@@ -208,8 +430,20 @@ def get(  # pylint: disable=too-many-arguments
         params["reply_to"] = reply_to
     params["reverse"] = reverse
 
-    with client:
-        client.loop.run_until_complete(dispatch_get(channels, client, params=params))
+    with client, _encoding_pool(workers) as pool, _open_sink(sink) as _sink:
+        client.loop.run_until_complete(
+            dispatch_get(
+                channels,
+                client,
+                params=params,
+                pool=pool,
+                fields=parse_fields(fields),
+                inject_user=inject_user,
+                since=since,
+                until=until,
+                sink=_sink,
+            )
+        )
 
 
 @cli.group()
@@ -231,17 +465,62 @@ def group():
     type=click.DateTime(["%Y-%m-%d"]),
     help="Start date for the collection. Must be in YYYY-MM-DD format.",
 )
+@click.option(
+    "--end_date",
+    "-e",
+    type=click.DateTime(["%Y-%m-%d"]),
+    help="End date for the collection, exclusive. Must be in YYYY-MM-DD format.",
+)
 @click.option("--limit", "-l", type=int, help="number of posts fo retrieve in one run")
+@click.option(
+    "--backend",
+    "-b",
+    type=click.Choice(list(BACKENDS)),
+    default="jsonl",
+    help="storage backend for messages and profiles. Defaults to jsonl.",
+)
+@click.option(
+    "--fields",
+    "-F",
+    help="fields to store, either a profile (minimal, research, full) or "
+    + "comma-separated dotted paths like replies.replies. defaults to full.",
+)
+@click.option(
+    "--resolve",
+    is_flag=True,
+    default=False,
+    help="resolve the accounts and store their profiles now instead of during the "
+    + "first run.",
+)
+@click.option(
+    "--concurrency",
+    "-c",
+    type=int,
+    default=4,
+    help="number of requests sent at once when resolving. defaults to 4.",
+)
 @click.argument("name", type=str, nargs=1, required=True)
 @click.argument("accounts", type=str, nargs=-1)
-def init(
+@click.pass_context
+def init(  # pylint: disable=too-many-arguments,too-many-locals
+    ctx: click.Context,
     read_file: str,
     start_date: datetime,
+    end_date: Optional[datetime],
     limit: int,
+    backend: str,
+    fields: Optional[str],
+    resolve: bool,
+    concurrency: int,
     name: str,
     accounts: List[str],
 ):
-    """Initialize a new account group."""
+    """Initialize a new account group.
+
+    Accounts are given as handles, URLs or IDs, duplicates are dropped. With
+    --resolve, handles are replaced by IDs and accounts unknown to Telegram are
+    marked as unreachable right away.
+    """
     cwd = Path()
     results_directory = cwd / name
     params = {"limit": limit, "reverse": True}
@@ -266,21 +545,62 @@ def init(
             sys.exit(127)
 
         with _read_file.open("r", encoding="utf8") as file:
-            for line in file:
-                line = str(line)
-                # test whether `line` is a valid id|handle|url
-                for match in re.finditer(r"[\w\d]+", line):
-                    matched_line = match.group(0)
-                    log.debug(f"Found {matched_line}.")
-                    accounts.append(matched_line)
+            accounts.extend(file)
 
+    accounts = normalize_accounts(accounts)
     log.debug(f"Found these accounts: {', '.join(accounts)}")
 
     if len(accounts) >= 1:
-        _group = Group(accounts, name, params)
+        profiles: Dict[str, Dict] = {}
+        failures: Dict[str, str] = {}
+        if resolve:
+            client = ctx.obj["client"]
+            with client:
+                profiles, failures = client.loop.run_until_complete(
+                    dispatch_resolve(client, accounts, concurrency=concurrency)
+                )
+            log.info(
+                f"Resolved {len(profiles)} of {len(accounts)} accounts, "
+                + f"{len(failures)} are unknown to Telegram."
+            )
+        members = {
+            str(profiles[account]["id"]) if account in profiles else account: None
+            for account in accounts
+        }
+        _group = Group(
+            list(members), name, params, backend=backend, fields=fields, until=end_date
+        )
+        for profile in profiles.values():
+            _group.storage.add_profile(profile)
+        for account, reason in failures.items():
+            _group.mark_member_unreachable(account, reason)
         _group.dump()
 
 
+@group.command("migrate")
+@click.option(
+    "--to",
+    "target",
+    type=click.Choice(list(BACKENDS)),
+    required=True,
+    help="storage backend to migrate the group to.",
+)
+@click.argument("name", type=str, nargs=1, required=True)
+def migrate_group(target: str, name: str):
+    """Migrate a group's messages and profiles to another storage backend."""
+    cwd = Path()
+    conf = _guarded_group_load(cwd, name)
+    if conf.backend == target:
+        log.info(f"{name} already uses the {target} backend.")
+        return
+    source = conf.storage
+    count = migrate(source, get_storage(cwd / name, target))
+    source.close()
+    log.info(f"Migrated {count} messages of {name} to {target}.")
+    conf.backend = target
+    conf.dump()
+
+
 @group.command()
 @click.argument("groups", nargs=-1)
 def reset(groups: Tuple[str]):
@@ -293,20 +613,249 @@ def reset(groups: Tuple[str]):
 
 
 @group.command()
+@click.option(
+    "--messages",
+    "-m",
+    type=int,
+    help="maximal number of messages per member and run.",
+)
+@click.option(
+    "--requests",
+    "-r",
+    type=int,
+    help="maximal number of API requests per member and run.",
+)
+@click.option(
+    "--member",
+    "members",
+    multiple=True,
+    help="set the quota of this member instead of the group's. may be repeated.",
+)
+@click.argument("name")
+def quota(
+    messages: Optional[int],
+    requests: Optional[int],
+    members: Tuple[str],
+    name: str,
+):
+    """Set how many messages members retrieve per run.
+
+    The group's quota is shared out by the members' posting rates, members
+    posting more often get up to four times as much. A member's own quota is
+    used as is. Without --messages and --requests the quota is removed.
+    """
+    conf = _guarded_group_load(Path(), name)
+    _quota = {
+        key: value
+        for key, value in {"messages": messages, "requests": requests}.items()
+        if value is not None
+    }
+    for member in members:
+        if conf.get_member_state(member) is None:
+            log.warning(f"Unknown member {member} in {name}. Skipping.")
+            continue
+        conf.set_quota(_quota, member)
+    if not members:
+        conf.set_quota(_quota)
+    conf.dump()
+
+
+@group.command()
+@click.option(
+    "--max-runtime",
+    "-t",
+    type=int,
+    help="stop starting new members after this many seconds.",
+)
+@click.option(
+    "--round-size",
+    "-r",
+    type=int,
+    default=ROUND_SIZE,
+    help="messages retrieved per member before the next member's turn. "
+    + f"defaults to {ROUND_SIZE}.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    default=0,
+    help="number of processes encoding messages. defaults to 0, encoding inline.",
+)
+@click.option(
+    "--sink",
+    type=str,
+    help="additionally stream messages as NDJSON to - (stdout), a named pipe, "
+    + "unix:PATH or tcp:HOST:PORT.",
+)
+@click.option(
+    "--queue",
+    is_flag=True,
+    default=False,
+    help="take members from the group's work queue, shared with other processes "
+    + "and hosts running the group.",
+)
+@click.option(
+    "--lease",
+    type=int,
+    default=DEFAULT_LEASE,
+    help="seconds a member is leased for without heartbeat. "
+    + f"defaults to {DEFAULT_LEASE}.",
+)
 @click.argument("groups", nargs=-1)
 @click.pass_context
-def run(ctx: click.Context, groups: Tuple[str]):
+def run(  # pylint: disable=too-many-arguments
+    ctx: click.Context,
+    max_runtime: Optional[int],
+    round_size: int,
+    workers: int,
+    sink: Optional[str],
+    queue: bool,
+    lease: int,
+    groups: Tuple[str],
+):
     """Load a group configuration and run the groups operations.
 
     GROUPS are subdirectories with a valid group configuration.
         If the special keyword all is given, all subdirectories are considered.
+        Members are run in order of priority: members not retrieved for long,
+        posting often and without recent errors come first. They take turns
+        retrieving --round-size messages until they are up to date or used up
+        their quota.
+
+    With --queue, several processes on hosts sharing the group directories
+    divide the members among each other.
     """
     client = ctx.obj["client"]
+    with client, _encoding_pool(workers) as pool, _open_sink(sink) as _sink:
+        if queue:
+            run_queue(
+                client, groups, lease, max_runtime=max_runtime, pool=pool, sink=_sink
+            )
+        else:
+            run_group(
+                client,
+                groups,
+                max_runtime=max_runtime,
+                pool=pool,
+                sink=_sink,
+                round_size=round_size,
+            )
+
+
+@group.command()
+@click.option(
+    "--concurrency",
+    "-c",
+    type=int,
+    default=4,
+    help="number of members backfilled at once. defaults to 4.",
+)
+@click.argument("groups", nargs=-1)
+@click.pass_context
+def backfill(ctx: click.Context, concurrency: int, groups: Tuple[str]):
+    """Retrieve messages missing in the histories of the groups' members.
+
+    Gaps are determined from the stored post numbers. Post numbers Telegram
+    does not return messages for are remembered and not requested again.
+    """
+    client = ctx.obj["client"]
+    cwd = Path()
     with client:
-        run_group(client, groups)
+        for group_name in groups:
+            conf = _guarded_group_load(cwd, group_name)
+            try:
+                client.loop.run_until_complete(
+                    _backfill_group(conf, client, concurrency)
+                )
+            finally:
+                conf.checkpoint(force=True)
+            log.info(f"Done with backfilling group {group_name}.")
+
+
+async def _backfill_group(conf: Group, client: TelegramClient, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(
+        *(
+            _backfill_member(member, conf, client, semaphore)
+            for member in conf.members
+            if str.isnumeric(member)
+        )
+    )
+
+
+async def _backfill_member(
+    member: str, conf: Group, client: TelegramClient, semaphore: asyncio.Semaphore
+):
+    gaps = find_gaps(
+        await run_io(conf.storage.id_set, member), conf.get_missing_ids(member)
+    )
+    if not gaps:
+        return
+    written = 0
+    fields = parse_fields(conf.fields)
+
+    async def _write(message, writer: MessageWriter):
+        nonlocal written
+        written += 1
+        await handle_message(message, file=writer, injects=None, fields=fields)
+
+    async with semaphore:
+        log.info(f"Backfilling {count_ids(gaps)} ids in {len(gaps)} gaps of {member}.")
+        received = None
+        try:
+            entity = await get_input_entity(client, int(member))
+            async with opened(conf.storage.open_member, member) as stored:
+                writer = QueuedWriter(stored)
+                try:
+                    received = await dispatch_backfill(
+                        client, entity, gaps, partial(_write, writer=writer)
+                    )
+                finally:
+                    await writer.aclose()
+        except LockedError:
+            log.warning(f"{member} is retrieved by another process. Skipping.")
+        except (ValueError, telethon.errors.FloodWaitError) as error:
+            log.warning(f"Backfilling {member} failed: {error}")
+        finally:
+            # backfilled messages are appended out of order, also by aborted runs
+            if written:
+                await _compact_member(member, conf)
+    if received is None:
+        return
+    conf.add_missing_ids(member, subtract_runs(gaps, id_runs(received)))
+
+
+async def _compact_member(member: str, conf: Group):
+    try:
+        await run_io(conf.storage.compact, member)
+    except LockedError:
+        log.warning(f"{member} is retrieved by another process. Not compacting it.")
+
+
+def _encoding_pool(workers: int) -> ContextManager[Optional[EncodingPool]]:
+    """Create an EncodingPool if workers are requested, a null context otherwise."""
+    return EncodingPool(workers) if workers > 0 else nullcontext()
+
 
+def _open_sink(target: Optional[str]) -> ContextManager[Optional[Sink]]:
+    """Open a Sink if a target is given, a null context otherwise."""
+    return open_sink(target) if target is not None else nullcontext()
 
-def _handle_group_member(member: str, conf: Group, client: TelegramClient) -> None:
+
+def _handle_group_member(
+    member: str,
+    conf: Group,
+    client: TelegramClient,
+    pool: Optional[EncodingPool] = None,
+    sink: Optional[Sink] = None,
+    limit: Optional[int] = None,
+) -> Optional[Tuple[str, int, bool]]:
+    """Retrieve a member's new messages.
+
+    Returns the member, which may have been renamed to its id, the number of
+    messages received and whether the retrieval succeeded. None if it was skipped.
+    """
     # check whether member is known already and, thus, present in profiles.jsonl
     # if (yes
     #   load user object
@@ -317,7 +866,7 @@ def _handle_group_member(member: str, conf: Group, client: TelegramClient) -> No
             try:
                 #   load user object from TG and save it to profiles.jsonl
                 profile = client.loop.run_until_complete(
-                    get_profile(client, member, conf.name)
+                    get_profile(client, member, conf.name, conf.storage)
                 )
             except (
                 telethon.errors.FloodWaitError,
@@ -330,105 +879,474 @@ def _handle_group_member(member: str, conf: Group, client: TelegramClient) -> No
                     "Encountered FloodWaitError, suspending profile"
                     + f"retrieval for {wait_time} seconds"
                 )
+                # suspend account retrieval to avoid banning/blocking of the account
                 conf.set_error_state("entities", wait_time)
-                conf.set_error_state(
-                    "entities", wait_time
-                )  # suspend account retrieval for one hour
-                # to avoid banning/blocking of the account
-                return
+                return None
             except (ValueError, telethon.errors.RPCError) as error:
                 message = "ValueError"
                 if isinstance(error, telethon.errors.RPCError):
                     message = error.message or "RPCError"
                 log.warning(f"Entity for {member} was not found due to a {message}.")
                 conf.mark_member_unreachable(member, message)
-                return
+                return None
             if profile is None:
                 conf.mark_member_unreachable(member, "Unknown")
-                return
+                return None
             # check whether profile is also unknown to TG
             #   check whether the member was specified by a handle
             #   if (yes)
         else:
             log.debug(f"Skipping {member}, due to suspended API method.")
-            return
+            return None
     if not str.isnumeric(member):
         #       replace handle by ID
         conf.update_member(member, str(profile["id"]))
-        conf.dump()
+        member = str(profile["id"])
 
     # get the input_entity from telethon
     try:
         entity = client.loop.run_until_complete(get_input_entity(client, int(member)))
     except ValueError:
         log.warning(f"Input entity for {member} not found. Skipping for now.")
-        return
+        return None
     # check whether a jsonl-file for this member exists
     # if (yes)
     #   iterate over lines in file and get the highest message.id
     #   modify `params`-dict accordingly
     _params = conf.get_params(entity=entity)
+    if limit is not None:
+        _params["limit"] = limit
     # Only set the ``min_id`` parameter if a file is existent for the user
     min_id = conf.get_last_message_for(member)
     if min_id is not None:
         _params["min_id"] = min_id
+    if conf.until is not None:
+        max_id = _resolve_until(member, conf, client, entity)
+        if max_id is None or max_id <= (min_id or 0) + 1:
+            log.debug(f"No messages left for {member} before {conf.until}.")
+            return None
+        _params["max_id"] = max_id
 
     log.debug(f"Request with the following parameters: {_params}")
+    conf.mark_member_run(member)
 
     # request data from telethon and write to disk
-    with (Path(conf.name) / (member + ".jsonl")).open("a") as member_file:
-        client.loop.run_until_complete(
-            dispatch_iter_messages(
-                client,
-                params=_params,
-                callback=partial(handle_message, file=member_file, injects=None),
+    received = 0
+
+    async def _count_and_handle(messages, handler):
+        nonlocal received
+        received += len(messages)
+        await handler(messages)
+
+    with conf.storage.open_member(member) as stored:
+        writer = (
+            stored
+            if sink is None
+            else TeeWriter(stored, sink.writer(conf.name, member))
+        )
+        writer = QueuedWriter(writer)
+        fields = parse_fields(conf.fields)
+        handler = None if pool is None else pool.handler(writer, fields=fields)
+        callback = (
+            partial(handle_messages, file=writer, injects=None, fields=fields)
+            if handler is None
+            else handler.extend
+        )
+        try:
+            success = client.loop.run_until_complete(
+                dispatch_iter_chunks(
+                    client,
+                    params=_params,
+                    callback=partial(_count_and_handle, handler=callback),
+                )
             )
+        finally:
+            if handler is not None:
+                client.loop.run_until_complete(handler.flush())
+            writer.close()
+    return member, received, success
+
+
+def _resolve_until(
+    member: str, conf: Group, client: TelegramClient, entity
+) -> Optional[int]:
+    """Get the exclusive ``max_id`` for a group's end date, cached per member.
+
+    The id is only cached once the end date has passed, until then messages sent
+    later may still fall before it. A member without messages before a passed end
+    date is cached as ``0``, as None values are not kept in the member's state.
+    """
+    state = conf.get_member_state(member) or {}
+    until_id = state.get("until_id")
+    if until_id is None:
+        until_id = client.loop.run_until_complete(
+            resolve_date(client, entity, conf.until)
         )
+        # naive dates are taken as UTC, like Telegram does
+        until = (
+            conf.until
+            if conf.until.tzinfo is not None
+            else conf.until.replace(tzinfo=timezone.utc)
+        )
+        if until <= datetime.now(timezone.utc):
+            until_id = 0 if until_id is None else until_id
+            conf.set_member_value(member, "until_id", until_id)
+    return None if until_id is None else until_id + 1
+
 
+def run_group(  # pylint: disable=too-many-arguments
+    client: TelegramClient,
+    groups: Tuple[str],
+    max_runtime: Optional[int] = None,
+    pool: Optional[EncodingPool] = None,
+    sink: Optional[Sink] = None,
+    round_size: int = ROUND_SIZE,
+):
+    """Runs the required operations for the specified groups.
 
-def run_group(client: TelegramClient, groups: Tuple[str]):
-    """Runs the required operations for the specified groups."""
+    Members take turns: each retrieves at most ``round_size`` messages, then the
+    next member's turn starts, until every member is up to date or has used up
+    its budget for this run.
+
+    Args:
+        client: signed in TG client.
+        groups: names of the groups to run.
+        max_runtime: seconds after which no further members are started.
+        pool: encode messages in this pool instead of the event loop.
+        sink: additionally stream messages to this sink.
+        round_size: messages retrieved per member and turn.
+    """
     cwd = Path()
+    deadline = None if max_runtime is None else time.monotonic() + max_runtime
+
+    # iterate groups
+    for group_name in _groups(groups):
+        # load group configuration
+        conf: Group = _guarded_group_load(cwd, group_name)
 
+        # iterate over group members, round-robin
+        pending = deque(schedule(conf))
+        budget = budgets(conf)
+        results: Dict[str, Tuple[str, int, bool]] = {}
+        try:
+            while pending:
+                member = pending.popleft()
+                if deadline is not None and time.monotonic() >= deadline:
+                    log.info(f"Reached maximal runtime, stopping before {member}.")
+                    return
+                name, total, _ = results.get(member, (member, 0, True))
+                limit = round_size
+                if budget.get(member) is not None:
+                    limit = min(round_size, budget[member] - total)
+                try:
+                    result = _handle_group_member(
+                        name, conf, client, pool, sink, limit=limit
+                    )
+                except LockedError:
+                    log.warning(f"{member} is retrieved by another process. Skipping.")
+                    continue
+                if result is None:
+                    continue
+                name, received, success = result
+                results[member] = (name, total + received, success)
+                if success and received >= limit:
+                    if budget.get(member) is None or total + received < budget[member]:
+                        # more history is waiting, continue after the other members
+                        pending.append(member)
+                        continue
+                log.debug(f"Done with {member}. {len(pending)} members pending.")
+        finally:
+            _record_results(conf, results, budget)
+            conf.checkpoint(force=True)
+        # done.
+        log.info(f"Done with group {group_name}.")
+
+
+def _record_results(
+    conf: Group,
+    results: Dict[str, Tuple[str, int, bool]],
+    budget: Dict[str, Optional[int]],
+) -> None:
+    """Record each member's retrieval and whether it used up its budget."""
+    for member, (name, received, success) in results.items():
+        conf.record_member_result(name, received, success)
+        exhausted = budget.get(member) is not None and received >= budget[member]
+        conf.set_member_value(name, "backlog", exhausted or None)
+
+
+def _groups(groups: Tuple[str]) -> List:
     if groups == ("all",):
-        groups = [
+        return [
             path
             for path in Path().iterdir()
             if path.is_dir() and not path.name.startswith(".")
         ]
+    return list(groups)
 
-    # iterate groups
-    for group_name in groups:
-        # load group configuration
-        conf: Group = _guarded_group_load(cwd, group_name)
 
-        # iterate over group members
-        for index, member in enumerate(conf.members):
-            _handle_group_member(member, conf, client)
-            log.debug(f"Done with {member}. {(index / len(conf.members) * 100):.2f}%")
-        # done.
-        log.info(f"Done with group {group_name}.")
+def run_queue(  # pylint: disable=too-many-arguments
+    client: TelegramClient,
+    groups: Tuple[str],
+    lease: int,
+    max_runtime: Optional[int] = None,
+    pool: Optional[EncodingPool] = None,
+    sink: Optional[Sink] = None,
+):
+    """Work on the queues of the specified groups together with other workers.
+
+    Members are retrieved with a private copy of the group configuration, their
+    states are journaled in the queue and folded into the configuration under the
+    group's lock every ``JOURNAL_BATCH`` members. The private copy is refreshed
+    with each fold.
+
+    Args:
+        client: signed in TG client.
+        groups: names of the groups to run.
+        lease: seconds a member is leased for without heartbeat.
+        max_runtime: seconds after which no further members are leased.
+        pool: encode messages in this pool instead of the event loop.
+        sink: additionally stream messages to this sink.
+    """
+    cwd = Path()
+    deadline = None if max_runtime is None else time.monotonic() + max_runtime
+    worker = worker_name()
+
+    for group_name in _groups(groups):
+        conf_path = cwd / group_name / CONF_FILE_NAME
+        lock_path = cwd / group_name / LOCK_FILE_NAME
+        with locked(lock_path):
+            conf = _guarded_group_load(cwd, group_name, autosave=False)
+            if conf.backend == SQLiteStorage.backend:
+                # WAL, which messages.db runs in, does not work on network filesystems
+                log.error(
+                    f"{group_name} uses the sqlite backend, which cannot be shared by "
+                    + "queued runs. Migrate it with `group migrate --to jsonl`."
+                )
+                sys.exit(127)
+            work = WorkQueue(cwd / group_name / QUEUE_FILE_NAME)
+            conf = _fold_journal(work, conf)
+            enqueued = work.enqueue(schedule(conf))
+        if enqueued:
+            log.info(f"Started a new round of {group_name} with {enqueued} members.")
+
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                member = work.lease(worker, lease)
+                if member is None:
+                    break
+                try:
+                    budget = {member: budgets(conf).get(member)}
+                    with Heartbeat(work, member, worker, lease) as heartbeat:
+                        result = _handle_group_member(
+                            member, conf, client, pool, sink, limit=budget[member]
+                        )
+                    if result is not None:
+                        _record_results(conf, {member: result}, budget)
+                except LockedError as error:
+                    work.release(member, worker, str(error))
+                    continue
+                except BaseException as error:
+                    work.release(member, worker, repr(error))
+                    raise
+                finally:
+                    conf.storage.close()
+                if heartbeat.lost:
+                    log.warning(f"Lost the lease on {member}, its state is discarded.")
+                    continue
+                state = conf.export_member(
+                    member, result[0] if result is not None else None
+                )
+                if work.complete(member, worker, state) >= JOURNAL_BATCH:
+                    with locked(lock_path):
+                        conf = _fold_journal(
+                            work, Group.load(conf_path, autosave=False)
+                        )
+        finally:
+            with locked(lock_path):
+                _fold_journal(work, Group.load(conf_path, autosave=False))
+        log.info(f"Done with group {group_name}: {work.counts()}")
+
+
+def _fold_journal(work: WorkQueue, conf: Group) -> Group:
+    """Fold the journaled member states into the group configuration and save it.
+
+    Must be called holding the group's lock, with the configuration loaded under
+    it. A fold interrupted before the journal was cleared is repeated by the next
+    one, merging a state twice does no harm.
+
+    Returns:
+        Group : the updated configuration.
+    """
+    journal = work.journal()
+    if journal:
+        for _, state in journal:
+            conf.merge_member_state(state)
+        conf.dump()
+        work.forget(journal[-1][0])
+    return conf
 
 
-def _guarded_group_load(cwd: Path, _name: str) -> Group:
+def _guarded_group_load(cwd: Path, _name: str, autosave: bool = True) -> Group:
     group_conf_fil = cwd / _name / "tegracli_group.conf.yml"
     if not group_conf_fil.exists():
         log.error(f"Unknown group {_name}. Aborting.")
         sys.exit(127)
-    with group_conf_fil.open("r") as file:
-        _group: Group = yaml.full_load(file)
-        return _group
+    return Group.load(group_conf_fil, autosave=autosave)
+
+
+@cli.command()
+@click.option(
+    "--format",
+    "-f",
+    "output_format",
+    type=click.Choice(["table", "json"]),
+    default="table",
+    help="Output format of the report. Defaults to table.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    default=0,
+    help="Number of processes scanning files. Defaults to 0, scanning inline.",
+)
+@click.argument("groups", nargs=-1)
+def stats(output_format: str, workers: int, groups: Tuple[str]):
+    """Summarize the messages collected by groups.
+
+    Reports per member the number of messages, date and post number range,
+    gaps in the post numbers and the most frequent sources of forwards.
+    """
+    # pandas is only imported here, as it slows down the start of all other commands
+    from .stats import (  # pylint: disable=import-outside-toplevel
+        group_summaries,
+        report,
+    )
+
+    cwd = Path()
+    rows = []
+    for group_name in groups:
+        conf = _guarded_group_load(cwd, group_name)
+        for row in report(group_summaries(conf, workers=workers)):
+            rows.append({"group": conf.name, **row})
+
+    if output_format == "json":
+        click.echo(json.dumps(rows, indent=2))
+        return
+    for row in rows:
+        click.echo(
+            f"{row['group']}/{row['member']}: {row['messages']} messages, "
+            + f"{row['first_date']} to {row['last_date']}, "
+            + f"ids {row['min_id']} to {row['max_id']}, "
+            + f"{row['missing_ids']} missing in {row['gaps']} gaps"
+            + (f", forwards from {row['top_forwards']}" if row["top_forwards"] else "")
+        )
 
 
 @cli.command()
+@click.option(
+    "--sink",
+    type=str,
+    help="Stream messages as NDJSON to - (stdout), a named pipe, unix:PATH or "
+    + "tcp:HOST:PORT instead of writing files.",
+)
 @click.argument("queries", nargs=-1)
 @click.pass_context
-def search(ctx: click.Context, queries: List[str]):
+def search(ctx: click.Context, sink: Optional[str], queries: List[str]):
     """Searches Telegram content that is available to your account."""
-    client = get_client(ctx.obj["credentials"])
+    client = ctx.obj["client"]
 
-    with client:
-        client.loop.run_until_complete(dispatch_search(queries, client))
+    with client, _open_sink(sink) as _sink:
+        client.loop.run_until_complete(dispatch_search(queries, client, sink=_sink))
+
+
+@cli.command()
+@click.option(
+    "--output_dir",
+    "-o",
+    type=click.Path(file_okay=False),
+    default=".",
+    help="Directory to write the merged files to. Defaults to the current directory.",
+)
+@click.option(
+    "--group",
+    "-g",
+    "group_name",
+    type=str,
+    help="Import the merged messages into this group instead.",
+)
+@click.option(
+    "--run_size",
+    "-r",
+    type=int,
+    default=RUN_SIZE,
+    help=f"Number of messages sorted in memory at once. Defaults to {RUN_SIZE}.",
+)
+@click.option(
+    "--temp_dir",
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory for the sorted runs spilled to disk. Defaults to the system's.",
+)
+@click.argument(
+    "files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+def merge(
+    output_dir: str,
+    group_name: Optional[str],
+    run_size: int,
+    temp_dir: Optional[str],
+    files: Tuple[str],
+):
+    """Merge message files into one file per channel, sorted by id.
+
+    FILES are grouped by name, e.g. all 1234.jsonl files are merged into 1234.jsonl
+    in OUTPUT_DIR together with the messages it already holds. Of messages with the
+    same id the one from the file given last is kept.
+
+    With --group, the messages are merged with those the group stores, profiles
+    injected by get are stored and the channels are added to the group's members.
+    """
+    channels: Dict[str, List[Path]] = {}
+    for file in files:
+        channels.setdefault(Path(file).stem, []).append(Path(file))
+    conf = None if group_name is None else _guarded_group_load(Path(), group_name)
+    storage = conf.storage if conf is not None else JSONLStorage(Path(output_dir))
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    _temp_dir = Path(temp_dir) if temp_dir is not None else None
+
+    profiles: Dict[int, Dict] = {}
+
+    def _collect_profile(message: Dict):
+        user = message.get("user")
+        if isinstance(user, dict) and "id" in user:
+            profiles[user["id"]] = user
+
+    merged: List[str] = []
+    for channel, paths in channels.items():
+        if conf is not None and not channel.isnumeric():
+            log.warning(f"Skipping {channel}, group members are named by their id.")
+            continue
+        sources = [
+            storage.iter_encoded(channel),
+            *(file_lines(path) for path in paths),
+        ]
+        try:
+            with storage.replace_member(channel) as writer:
+                read, written = merge_messages(
+                    sources, writer, run_size, _temp_dir, _collect_profile
+                )
+        except LockedError:
+            log.error(f"{channel} is being written by another process. Skipping.")
+            continue
+        log.info(f"Merged {read} messages of {channel} into {written}.")
+        merged.append(channel)
+
+    if conf is not None:
+        conf.add_members(merged)
+        for profile in profiles.values():
+            if storage.get_profile(str(profile["id"])) is None:
+                storage.add_profile(profile)
+        conf.checkpoint(force=True)
 
 
 # if __name__ == "main":
@@ -0,0 +1,131 @@
+"""Merge message files into one file sorted by id, using bounded memory.
+
+``get`` appends to ``<id>.jsonl`` files, which thus hold messages in the order they
+were retrieved, forward or backward, and messages retrieved repeatedly. Merging
+reads the files in runs of at most ``RUN_SIZE`` messages, sorts each run and spills
+it to a temporary file. The sorted runs are then merged with a k-way merge, which
+holds a single message per run in memory.
+
+Of messages with the same id the one read last is kept, thus later files replace
+earlier ones.
+"""
+import heapq
+import tempfile
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import ujson
+from loguru import logger as log
+
+if TYPE_CHECKING:
+    from .storage import MessageWriter
+
+RUN_SIZE = 100_000
+"""Number of messages sorted in memory at once."""
+
+Record = Tuple[int, int, str, str]
+"""A message's id, its position among all messages read, its date and its JSON."""
+
+# pylint: disable=c-extension-no-member
+
+
+def merge_messages(
+    sources: Iterable[Iterable[str]],
+    writer: "MessageWriter",
+    run_size: int = RUN_SIZE,
+    temp_dir: Optional[Path] = None,
+    on_message: Optional[Callable[[Dict], None]] = None,
+) -> Tuple[int, int]:
+    """Write the messages of several sources sorted by id and without duplicates.
+
+    Args:
+        sources: the sources, each an iterable of JSON lines, e.g. an open file.
+        writer: the writer to write the merged messages to.
+        run_size: number of messages sorted in memory at once.
+        temp_dir: directory for the spilled runs, defaults to the system's.
+        on_message: called with each message read.
+
+    Returns:
+        Tuple[int, int] : number of messages read and written.
+    """
+    with tempfile.TemporaryDirectory(dir=temp_dir, prefix="tegracli-") as spill_dir:
+        spilled, last_run = _sorted_runs(sources, run_size, Path(spill_dir), on_message)
+        runs = [_read_run(path) for path in spilled]
+        written = 0
+        for message_id, _, date, data in _unique(heapq.merge(*runs, last_run)):
+            writer.write_encoded(message_id, date or None, data)
+            written += 1
+        read = len(spilled) * run_size + len(last_run)
+    return read, written
+
+
+def file_lines(path: Path) -> Iterator[str]:
+    """Read the lines of a file, which is only opened once they are iterated."""
+    with path.open("r", encoding="utf8") as file:
+        yield from file
+
+
+def _sorted_runs(
+    sources: Iterable[Iterable[str]],
+    run_size: int,
+    spill_dir: Path,
+    on_message: Optional[Callable[[Dict], None]],
+) -> Tuple[List[Path], List[Record]]:
+    """Split the sources into sorted runs, all but the last are spilled to disk."""
+    spilled: List[Path] = []
+    run: List[Record] = []
+    position = 0
+    for source in sources:
+        for line in source:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            try:
+                message = ujson.loads(line)
+            except ValueError:
+                log.warning("Skipping undecodable line.")
+                continue
+            if on_message is not None:
+                on_message(message)
+            run.append((int(message["id"]), position, message.get("date") or "", line))
+            position += 1
+            if len(run) >= run_size:
+                spilled.append(_spill(run, spill_dir / f"{len(spilled):05d}.run"))
+                run = []
+    run.sort()
+    return spilled, run
+
+
+def _spill(run: List[Record], path: Path) -> Path:
+    run.sort()
+    with path.open("w", encoding="utf8") as file:
+        for message_id, position, date, data in run:
+            file.write(f"{message_id}\t{position}\t{date}\t{data}\n")
+    return path
+
+
+def _read_run(path: Path) -> Iterator[Record]:
+    with path.open("r", encoding="utf8") as file:
+        for line in file:
+            message_id, position, date, data = line.rstrip("\n").split("\t", 3)
+            yield int(message_id), int(position), date, data
+
+
+def _unique(records: Iterable[Record]) -> Iterator[Record]:
+    """Keep the last of consecutive records with the same id."""
+    previous: Optional[Record] = None
+    for record in records:
+        if previous is not None and record[0] != previous[0]:
+            yield previous
+        previous = record
+    if previous is not None:
+        yield previous
@@ -0,0 +1,114 @@
+"""Pace the requests of long retrievals.
+
+``iter_messages`` requests messages in chunks of 100 and can pause a fixed
+``wait_time`` between the requests. A fixed pause is either too long, which makes
+large backfills slow, or too short, which makes Telegram answer with FloodWaitErrors.
+
+A ``Pacer`` starts without pauses and backs off whenever a request ran into a
+FloodWaitError, whether Telethon slept through it or raised it. Each request
+answered without one shortens the pause again. Pacers are kept per client, thus all
+retrievals of an account share what was learned about its limits.
+"""
+from typing import Any, AsyncIterable, AsyncIterator, Dict, TypeVar
+from weakref import WeakKeyDictionary
+
+T = TypeVar("T")
+
+MAX_WAIT = 10.0
+"""Longest pause between two requests in seconds."""
+BACKOFF = 1.0
+"""First pause after a FloodWaitError, it doubles with every further one."""
+RECOVERY = 0.8
+"""Factor the pause shrinks by with every request answered without a flood wait."""
+
+
+class Pacer:
+    """Adapts the pause between requests to the flood waits encountered.
+
+    Args:
+        max_wait: longest pause between two requests in seconds.
+    """
+
+    def __init__(self, max_wait: float = MAX_WAIT) -> None:
+        self.max_wait = max_wait
+        self.wait = 0.0
+        self.floods = 0
+        self._last_due = 0.0
+
+    def backoff(self) -> None:
+        """Lengthen the pause after a flood wait."""
+        self.floods += 1
+        self.wait = min(self.max_wait, max(BACKOFF, self.wait * 2))
+
+    def recover(self) -> None:
+        """Shorten the pause after a request answered without a flood wait."""
+        self.wait *= RECOVERY
+        if self.wait < 0.1:
+            self.wait = 0.0
+
+    def observe(self, client) -> bool:
+        """Back off if the client ran into a flood wait since the last observation.
+
+        Telethon notes the end of each flood wait per request type, including those
+        it sleeps through silently.
+
+        Returns:
+            bool : True if the client ran into a flood wait.
+        """
+        due = _latest_flood_wait(client)
+        if due > self._last_due:
+            self._last_due = due
+            self.backoff()
+            return True
+        self.recover()
+        return False
+
+
+_pacers: "WeakKeyDictionary[Any, Pacer]" = WeakKeyDictionary()
+
+
+def pacer_for(client) -> Pacer:
+    """Get the pacer of a client, flood waits from before its creation are ignored."""
+    pacer = _pacers.get(client)
+    if pacer is None:
+        pacer = _pacers[client] = Pacer()
+        pacer._last_due = _latest_flood_wait(client)  # pylint: disable=protected-access
+    return pacer
+
+
+def _latest_flood_wait(client) -> float:
+    waited: Dict[int, float] = getattr(client, "_flood_waited_requests", None) or {}
+    return max(waited.values(), default=0.0)
+
+
+def paced(iterable: AsyncIterable[T], pacer: Pacer, client) -> AsyncIterable[T]:
+    """Pause between the requests of a Telethon ``RequestIter`` as ``pacer`` says.
+
+    Args:
+        iterable: the iterator, e.g. ``client.iter_messages``.
+        pacer: the pacer to follow and to inform about flood waits.
+        client: the client sending the requests.
+
+    Returns:
+        AsyncIterable : the iterable, unchanged if it cannot be paced.
+    """
+    if not hasattr(iterable, "wait_time"):
+        return iterable
+    return _paced(iterable, pacer, client)
+
+
+async def _paced(iterable, pacer: Pacer, client) -> AsyncIterator:
+    iterator = iterable.__aiter__()
+    while True:
+        # a request is sent once the buffered chunk is used up
+        requesting = iterator.buffer is None or iterator.index == len(iterator.buffer)
+        if requesting:
+            iterator.wait_time = pacer.wait
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            if requesting:
+                pacer.observe(client)
+        yield item
@@ -0,0 +1,141 @@
+"""Measure where a run spends its time.
+
+Stages of a run, e.g. ``fetch`` or ``serialize``, are wrapped into spans which sum up
+their wall-clock and CPU time. Spans cost next to nothing while profiling is disabled.
+Stages are measured exclusively of each other, except for concurrently running tasks,
+e.g. members backfilled at once, whose spans overlap.
+
+Stages:
+    entity: resolving members and channels to entities and profiles.
+    resume: looking up the last stored message of a member.
+    fetch: waiting for Telegram to return messages.
+    serialize: converting messages to JSON.
+    write: writing messages to files, databases or sinks.
+    persist: saving group configurations.
+"""
+import time
+from contextlib import nullcontext
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+_NULL_SPAN = nullcontext()
+
+
+class Profiler:
+    """Accumulates the time spent per stage."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, List[float]] = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, wall: float, cpu: float) -> None:
+        """Account a span's times to a stage."""
+        totals = self.stages.setdefault(stage, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += wall
+        totals[2] += cpu
+
+    def report(self) -> List[Dict]:
+        """Get the stages' totals, most time-consuming first."""
+        return [
+            {"stage": stage, "calls": int(calls), "wall": wall, "cpu": cpu}
+            for stage, (calls, wall, cpu) in sorted(
+                self.stages.items(), key=lambda item: item[1][1], reverse=True
+            )
+        ]
+
+    def summary(self) -> str:
+        """Format the report as a table."""
+        elapsed = time.perf_counter() - self.started
+        lines = [
+            f"{'stage':<10} {'calls':>9} {'wall s':>10} {'cpu s':>10} {'wall %':>7}"
+        ]
+        for row in self.report():
+            share = row["wall"] / elapsed * 100 if elapsed else 0.0
+            lines.append(
+                f"{row['stage']:<10} {row['calls']:>9} {row['wall']:>10.3f} "
+                + f"{row['cpu']:>10.3f} {share:>7.1f}"
+            )
+        lines.append(f"{'total':<10} {'':>9} {elapsed:>10.3f}")
+        return "\n".join(lines)
+
+
+class _Span:
+    def __init__(self, profiler: Profiler, stage: str) -> None:
+        self.profiler = profiler
+        self.stage = stage
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self) -> None:
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *args) -> None:
+        self.profiler.add(
+            self.stage,
+            time.perf_counter() - self.wall,
+            time.process_time() - self.cpu,
+        )
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    """Start profiling."""
+    global _profiler  # pylint: disable=global-statement
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    """Stop profiling.
+
+    Returns:
+        Optional[Profiler] : the profiler that was active.
+    """
+    global _profiler  # pylint: disable=global-statement
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def span(stage: str):
+    """Measure a block of code as part of a stage.
+
+    Args:
+        stage: name of the stage.
+
+    Returns:
+        a context manager measuring its block.
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _Span(_profiler, stage)
+
+
+def timed(iterable: AsyncIterable[T], stage: str) -> AsyncIterable[T]:
+    """Measure the time spent waiting for each item of an async iterable.
+
+    Args:
+        iterable: the iterable, e.g. ``client.iter_messages``.
+        stage: name of the stage.
+
+    Returns:
+        AsyncIterable : the iterable, unchanged if profiling is disabled.
+    """
+    if _profiler is None:
+        return iterable
+    return _timed(iterable, stage)
+
+
+async def _timed(iterable: AsyncIterable[T], stage: str) -> AsyncIterator[T]:
+    iterator = iterable.__aiter__()
+    while True:
+        with span(stage):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
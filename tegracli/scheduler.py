@@ -0,0 +1,163 @@
+"""Order the members of a group by how likely they have new content.
+
+Members are scored by the time since their last successful retrieval, weighted
+by their historical posting rate and discounted by their recent errors.
+Members that were never retrieved successfully are scheduled first.
+
+Quotas bound the number of messages a member may retrieve per run. A group's quota
+is weighted by the members' posting rates, within limits, so very active members
+get a larger share without starving the others. Members whose quota was used up
+keep a backlog and are scheduled earlier in the next run.
+"""
+from datetime import datetime
+from statistics import median
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from .group import Group
+
+RATE_SMOOTHING = 0.5
+"""Weight of the latest observation in the exponential moving average of the posting rate."""
+ERROR_DECAY = 0.5
+"""Factor the error count is multiplied with after a successful retrieval."""
+BACKLOG_BOOST = 2.0
+"""Factor the score of a member is multiplied with if it used up its last quota."""
+MESSAGES_PER_REQUEST = 100
+"""Number of messages Telegram returns per request."""
+MIN_WEIGHT = 0.5
+MAX_WEIGHT = 4.0
+"""Bounds of the factor a group's quota is weighted with per member."""
+ROUND_SIZE = 500
+"""Number of messages retrieved per member before the next member's turn."""
+
+
+def update_statistics(
+    record: Dict, messages: int, success: bool, now: Optional[float] = None
+) -> None:
+    """Update a member's state record with the outcome of a retrieval.
+
+    Args:
+        record: the member's state record, is modified in place.
+        messages: number of messages retrieved.
+        success: whether the retrieval finished without errors.
+        now: timestamp of the retrieval, defaults to now.
+    """
+    now = now if now is not None else datetime.now().timestamp()
+    if not success:
+        record["errors"] = record.get("errors", 0) + 1
+        record["last_error"] = now
+        return
+
+    last_success = record.get("last_success")
+    if last_success is not None and now > last_success:
+        rate = messages / ((now - last_success) / 86400)
+        previous = record.get("rate")
+        record["rate"] = (
+            rate
+            if previous is None
+            else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * previous
+        )
+    record["last_success"] = now
+    record["errors"] = record.get("errors", 0) * ERROR_DECAY
+
+
+def priority(record: Dict, now: float) -> float:
+    """Score a member, higher scores are scheduled first.
+
+    Args:
+        record: the member's state record.
+        now: the current timestamp.
+
+    Returns:
+        float : the member's score.
+    """
+    last_success = record.get("last_success")
+    if last_success is None:
+        return float("inf")
+    staleness = max(now - last_success, 0) / 3600
+    expected_messages = staleness / 24 * (record.get("rate") or 0)
+    score = (staleness + expected_messages) / (1 + record.get("errors", 0)) ** 2
+    return score * BACKLOG_BOOST if record.get("backlog") else score
+
+
+def schedule(group: "Group", now: Optional[float] = None) -> List[str]:
+    """Order the active members of a group by priority.
+
+    Args:
+        group: the group to schedule.
+        now: the current timestamp, defaults to now.
+
+    Returns:
+        List[str] : active members, highest priority first.
+    """
+    now = now if now is not None else datetime.now().timestamp()
+    members = group.members
+    scores = {
+        member: priority(group.get_member_state(member) or {}, now)
+        for member in members
+    }
+    # sorted is stable, members with equal scores keep their configured order
+    return sorted(members, key=lambda member: scores[member], reverse=True)
+
+
+def quota_messages(quota: Optional[Dict]) -> Optional[int]:
+    """Convert a quota of ``messages`` and ``requests`` into a number of messages.
+
+    Args:
+        quota: the quota, either key may be missing.
+
+    Returns:
+        Optional[int] : the number of messages, None if unlimited.
+    """
+    limits = []
+    if quota and quota.get("messages") is not None:
+        limits.append(quota["messages"])
+    if quota and quota.get("requests") is not None:
+        limits.append(quota["requests"] * MESSAGES_PER_REQUEST)
+    return min(limits) if limits else None
+
+
+def weight(record: Dict, median_rate: float) -> float:
+    """Weight a member's share of its group's quota by its posting rate.
+
+    Args:
+        record: the member's state record.
+        median_rate: the median posting rate of the group's members.
+
+    Returns:
+        float : the factor, 1 for members without a known rate.
+    """
+    rate = record.get("rate")
+    if not rate or not median_rate:
+        return 1.0
+    return min(MAX_WEIGHT, max(MIN_WEIGHT, (rate / median_rate) ** 0.5))
+
+
+def budgets(group: "Group") -> Dict[str, Optional[int]]:
+    """Get the number of messages each active member may retrieve in a run.
+
+    Members with a quota of their own get exactly that. The others share the
+    group's quota, or its ``limit`` parameter, weighted by their posting rates.
+
+    Args:
+        group: the group to budget.
+
+    Returns:
+        Dict[str, Optional[int]] : the budget per member, None if unlimited.
+    """
+    base = quota_messages(getattr(group, "quota", None))
+    limit = (group.params or {}).get("limit")
+    if limit is not None and limit > 0:
+        base = limit if base is None else min(base, limit)
+    records = {member: group.get_member_state(member) or {} for member in group.members}
+    rates = [record["rate"] for record in records.values() if record.get("rate")]
+    median_rate = median(rates) if rates else 0.0
+    result: Dict[str, Optional[int]] = {}
+    for member, record in records.items():
+        if record.get("quota"):
+            result[member] = quota_messages(record["quota"])
+        elif base is not None:
+            result[member] = max(1, round(base * weight(record, median_rate)))
+        else:
+            result[member] = None
+    return result
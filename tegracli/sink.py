@@ -0,0 +1,167 @@
+"""Stream messages to stdout, a named pipe or a local socket.
+
+Instead of files in the working directory, messages are written as newline-delimited
+JSON to a single sink, each wrapped into an envelope that names the command or group
+it was retrieved by and the member or query it belongs to:
+
+    {"source": "get", "member": "1234", "message": {...}}
+
+Writes are buffered and flushed once ``BUFFER_SIZE`` bytes are pending. A flush blocks
+until the consumer accepted the data. Writers run in the I/O executor, thus a slow
+consumer fills their queues and ``drain`` slows down the retrieval to its pace.
+"""
+import socket
+import sys
+import threading
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, List, Optional
+
+import ujson
+
+from .storage import EncodedMessage, MessageWriter
+
+BUFFER_SIZE = 64 * 1024
+"""Number of bytes collected before they are written to the sink."""
+
+# pylint: disable=c-extension-no-member
+
+
+class Sink:
+    """Buffered NDJSON output shared by the writers of all members.
+
+    Writes and flushes hold a lock, as the writers of several members may run in
+    different threads.
+
+    Args:
+        stream: binary stream to write to.
+        buffer_size: number of bytes collected before writing them.
+        on_close: called after the final flush, e.g. to close a socket.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        buffer_size: int = BUFFER_SIZE,
+        on_close: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.on_close = on_close
+        self._buffer = bytearray()
+        self._lock = threading.RLock()
+
+    def write(self, data: bytes) -> None:
+        """Buffer data and write it once the buffer is full."""
+        with self._lock:
+            self._buffer += data
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered data."""
+        with self._lock:
+            if self._buffer:
+                self.stream.write(self._buffer)
+                self._buffer.clear()
+            self.stream.flush()
+
+    def writer(self, source: str, member: str) -> "SinkWriter":
+        """Create a writer wrapping messages into envelopes.
+
+        Args:
+            source: the command or group the messages are retrieved by.
+            member: the member or query the messages belong to.
+
+        Returns:
+            SinkWriter : the writer.
+        """
+        return SinkWriter(self, source, member)
+
+    def close(self) -> None:
+        """Flush and release the sink."""
+        self.flush()
+        if self.on_close is not None:
+            self.on_close()
+
+    def __enter__(self) -> "Sink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class SinkWriter(MessageWriter):
+    """Write messages into a ``Sink``, wrapped into an envelope."""
+
+    def __init__(self, sink: Sink, source: str, member: str) -> None:
+        self.sink = sink
+        # the already encoded message is spliced in, saving a decode and encode
+        self._prefix = (
+            '{"source":'
+            + ujson.dumps(source, ensure_ascii=True)
+            + ',"member":'
+            + ujson.dumps(member, ensure_ascii=True)
+            + ',"message":'
+        )
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        self.sink.write(f"{self._prefix}{data}}}\n".encode("ascii"))
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        self.sink.write(
+            "".join(f"{self._prefix}{data}}}\n" for _, _, data in messages).encode(
+                "ascii"
+            )
+        )
+
+
+class TeeWriter(MessageWriter):
+    """Write messages to several writers."""
+
+    def __init__(self, *writers: MessageWriter) -> None:
+        self.writers: List[MessageWriter] = list(writers)
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        for writer in self.writers:
+            writer.write_encoded(message_id, date, data)
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        messages = list(messages)
+        for writer in self.writers:
+            writer.write_many(messages)
+
+    def close(self) -> None:
+        for writer in self.writers:
+            writer.close()
+
+
+def open_sink(target: str) -> Sink:
+    """Open a sink.
+
+    Args:
+        target: ``-`` for stdout, ``unix:PATH`` for a Unix domain socket,
+            ``tcp:HOST:PORT`` for a TCP socket or the path of a file or named pipe.
+
+    Returns:
+        Sink : the opened sink.
+    """
+    if target == "-":
+        return Sink(sys.stdout.buffer)
+    if target.startswith(("unix:", "tcp:")):
+        scheme, address = target.split(":", 1)
+        if scheme == "unix":
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(address)
+        else:
+            host, port = address.rsplit(":", 1)
+            connection = socket.create_connection((host, int(port)))
+        stream = connection.makefile("wb")
+
+        def _close():
+            stream.close()
+            connection.close()
+
+        return Sink(stream, on_close=_close)
+    # opening a named pipe blocks until a reader is connected
+    stream = Path(target).open("ab")  # pylint: disable=consider-using-with
+    return Sink(stream, on_close=stream.close)
@@ -0,0 +1,264 @@
+"""Summarize the messages collected by a group.
+
+Per member this counts messages, determines the covered date and id range, gaps in
+the id sequence and the most frequent sources of forwarded messages.
+
+Member files are read in chunks with pandas and scanned in a process pool. Summaries
+are cached per file in ``.stats_cache.json`` inside the group directory together with
+the file's size and modification time, so a rerun only reads data appended since.
+"""
+import io
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from .gaps import count_ids, id_runs, merge_runs
+from .group import Group
+from .storage import JSONLStorage
+
+CACHE_FILE_NAME = ".stats_cache.json"
+CHUNK_SIZE = 10_000
+"""Number of messages parsed at once."""
+TOP_FORWARDS = 5
+"""Number of forward sources listed in the report."""
+
+Summary = Dict
+
+
+def empty_summary() -> Summary:
+    """A summary of no messages."""
+    return {
+        "count": 0,
+        "min_id": None,
+        "max_id": None,
+        "first_date": None,
+        "last_date": None,
+        "runs": [],
+        "forwards": {},
+    }
+
+
+def _peer_key(header) -> Optional[str]:
+    """Identify the source of a forwarded message."""
+    if not isinstance(header, dict):
+        return None
+    peer = header.get("from_id")
+    if isinstance(peer, dict):
+        for key in ("channel_id", "user_id", "chat_id"):
+            if key in peer:
+                return str(peer[key])
+    return header.get("from_name")
+
+
+def _pick(func, *values):
+    present = [value for value in values if value is not None]
+    return func(present) if present else None
+
+
+def merge_summaries(left: Summary, right: Summary) -> Summary:
+    """Combine the summaries of two sets of messages."""
+    return {
+        "count": left["count"] + right["count"],
+        "min_id": _pick(min, left["min_id"], right["min_id"]),
+        "max_id": _pick(max, left["max_id"], right["max_id"]),
+        "first_date": _pick(min, left["first_date"], right["first_date"]),
+        "last_date": _pick(max, left["last_date"], right["last_date"]),
+        "runs": merge_runs(left["runs"], right["runs"]),
+        "forwards": dict(Counter(left["forwards"]) + Counter(right["forwards"])),
+    }
+
+
+def summarize_frame(frame: pd.DataFrame) -> Summary:
+    """Summarize a chunk of messages.
+
+    Args:
+        frame: messages as read by ``pandas.read_json``.
+
+    Returns:
+        Summary : the chunk's summary.
+    """
+    summary = empty_summary()
+    if frame.empty or "id" not in frame:
+        return summary
+    ids = pd.to_numeric(frame["id"], errors="coerce").dropna().astype("int64")
+    summary["count"] = int(ids.size)
+    if ids.size:
+        summary["min_id"] = int(ids.min())
+        summary["max_id"] = int(ids.max())
+        summary["runs"] = id_runs(ids.tolist())
+    if "date" in frame:
+        dates = frame["date"].dropna().astype(str)
+        if dates.size:
+            summary["first_date"] = dates.min()
+            summary["last_date"] = dates.max()
+    if "fwd_from" in frame:
+        sources = frame["fwd_from"].dropna().map(_peer_key).dropna()
+        summary["forwards"] = {
+            str(key): int(value) for key, value in sources.value_counts().items()
+        }
+    return summary
+
+
+def summarize_file(path: Path, offset: int = 0) -> Tuple[Summary, int]:
+    """Summarize the complete lines of a JSONL file starting at ``offset``.
+
+    Args:
+        path: the JSONL file.
+        offset: byte offset to start reading from.
+
+    Returns:
+        Tuple[Summary, int] : the summary and the offset after the last complete line.
+    """
+    with path.open("rb") as file:
+        file.seek(offset)
+        data = file.read()
+    end = data.rfind(b"\n") + 1
+    summary = empty_summary()
+    if end == 0:
+        return summary, offset
+    reader = pd.read_json(
+        io.BytesIO(data[:end]),
+        lines=True,
+        chunksize=CHUNK_SIZE,
+        dtype=False,
+        convert_dates=False,
+    )
+    with reader:
+        for frame in reader:
+            summary = merge_summaries(summary, summarize_frame(frame))
+    return summary, offset + end
+
+
+def summarize_records(records: Iterable[Dict]) -> Summary:
+    """Summarize messages given as dicts, e.g. from a storage backend."""
+    summary = empty_summary()
+    chunk: List[Dict] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= CHUNK_SIZE:
+            summary = merge_summaries(summary, summarize_frame(pd.DataFrame(chunk)))
+            chunk = []
+    if chunk:
+        summary = merge_summaries(summary, summarize_frame(pd.DataFrame(chunk)))
+    return summary
+
+
+def _summarize_job(job: Tuple[str, int]) -> Tuple[Summary, int]:
+    path, offset = job
+    return summarize_file(Path(path), offset)
+
+
+def _load_cache(path: Path) -> Dict:
+    if not path.exists():
+        return {}
+    try:
+        with path.open("r", encoding="utf8") as file:
+            return json.load(file)
+    except ValueError:
+        return {}
+
+
+def _ends_line(path: Path, offset: int) -> bool:
+    """Check whether ``offset`` is the start of a line in a file."""
+    if offset == 0:
+        return True
+    with path.open("rb") as file:
+        file.seek(offset - 1)
+        return file.read(1) == b"\n"
+
+
+def group_summaries(group: Group, workers: int = 0) -> Dict[str, Summary]:
+    """Summarize the messages of each member of a group.
+
+    Args:
+        group: the group to summarize.
+        workers: number of processes scanning files, 0 scans inline.
+
+    Returns:
+        Dict[str, Summary] : summaries by member.
+    """
+    storage = group.storage
+    if not isinstance(storage, JSONLStorage):
+        return {
+            member: summarize_records(storage.iter_messages(member))
+            for member in storage.members()
+        }
+
+    cache_path = Path(group.name) / CACHE_FILE_NAME
+    cache = _load_cache(cache_path)
+    summaries: Dict[str, Summary] = {}
+    jobs: Dict[str, Tuple[str, int]] = {}
+    for member in storage.members():
+        path = Path(group.name) / f"{member}.jsonl"
+        stat = path.stat()
+        entry = cache.get(member)
+        # compact and merge replace files, which usually changes their size as well
+        if entry and entry.get("inode") != stat.st_ino:
+            entry = None
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            summaries[member] = entry["summary"]
+            continue
+        if entry and entry["size"] < stat.st_size and _ends_line(path, entry["offset"]):
+            # the file was appended to, only read the new lines
+            summaries[member] = entry["summary"]
+            jobs[member] = (str(path), entry["offset"])
+        else:
+            summaries[member] = empty_summary()
+            jobs[member] = (str(path), 0)
+        cache[member] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "inode": stat.st_ino,
+        }
+
+    if workers > 0:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_summarize_job, jobs.values()))
+    else:
+        results = [_summarize_job(job) for job in jobs.values()]
+
+    for member, (summary, offset) in zip(jobs, results):
+        summaries[member] = merge_summaries(summaries[member], summary)
+        cache[member].update(offset=offset, summary=summaries[member])
+
+    with cache_path.open("w", encoding="utf8") as file:
+        json.dump(cache, file)
+    return summaries
+
+
+def report(summaries: Dict[str, Summary]) -> List[Dict]:
+    """Turn summaries into report rows.
+
+    Args:
+        summaries: summaries by member.
+
+    Returns:
+        List[Dict] : one row per member.
+    """
+    rows = []
+    for member, summary in sorted(summaries.items()):
+        runs = summary["runs"]
+        missing = (
+            summary["max_id"] - summary["min_id"] + 1 - count_ids(runs) if runs else 0
+        )
+        forwards = Counter(summary["forwards"]).most_common(TOP_FORWARDS)
+        rows.append(
+            {
+                "member": member,
+                "messages": summary["count"],
+                "first_date": summary["first_date"],
+                "last_date": summary["last_date"],
+                "min_id": summary["min_id"],
+                "max_id": summary["max_id"],
+                "gaps": max(len(runs) - 1, 0),
+                "missing_ids": missing,
+                "top_forwards": ", ".join(
+                    f"{key} ({count})" for key, count in forwards
+                ),
+            }
+        )
+    return rows
@@ -0,0 +1,760 @@
+"""Storage backends for group archives.
+
+A group stores its messages and the profiles of its members either as
+one ``<member>.jsonl`` file per member (the default) or in a single SQLite
+database, ``messages.db``, inside the group directory.
+"""
+import mmap
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from contextlib import contextmanager
+from io import TextIOWrapper
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import ujson
+from loguru import logger as log
+
+from .idset import IdSet
+from .merge import merge_messages
+from .profiling import span
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, files are not locked there
+    fcntl = None  # type: ignore
+
+PROF_FILE_NAME = "profiles.jsonl"
+DB_FILE_NAME = "messages.db"
+TAIL_SIZE = 16
+"""Number of records read from the end of a file to determine the last message."""
+ROW_BATCH = 1000
+"""Number of rows fetched from SQLite at once."""
+INDEX_SUFFIX = ".ids"
+"""Suffix of the id index next to a member's JSONL file."""
+
+EncodedMessage = Tuple[int, Optional[str], str]
+
+# pylint: disable=c-extension-no-member
+
+
+def _cast_member(member: Union[str, int]) -> Union[str, int]:
+    """Cast numeric member strings to int, as Telegram ids are stored as ints."""
+    if isinstance(member, str) and str.isnumeric(member):
+        return int(member)
+    return member
+
+
+def tail_lines(path: Path, count: int) -> List[bytes]:
+    """Read the last lines of a file by scanning it backwards.
+
+    The file is memory-mapped, thus only its end is actually read. A final line
+    without a trailing newline is returned as well, it might be torn by an
+    interrupted write though.
+
+    Args:
+        path: the file to read.
+        count: maximal number of lines to return.
+
+    Returns:
+        List[bytes] : up to ``count`` non-empty lines, in file order.
+    """
+    lines: List[bytes] = []
+    with path.open("rb") as file:
+        if path.stat().st_size == 0:
+            return lines
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            end = len(mapped)
+            while end > 0 and len(lines) < count:
+                start = mapped.rfind(b"\n", 0, end) + 1
+                line = mapped[start:end].strip()
+                if line:
+                    lines.append(line)
+                end = start - 1
+    lines.reverse()
+    return lines
+
+
+def tail_records(path: Path, count: int) -> List[Dict]:
+    """Read the last JSON records of a JSONL file, skipping undecodable lines.
+
+    Args:
+        path: the JSONL file to read.
+        count: maximal number of lines to read.
+
+    Returns:
+        List[Dict] : the decoded records, in file order.
+    """
+    records = []
+    for line in tail_lines(path, count):
+        try:
+            records.append(ujson.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+class LockedError(RuntimeError):
+    """A file is locked by another process."""
+
+
+def lock_file(file: IO, blocking: bool = True) -> None:
+    """Lock an open file exclusively, the lock is released when the file is closed.
+
+    Args:
+        file: the open file.
+        blocking: wait for the lock rather than raising a ``LockedError``.
+    """
+    if fcntl is None:
+        return
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(file.fileno(), flags)
+    except BlockingIOError as error:
+        raise LockedError(f"{file.name} is locked by another process.") from error
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a lock file while running a block."""
+    with path.open("a", encoding="utf8") as file:
+        lock_file(file)
+        yield
+
+
+class MessageWriter:
+    """Write message dicts to a storage backend."""
+
+    def write(self, m_dict: Dict) -> None:
+        """Write a single message.
+
+        Args:
+            m_dict: the message, already converted by ``str_dict``.
+        """
+        self.write_encoded(
+            int(m_dict["id"]),
+            m_dict.get("date"),
+            ujson.dumps(m_dict, ensure_ascii=True),
+        )
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        """Write a single message that is already encoded to JSON.
+
+        Args:
+            message_id: the message's id.
+            date: the message's date as converted by ``str_dict``.
+            data: the JSON-encoded message.
+        """
+        raise NotImplementedError
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        """Write a chunk of messages that are already encoded to JSON.
+
+        Args:
+            messages: the messages' ids, dates and JSON.
+        """
+        for encoded in messages:
+            self.write_encoded(*encoded)
+
+    async def drain(self) -> None:
+        """Wait until further messages may be written, writers writing in the
+        background wait while too many writes are pending."""
+
+    def flush(self) -> None:
+        """Write the messages written so far through to disk."""
+
+    def close(self) -> None:
+        """Flush pending messages."""
+
+
+def sync_file(file: IO) -> None:
+    """Flush a file and write it through to disk, pipes and terminals are only
+    flushed."""
+    file.flush()
+    try:
+        os.fsync(file.fileno())
+    except OSError:
+        pass
+
+
+class JSONLWriter(MessageWriter):
+    """Write messages as JSON lines into an open file."""
+
+    def __init__(self, file: TextIOWrapper) -> None:
+        self.file = file
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        self.file.write(data + "\n")
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        self.file.write("".join(f"{data}\n" for _, _, data in messages))
+
+    def flush(self) -> None:
+        sync_file(self.file)
+
+
+class SQLiteWriter(MessageWriter):
+    """Write messages into the ``messages`` table in batched transactions.
+
+    Messages already stored are kept, unless ``replace`` is set. Transactions hold
+    ``lock``, which is shared with the other users of the connection.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        connection: sqlite3.Connection,
+        chat_id: str,
+        batch_size: int = 500,
+        replace: bool = False,
+        lock: Optional[threading.RLock] = None,
+    ) -> None:
+        self.connection = connection
+        self.chat_id = chat_id
+        self.batch_size = batch_size
+        self.replace = replace
+        self.lock = lock or threading.RLock()
+        self._batch: List[tuple] = []
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        self._batch.append((self.chat_id, message_id, date, data))
+        if len(self._batch) >= self.batch_size:
+            self.close()
+
+    def write_many(self, messages: Iterable[EncodedMessage]) -> None:
+        self._batch.extend(
+            (self.chat_id, message_id, date, data)
+            for message_id, date, data in messages
+        )
+        if len(self._batch) >= self.batch_size:
+            self.close()
+
+    def flush(self) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if not self._batch:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR {'REPLACE' if self.replace else 'IGNORE'} INTO messages "
+                + "(chat_id, id, date, data) VALUES (?, ?, ?, ?)",
+                self._batch,
+            )
+        self._batch = []
+
+
+class ShardedJSONLWriter(MessageWriter):
+    """Write messages as JSON lines into numbered files of limited size.
+
+    Shards are named after ``path``, e.g. ``out.00000.jsonl``, ``out.00001.jsonl``.
+    Numbering continues after the highest shard that already exists.
+
+    Args:
+        path: template for the shards' names.
+        shard_size: maximal number of messages per shard.
+    """
+
+    def __init__(self, path: Path, shard_size: int) -> None:
+        self.path = path
+        self.shard_size = shard_size
+        self._index = self._next_index()
+        self._count = 0
+        self._file: Optional[TextIOWrapper] = None
+
+    def _next_index(self) -> int:
+        pattern = re.compile(
+            rf"{re.escape(self.path.stem)}\.(\d{{5,}}){re.escape(self.path.suffix)}"
+        )
+        numbers = [
+            int(match.group(1))
+            for match in map(pattern.fullmatch, os.listdir(self.path.parent))
+            if match is not None
+        ]
+        return max(numbers) + 1 if numbers else 0
+
+    def _shard_path(self) -> Path:
+        return self.path.with_name(
+            f"{self.path.stem}.{self._index:05d}{self.path.suffix}"
+        )
+
+    def write_encoded(self, message_id: int, date: Optional[str], data: str) -> None:
+        if self._file is None or self._count >= self.shard_size:
+            self.close()
+            self._file = self._shard_path().open(  # pylint: disable=consider-using-with
+                "x", encoding="utf8"
+            )
+            self._index += 1
+            self._count = 0
+        self._file.write(data + "\n")
+        self._count += 1
+
+    def flush(self) -> None:
+        if self._file is not None:
+            sync_file(self._file)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def as_writer(file: Union[TextIOWrapper, MessageWriter]) -> MessageWriter:
+    """Wrap plain files into a ``JSONLWriter``, pass writers through."""
+    if isinstance(file, MessageWriter):
+        return file
+    return JSONLWriter(file)
+
+
+class Storage:
+    """Interface of a group's storage backend."""
+
+    backend = ""
+
+    def __init__(self, group_dir: Path) -> None:
+        self.group_dir = group_dir
+
+    def prepare(self) -> None:
+        """Create files or tables the backend needs."""
+
+    @contextmanager
+    def open_member(self, member: str) -> Iterator[MessageWriter]:
+        """Open a writer for a member's messages."""
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable
+
+    @contextmanager
+    def replace_member(self, member: str) -> Iterator[MessageWriter]:
+        """Open a writer for a complete, sorted history of a member.
+
+        The messages written replace the stored ones, stored messages that are not
+        written again may be lost.
+        """
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable
+
+    def members(self) -> List[str]:
+        """List all members with stored messages."""
+        raise NotImplementedError
+
+    def iter_messages(self, member: str) -> Iterator[Dict]:
+        """Iterate over all stored messages of a member."""
+        raise NotImplementedError
+
+    def iter_encoded(self, member: str) -> Iterator[str]:
+        """Iterate over all stored messages of a member, encoded to JSON."""
+        for message in self.iter_messages(member):
+            yield ujson.dumps(message, ensure_ascii=True)
+
+    def message_ids(self, member: str) -> List[int]:
+        """Get the ids of all stored messages of a member."""
+        return [int(message["id"]) for message in self.iter_messages(member)]
+
+    def id_set(self, member: str) -> IdSet:
+        """Get the ids of all stored messages of a member as a compact set."""
+        return IdSet(int(message["id"]) for message in self.iter_messages(member))
+
+    def last_message_id(self, member: str) -> Optional[int]:
+        """Get the highest stored message id of a member."""
+        return self.id_set(member).max()
+
+    def compact(self, member: str) -> None:
+        """Sort a member's messages by id and drop duplicates."""
+
+    def get_profile(self, member: str) -> Optional[Dict]:
+        """Look up a stored profile by id or username."""
+        raise NotImplementedError
+
+    def iter_profiles(self) -> Iterator[Dict]:
+        """Iterate over all stored profiles."""
+        raise NotImplementedError
+
+    def add_profile(self, p_dict: Dict) -> None:
+        """Store a profile."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release resources held by the backend."""
+
+
+class JSONLStorage(Storage):
+    """One ``<member>.jsonl`` file per member plus ``profiles.jsonl``."""
+
+    backend = "jsonl"
+
+    @property
+    def _profiles_path(self) -> Path:
+        return self.group_dir / PROF_FILE_NAME
+
+    def _member_path(self, member: str) -> Path:
+        return self.group_dir / (member + ".jsonl")
+
+    def _index_path(self, member: str) -> Path:
+        return self.group_dir / (member + INDEX_SUFFIX)
+
+    def prepare(self) -> None:
+        if not self._profiles_path.exists():
+            self._profiles_path.touch()
+
+    @contextmanager
+    def open_member(self, member: str) -> Iterator[MessageWriter]:
+        """Open a member's file, raises a ``LockedError`` if another process has it."""
+        with self._member_path(member).open("a", encoding="utf8") as file:
+            lock_file(file, blocking=False)
+            yield JSONLWriter(file)
+
+    @contextmanager
+    def replace_member(self, member: str) -> Iterator[MessageWriter]:
+        """Write into a temporary file, which replaces the member's file once done.
+
+        The member's file stays locked meanwhile, an error leaves it untouched.
+        """
+        member_path = self._member_path(member)
+        temp_path = member_path.with_suffix(".jsonl.tmp")
+        with member_path.open("a", encoding="utf8") as locked_file:
+            lock_file(locked_file, blocking=False)
+            try:
+                with temp_path.open("w", encoding="utf8") as file:
+                    yield JSONLWriter(file)
+                os.replace(temp_path, member_path)
+            finally:
+                if temp_path.exists():
+                    temp_path.unlink()
+
+    def members(self) -> List[str]:
+        return sorted(
+            path.stem
+            for path in self.group_dir.glob("*.jsonl")
+            if path.name != PROF_FILE_NAME
+        )
+
+    def iter_messages(self, member: str) -> Iterator[Dict]:
+        member_path = self._member_path(member)
+        if not member_path.exists():
+            return
+        with member_path.open("r", encoding="utf8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    yield ujson.loads(line)
+                except ValueError:
+                    log.warning(f"Skipping undecodable line in {member_path}.")
+
+    def iter_encoded(self, member: str) -> Iterator[str]:
+        """Iterate over the lines of a member's file, without decoding them."""
+        member_path = self._member_path(member)
+        if not member_path.exists():
+            return
+        with member_path.open("r", encoding="utf8") as file:
+            for line in file:
+                if line.strip():
+                    yield line.rstrip("\n")
+
+    def last_message_id(self, member: str) -> Optional[int]:
+        """Get the highest stored message id of a member.
+
+        Group files are written in ascending order (``reverse=True``), so only the
+        end of the file is read. If the last records are not in ascending order,
+        the entire file is scanned.
+        """
+        member_path = self._member_path(member)
+        if not member_path.exists():
+            return None
+        ids = [int(record["id"]) for record in tail_records(member_path, TAIL_SIZE)]
+        if ids and all(prev < succ for prev, succ in zip(ids, ids[1:])):
+            return ids[-1]
+        return super().last_message_id(member)
+
+    def id_set(self, member: str) -> IdSet:
+        """Get the ids of a member's messages, kept up to date in ``<member>.ids``.
+
+        The index covers the beginning of the member's file, only messages appended
+        since are read and added to it. It is rebuilt if the file was replaced.
+        """
+        member_path = self._member_path(member)
+        if not member_path.exists():
+            return IdSet()
+        stat = member_path.stat()
+        ids, covered = self._read_index(member, stat.st_ino)
+        if covered > stat.st_size:
+            ids, covered = IdSet(), 0
+        if covered == stat.st_size:
+            return ids
+
+        with member_path.open("rb") as file:
+            file.seek(covered)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # the line is still being written
+                covered += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    ids.add(int(ujson.loads(line)["id"]))
+                except ValueError:
+                    log.warning(f"Skipping undecodable line in {member_path}.")
+        self._write_index(member, ids, covered, stat.st_ino)
+        return ids
+
+    def _read_index(self, member: str, inode: int) -> Tuple[IdSet, int]:
+        """Read a member's id index and the number of bytes of the file it covers."""
+        header = array("q")
+        try:
+            with self._index_path(member).open("rb") as file:
+                header.fromfile(file, 2)
+                if header[0] != inode:
+                    return IdSet(), 0
+                return IdSet.read(file), header[1]
+        except (OSError, EOFError):
+            return IdSet(), 0
+
+    def _write_index(self, member: str, ids: IdSet, covered: int, inode: int) -> None:
+        index_path = self._index_path(member)
+        temp_path = index_path.with_suffix(f"{INDEX_SUFFIX}.{os.getpid()}.tmp")
+        try:
+            with temp_path.open("wb") as file:
+                array("q", [inode, covered]).tofile(file)
+                ids.write(file)
+            os.replace(temp_path, index_path)
+        except OSError as error:
+            log.debug(f"Could not write the id index of {member}: {error}")
+            if temp_path.exists():
+                temp_path.unlink()
+
+    def compact(self, member: str) -> None:
+        """Rewrite a member's file sorted by id and without duplicates.
+
+        The file is merged through ``replace_member`` with bounded memory and stays
+        locked meanwhile, raises a ``LockedError`` if another process has it.
+        """
+        if not self._member_path(member).exists():
+            return
+        with self.replace_member(member) as writer:
+            merge_messages([self.iter_encoded(member)], writer)
+
+    def get_profile(self, member: str) -> Optional[Dict]:
+        _member = _cast_member(member)
+        for record in self.iter_profiles():
+            if record.get("id") == _member or record.get("username") == _member:
+                return record
+        return None
+
+    def iter_profiles(self) -> Iterator[Dict]:
+        if not self._profiles_path.exists():
+            return
+        with self._profiles_path.open("r", encoding="utf8") as profiles:
+            for line in profiles:
+                if line.strip():
+                    yield ujson.loads(line)
+
+    def add_profile(self, p_dict: Dict) -> None:
+        with self._profiles_path.open("a", encoding="utf8") as profiles:
+            lock_file(profiles)
+            profiles.write(ujson.dumps(p_dict) + "\n")
+
+
+class SQLiteStorage(Storage):
+    """All messages and profiles of a group in a single SQLite database.
+
+    The database runs in WAL mode, messages are keyed by chat id and message id,
+    so re-fetched messages are deduplicated on insert.
+
+    The connection is shared by the event loop and the I/O threads, each use of it
+    holds ``lock``. Query results are fetched in batches, the lock is released
+    between them.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, group_dir: Path) -> None:
+        super().__init__(group_dir)
+        self._connection: Optional[sqlite3.Connection] = None
+        self.lock = threading.RLock()
+
+    @property
+    def _db_path(self) -> Path:
+        return self.group_dir / DB_FILE_NAME
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Lazily opened connection to the group's database."""
+        with self.lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(
+                    str(self._db_path), check_same_thread=False
+                )
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+                self._create_tables()
+            return self._connection
+
+    def _rows(self, query: str, params: tuple = ()) -> Iterator[tuple]:
+        """Run a query and fetch its rows in batches, each under the lock."""
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(ROW_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def _create_tables(self) -> None:
+        with self._connection:  # type: ignore
+            self._connection.executescript(  # type: ignore
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    chat_id TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    date TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, id)
+                );
+                CREATE INDEX IF NOT EXISTS messages_date ON messages (chat_id, date);
+                CREATE TABLE IF NOT EXISTS profiles (
+                    id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS profiles_username ON profiles (username);
+                """
+            )
+
+    def prepare(self) -> None:
+        _ = self.connection
+
+    @contextmanager
+    def open_member(self, member: str) -> Iterator[MessageWriter]:
+        writer = SQLiteWriter(self.connection, member, lock=self.lock)
+        try:
+            yield writer
+        finally:
+            with span("write"):
+                writer.close()
+
+    @contextmanager
+    def replace_member(self, member: str) -> Iterator[MessageWriter]:
+        """Write messages replacing stored ones with the same id.
+
+        Stored messages that are not written again are kept.
+        """
+        writer = SQLiteWriter(self.connection, member, replace=True, lock=self.lock)
+        try:
+            yield writer
+        finally:
+            with span("write"):
+                writer.close()
+
+    def members(self) -> List[str]:
+        rows = self._rows("SELECT DISTINCT chat_id FROM messages ORDER BY chat_id")
+        return [row[0] for row in rows]
+
+    def iter_messages(self, member: str) -> Iterator[Dict]:
+        rows = self._rows(
+            "SELECT data FROM messages WHERE chat_id = ? ORDER BY id", (member,)
+        )
+        for (data,) in rows:
+            yield ujson.loads(data)
+
+    def iter_encoded(self, member: str) -> Iterator[str]:
+        rows = self._rows(
+            "SELECT data FROM messages WHERE chat_id = ? ORDER BY id", (member,)
+        )
+        for (data,) in rows:
+            yield data
+
+    def message_ids(self, member: str) -> List[int]:
+        rows = self._rows(
+            "SELECT id FROM messages WHERE chat_id = ? ORDER BY id", (member,)
+        )
+        return [row[0] for row in rows]
+
+    def id_set(self, member: str) -> IdSet:
+        rows = self._rows(
+            "SELECT id FROM messages WHERE chat_id = ? ORDER BY id", (member,)
+        )
+        return IdSet.from_sorted(row[0] for row in rows)
+
+    def last_message_id(self, member: str) -> Optional[int]:
+        rows = self._rows("SELECT MAX(id) FROM messages WHERE chat_id = ?", (member,))
+        row = next(rows, None)
+        return row[0] if row else None
+
+    def get_profile(self, member: str) -> Optional[Dict]:
+        _member = _cast_member(member)
+        column = "id" if isinstance(_member, int) else "username"
+        rows = self._rows(
+            f"SELECT data FROM profiles WHERE {column} = ? LIMIT 1", (_member,)
+        )
+        row = next(rows, None)
+        return ujson.loads(row[0]) if row else None
+
+    def iter_profiles(self) -> Iterator[Dict]:
+        for (data,) in self._rows("SELECT data FROM profiles"):
+            yield ujson.loads(data)
+
+    def add_profile(self, p_dict: Dict) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO profiles (id, username, data) VALUES (?, ?, ?)",
+                (p_dict.get("id"), p_dict.get("username"), ujson.dumps(p_dict)),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+BACKENDS = {
+    JSONLStorage.backend: JSONLStorage,
+    SQLiteStorage.backend: SQLiteStorage,
+}
+
+
+def get_storage(group_dir: Path, backend: str = JSONLStorage.backend) -> Storage:
+    """Instantiate the storage backend for a group directory.
+
+    Args:
+        group_dir: the group's directory.
+        backend: name of the backend, either ``jsonl`` or ``sqlite``.
+
+    Returns:
+        Storage : the backend.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend}.")
+    return BACKENDS[backend](group_dir)
+
+
+def migrate(source: Storage, target: Storage) -> int:
+    """Copy all messages and profiles from one backend to another.
+
+    Each member's messages are merged with those the target holds already and
+    replace them, thus migrating back and forth does not duplicate messages.
+
+    Args:
+        source: backend to read from.
+        target: backend to write to.
+
+    Returns:
+        int : number of messages stored for the migrated members.
+    """
+    target.prepare()
+    known = {profile.get("id") for profile in target.iter_profiles()}
+    for profile in source.iter_profiles():
+        if profile.get("id") not in known:
+            target.add_profile(profile)
+            known.add(profile.get("id"))
+    count = 0
+    for member in source.members():
+        # messages of the source are read last and replace stored ones
+        sources = [target.iter_encoded(member), source.iter_encoded(member)]
+        with target.replace_member(member) as writer:
+            _, written = merge_messages(sources, writer)
+        count += written
+    return count
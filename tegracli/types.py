@@ -1,8 +1,9 @@
 """Define type and function interfaces
 """
-from typing import Awaitable, Callable
+from typing import Awaitable, Callable, List
 
 import telethon
 
 MessageHandler = Callable[[telethon.types.Message], Awaitable[None]]
+ChunkHandler = Callable[[List[telethon.types.Message]], Awaitable[None]]
 AuthenticationHandler = Callable[[telethon.TelegramClient], Awaitable[None]]
@@ -1,12 +1,39 @@
 """Utility functions for tegracli."""
 import datetime
+import random
+import re
+import sqlite3
 from functools import singledispatch
-from typing import Any, Dict, Union
+from typing import Any, Dict, Iterable, List, Optional, Union
 
+from loguru import logger as log
 from telethon import TelegramClient
+from telethon.sessions import Session, SQLiteSession, StringSession
 
 from .types import AuthenticationHandler
 
+CLIENT_OPTIONS = (
+    "timeout",
+    "request_retries",
+    "connection_retries",
+    "retry_delay",
+    "auto_reconnect",
+    "receive_updates",
+    "entity_cache_limit",
+    "use_ipv6",
+)
+"""Options of the configuration's ``client`` section passed on to the TelegramClient."""
+DEFAULT_FLOOD_SLEEP_THRESHOLD = 15 * 60
+
+
+_ACCOUNT_URL = re.compile(
+    r"^(?:https?://)?(?:www\.)?(?:t|telegram)\.(?:me|dog)/(?:s/)?@?([A-Za-z0-9_]+)/?"
+)
+_ACCOUNT_RESOLVE = re.compile(r"^tg://resolve\?domain=([A-Za-z0-9_]+)")
+_HANDLE = re.compile(r"^@?([A-Za-z][A-Za-z0-9_]{3,31})$")
+_MARKED_ID = re.compile(r"^-(?:100)?(\d+)$")
+_INVITE_PATHS = ("joinchat", "addlist", "c")
+
 
 @singledispatch
 def str_dict(data):
@@ -34,18 +61,122 @@ def _(data: bytes) -> str:
     return str(data)
 
 
-def get_client(conf: Dict) -> TelegramClient:
-    """Utility function to initialize the TelegramClient from the loaded configuration values."""
+def normalize_account(account: str) -> Optional[str]:
+    """Utility function to reduce an account given as handle, URL or ID to either.
+
+    IDs in the marked form of the Bot API, e.g. ``-1001234``, are reduced to the
+    bare ID.
+
+    Params:
+        account str : e.g. ``@handle``, ``https://t.me/handle`` or ``1234``.
+
+    Returns:
+        Optional[str] : the handle or ID, None for anything else, e.g. invite links.
+    """
+    account = account.strip()
+    if account.isdigit():
+        return account
+    marked = _MARKED_ID.match(account)
+    if marked:
+        return marked.group(1)
+    url = _ACCOUNT_URL.match(account) or _ACCOUNT_RESOLVE.match(account)
+    if url:
+        if url.group(1) in _INVITE_PATHS or account.split("/")[-1].startswith("+"):
+            return None
+        return url.group(1)
+    handle = _HANDLE.match(account)
+    if handle:
+        return handle.group(1)
+    return None
+
+
+def normalize_accounts(lines: Iterable[str]) -> List[str]:
+    """Utility function to normalize and deduplicate a list of accounts.
+
+    Only the first column of each line is considered, empty lines and lines starting
+    with ``#`` are skipped. Accounts that cannot be normalized are logged and dropped,
+    handles differing only in case are considered the same, as Telegram does not
+    distinguish them.
+
+    Params:
+        lines Iterable[str] : the accounts, one per line.
+    """
+    accounts: Dict[str, str] = {}
+    for line in lines:
+        fields = re.split(r"[,;\s]+", line.strip())
+        if not fields[0] or fields[0].startswith("#"):
+            continue
+        account = normalize_account(fields[0])
+        if account is None:
+            log.warning(f"Skipping {fields[0]}, it is no handle, URL or ID.")
+            continue
+        accounts.setdefault(account.lower(), account)
+    return list(accounts.values())
+
+
+def get_client(
+    conf: Dict, command: Optional[str] = None, client_class: Optional[type] = None
+) -> TelegramClient:
+    """Utility function to initialize the TelegramClient from the loaded configuration values.
+
+    Connection and session behaviour is tuned in the optional ``client`` section of the
+    configuration, see ``tegracli.conf.template.yml``.
+
+    Params:
+        conf Dict : the loaded configuration.
+        command Optional[str] : the command the client is used for, selects its flood
+            sleep threshold.
+        client_class Optional[type] : a TelegramClient subclass to instantiate.
+    """
     session_name = conf["session_name"]
     api_id = conf["api_id"]
     api_hash = conf["api_hash"]
+    options = conf.get("client") or {}
+
+    kwargs = {key: options[key] for key in CLIENT_OPTIONS if key in options}
+    if options.get("proxies"):
+        kwargs["proxy"] = random.choice(options["proxies"])  # nosec
+    session: Union[str, Session] = session_name
+    if options.get("session") == "memory":
+        session = memory_session(session_name)
 
-    client = TelegramClient(session_name, api_id, api_hash)
-    client.flood_sleep_threshold = 15 * 60
+    client = (client_class or TelegramClient)(session, api_id, api_hash, **kwargs)
+    client.flood_sleep_threshold = flood_sleep_threshold(options, command)
 
     return client
 
 
+def flood_sleep_threshold(options: Dict, command: Optional[str]) -> int:
+    """Utility function to look up the flood sleep threshold for a command.
+
+    Telethon silently sleeps on FloodWaitErrors shorter than the threshold, longer
+    waits are raised. A threshold of 0 raises all FloodWaitErrors.
+    """
+    thresholds = options.get("flood_sleep_thresholds") or {}
+    return thresholds.get(
+        command, options.get("flood_sleep_threshold", DEFAULT_FLOOD_SLEEP_THRESHOLD)
+    )
+
+
+def memory_session(session_name: str) -> StringSession:
+    """Utility function to load a SQLite session into memory.
+
+    Authorization and cached entities are copied from the session file, which is not
+    written to afterwards. Entities learned during the run are thus not persisted.
+    """
+    stored = SQLiteSession(session_name)
+    session = StringSession(StringSession.save(stored))
+    with sqlite3.connect(stored.filename) as connection:
+        rows = connection.execute(
+            "SELECT id, hash, username, phone, name FROM entities"
+        ).fetchall()
+    stored.close()
+    session._entities.update(  # pylint: disable=protected-access
+        tuple(row) for row in rows
+    )
+    return session
+
+
 async def ensure_authentication(
     client: TelegramClient, callback: AuthenticationHandler
 ):
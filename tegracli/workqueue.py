@@ -0,0 +1,251 @@
+"""Distribute the members of a group across workers.
+
+Several ``group run --queue`` processes, on one or several hosts sharing the group
+directory, take members from a queue stored in ``queue.db`` inside the group
+directory. A member is leased to one worker at a time. Workers extend their lease
+while they retrieve a member, a lease that is not extended expires and the member is
+handed to another worker. Members whose retrieval failed are retried up to
+``MAX_ATTEMPTS`` times.
+
+The first worker finding no open tasks enqueues all members of the group in order of
+their priority, thus a round is started by whichever host runs first and finished by
+all of them.
+
+Completing a member journals the member's state in the queue's database. Workers
+fold the journal into the group configuration in batches, rather than rewriting the
+configuration after every member.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import ujson
+
+QUEUE_FILE_NAME = "queue.db"
+LOCK_FILE_NAME = ".lock"
+"""Lock file serializing changes to the group configuration."""
+MAX_ATTEMPTS = 3
+"""Number of times a member is leased before it is given up for the round."""
+DEFAULT_LEASE = 600
+"""Seconds a member is leased for without a heartbeat."""
+JOURNAL_BATCH = 50
+"""Number of journaled member states that are folded into the configuration at once."""
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def worker_name() -> str:
+    """Identify this process across hosts."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Queue of a group's members stored in a SQLite database.
+
+    The database uses a rollback journal instead of WAL, as WAL does not work on
+    network filesystems. Every operation opens a short transaction with a fresh
+    connection, thus a queue may be used from several threads.
+
+    Args:
+        path: the database file.
+        max_attempts: number of leases per member and round.
+    """
+
+    def __init__(self, path, max_attempts: int = MAX_ATTEMPTS) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                + "member TEXT PRIMARY KEY, priority INTEGER NOT NULL, "
+                + "status TEXT NOT NULL, worker TEXT, lease_until REAL, "
+                + "attempts INTEGER NOT NULL DEFAULT 0, error TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                + "seq INTEGER PRIMARY KEY AUTOINCREMENT, state TEXT NOT NULL)"
+            )
+
+    def _transaction(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return _Transaction(connection)
+
+    def enqueue(self, members: Iterable[str]) -> int:
+        """Start a new round with ``members`` unless a round is still open.
+
+        Args:
+            members: the members in order of priority.
+
+        Returns:
+            int : number of members enqueued, 0 if a round is still open.
+        """
+        with self._transaction() as connection:
+            (open_tasks,) = connection.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (PENDING, LEASED)
+            ).fetchone()
+            if open_tasks:
+                return 0
+            connection.execute("DELETE FROM tasks")
+            rows = [(member, index, PENDING) for index, member in enumerate(members)]
+            connection.executemany(
+                "INSERT INTO tasks (member, priority, status) VALUES (?, ?, ?)", rows
+            )
+            return len(rows)
+
+    def lease(self, worker: str, duration: float = DEFAULT_LEASE) -> Optional[str]:
+        """Lease the next pending member or one whose lease expired.
+
+        Args:
+            worker: name of the leasing worker.
+            duration: seconds until the lease expires.
+
+        Returns:
+            Optional[str] : the member, None if there is nothing left to do.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = ?, error = 'lease expired' "
+                + "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts),
+            )
+            row = connection.execute(
+                "SELECT member FROM tasks WHERE status = ? "
+                + "OR (status = ? AND lease_until < ?) ORDER BY priority LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, "
+                + "attempts = attempts + 1 WHERE member = ?",
+                (LEASED, worker, now + duration, row[0]),
+            )
+            return row[0]
+
+    def heartbeat(self, member: str, worker: str, duration: float) -> bool:
+        """Extend a lease.
+
+        Returns:
+            bool : False if the lease was lost to another worker.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET lease_until = ? "
+                + "WHERE member = ? AND worker = ? AND status = ?",
+                (time.time() + duration, member, worker, LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, member: str, worker: str, state: Optional[Dict] = None) -> int:
+        """Mark a leased member as done and journal its state.
+
+        Args:
+            member: the leased member.
+            worker: name of the worker holding the lease.
+            state: the member's state, journaled if the lease is still held.
+
+        Returns:
+            int : number of journaled states.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET status = ?, lease_until = NULL, error = NULL "
+                + "WHERE member = ? AND worker = ?",
+                (DONE, member, worker),
+            )
+            if state is not None and cursor.rowcount == 1:
+                connection.execute(
+                    "INSERT INTO journal (state) VALUES (?)", (ujson.dumps(state),)
+                )
+            (journaled,) = connection.execute("SELECT COUNT(*) FROM journal").fetchone()
+            return journaled
+
+    def journal(self) -> List[Tuple[int, Dict]]:
+        """Get the journaled states in the order they were journaled."""
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT seq, state FROM journal ORDER BY seq"
+            ).fetchall()
+        return [(seq, ujson.loads(state)) for seq, state in rows]
+
+    def forget(self, last_seq: int) -> None:
+        """Remove the journaled states up to ``last_seq``, once they were folded."""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM journal WHERE seq <= ?", (last_seq,))
+
+    def release(self, member: str, worker: str, error: str) -> None:
+        """Give a leased member back for a retry, or up if it ran out of attempts."""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                + "lease_until = NULL, error = ? WHERE member = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, error, member, worker),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Count the members per status."""
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+
+class _Transaction:
+    """Run a block in an immediate transaction and close the connection afterwards."""
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, *args) -> None:
+        try:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.connection.close()
+
+
+class Heartbeat:
+    """Extend a lease in a background thread while a member is retrieved.
+
+    Args:
+        queue: the queue holding the lease.
+        member: the leased member.
+        worker: name of the worker holding the lease.
+        duration: seconds a lease is extended by, it is extended every third of it.
+    """
+
+    def __init__(
+        self, queue: WorkQueue, member: str, worker: str, duration: float
+    ) -> None:
+        self.queue = queue
+        self.member = member
+        self.worker = worker
+        self.duration = duration
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.duration / 3):
+            if not self.queue.heartbeat(self.member, self.worker, self.duration):
+                self.lost = True
+                return
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,77 @@
+"""Cassette Tests.
+
+This test suite tests recording Telegram responses and replaying them.
+"""
+
+import asyncio
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from telethon import functions, types
+from telethon.errors import FloodWaitError
+from telethon.sessions import MemorySession
+
+from tegracli.cassette import (
+    Cassette,
+    CassetteMiss,
+    RecordingClient,
+    ReplayClient,
+)
+
+
+class FakeSender:  # pylint: disable=too-few-public-methods
+    """Answers requests like MTProtoSender, from a fixed set of responses."""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def send(self, request, ordered=False):  # pylint: disable=unused-argument
+        """Resolve to the response for the request's type."""
+        future = asyncio.get_running_loop().create_future()
+        response = self.responses[type(request)]
+        if isinstance(response, Exception):
+            future.set_exception(response)
+        else:
+            future.set_result(response)
+        return future
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_record_and_replay(tmp_path: Path):
+    """Should replay recorded responses and errors in order."""
+    state = types.updates.State(1, 2, datetime(2022, 1, 1), 3, 0)
+    me = types.User(1234, access_hash=42, username="me")
+    state_request = functions.updates.GetStateRequest()
+    users_request = functions.users.GetUsersRequest([types.InputUserSelf()])
+    sender = FakeSender(
+        {
+            type(state_request): state,
+            type(users_request): FloodWaitError(None, capture=100),
+        }
+    )
+
+    cassette = Cassette(tmp_path / "run.cassette")
+    recorder = RecordingClient(MemorySession(), 1, "hash")
+    recorder.flood_sleep_threshold = 0
+    recorder.record(cassette)
+    # pylint: disable=protected-access
+    assert await recorder._call(sender, state_request) == state
+    with pytest.raises(FloodWaitError):
+        await recorder._call(sender, users_request)
+    sender.responses[type(users_request)] = [me]
+    recorder._flood_waited_requests.clear()  # as if the wait was over
+    assert await recorder._call(sender, users_request) == [me]
+    cassette.close()
+
+    replay = ReplayClient(Cassette.load(tmp_path / "run.cassette"), speed=0)
+    replay.flood_sleep_threshold = 0
+    assert bytes(await replay(state_request)) == bytes(state)
+    with pytest.raises(FloodWaitError) as error:
+        await replay(users_request)
+    assert error.value.seconds == 100
+    replay._flood_waited_requests.clear()
+    assert [user.username for user in await replay(users_request)] == ["me"]
+    with pytest.raises(CassetteMiss):
+        await replay(state_request)
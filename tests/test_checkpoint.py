@@ -0,0 +1,58 @@
+"""Hydration Checkpoint Tests.
+
+This test suite tests the bookkeeping of resumable hydrations.
+"""
+
+from pathlib import Path
+
+from tegracli.checkpoint import HydrateCheckpoint, chunked
+from tegracli.storage import ShardedJSONLWriter
+
+
+def test_checkpoint_resume(tmp_path: Path):
+    """Should skip completed and missing ids after a restart."""
+    path = tmp_path / "hydrate.checkpoint.jsonl"
+    checkpoint = HydrateCheckpoint(path)
+    assert not checkpoint.resumed
+    assert list(checkpoint.pending("channel", [3, 1, 2, 2])) == [1, 2, 3]
+
+    checkpoint.mark_done("channel", [1, 2], missing=[2])
+
+    restarted = HydrateCheckpoint(path)
+    assert restarted.resumed
+    assert list(restarted.pending("channel", [1, 2, 3, 4])) == [3, 4]
+    assert list(restarted.pending("other_channel", [1])) == [1]
+
+
+def test_chunked():
+    """Should split ids into chunks of limited size."""
+    assert list(chunked(list(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_sharded_writer(tmp_path: Path):
+    """Should rotate shards and continue numbering after existing shards."""
+    writer = ShardedJSONLWriter(tmp_path / "out.jsonl", shard_size=2)
+    for message_id in range(3):
+        writer.write({"id": message_id})
+    writer.close()
+
+    writer = ShardedJSONLWriter(tmp_path / "out.jsonl", shard_size=2)
+    writer.write({"id": 3})
+    writer.close()
+
+    shards = sorted(path.name for path in tmp_path.iterdir())
+    assert shards == ["out.00000.jsonl", "out.00001.jsonl", "out.00002.jsonl"]
+    assert len((tmp_path / "out.00000.jsonl").read_text().splitlines()) == 2
+
+
+def test_sharded_writer_after_deleted_shard(tmp_path: Path):
+    """Should start above the highest shard, ignoring other files."""
+    (tmp_path / "out.00001.jsonl").touch()
+    (tmp_path / "out.checkpoint.jsonl").touch()
+
+    writer = ShardedJSONLWriter(tmp_path / "out.jsonl", shard_size=2)
+    writer.write({"id": 1})
+    writer.flush()
+
+    assert (tmp_path / "out.00002.jsonl").read_text() == '{"id":1}\n'
+    writer.close()
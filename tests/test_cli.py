@@ -8,10 +8,14 @@ Tests should be run with click.CliRunner.
 # pylint: disable=redefined-outer-name
 # pylint: disable=wrong-import-position
 
+import asyncio
+from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import patch
 
 import pytest
+import telethon
 import yaml
 from click.testing import CliRunner
 
@@ -20,7 +24,8 @@ from tegracli.group import Group
 patcher = patch("telethon.TelegramClient")
 patcher.start()
 
-from tegracli.main import cli
+from tegracli import main
+from tegracli.main import _backfill_group, _resolve_until, cli
 
 
 @pytest.fixture
@@ -32,6 +37,37 @@ def group_config() -> Path:
         return yaml.full_load(file)
 
 
+class HistoryClient:
+    """Serves a fixed history of messages, failing on the requests in ``fail``."""
+
+    def __init__(self, available, fail=()):
+        self.available = available
+        self.fail = fail
+        self.requests = 0
+
+    async def get_input_entity(self, member_id):
+        """Mimic TelegramClient.get_input_entity."""
+        return member_id
+
+    async def iter_messages(self, wait_time=None, **params):
+        """Mimic TelegramClient.iter_messages for ids and id ranges."""
+        self.requests += 1
+        if self.requests in self.fail:
+            raise telethon.errors.RPCError(None, "INTERNAL")
+        if "ids" in params:
+            ids = params["ids"]
+        else:
+            ids = [i for i in self.available if params["min_id"] < i < params["max_id"]]
+        for message_id in ids:
+            if message_id in self.available:
+                yield SimpleNamespace(
+                    id=message_id,
+                    to_dict=lambda message_id=message_id: {"id": message_id},
+                )
+            else:
+                yield None
+
+
 @pytest.fixture
 def runner():
     """Fixture for click.CliRunner."""
@@ -171,6 +207,57 @@ def test_account_group_run(runner: CliRunner, group_config: Path, tmp_path: Path
         assert result.exit_code == 0  # indicating success?
 
 
+def test_group_quota(runner: CliRunner, group_config: Path, tmp_path: Path):
+    """Should set the quota of a group and of single members."""
+    with runner.isolated_filesystem(temp_dir=tmp_path) as temp_dir:
+        conf_file = Path(temp_dir) / "tegracli.conf.yml"
+        r_folder = Path(temp_dir) / "behoerden/"
+        r_folder.mkdir()
+        with (r_folder / "tegracli_group.conf.yml").open("w") as file:
+            yaml.dump(group_config, file)
+
+        with conf_file.open("w") as config:
+            yaml.dump(
+                {
+                    "api_id": 123456,
+                    "api_hash": "wahgi231kmdma91",
+                    "session_name": "test",
+                },
+                config,
+            )
+
+        group_result = runner.invoke(cli, "group quota -m 1000 -r 5 behoerden")
+        member_result = runner.invoke(
+            cli, "group quota -m 50 --member 1446651076 behoerden"
+        )
+
+        assert group_result.exit_code == 0
+        assert member_result.exit_code == 0
+        conf = Group.load(r_folder / "tegracli_group.conf.yml")
+        assert conf.quota == {"messages": 1000, "requests": 5}
+        assert conf.get_member_state("1446651076")["quota"] == {"messages": 50}
+
+
+def test_queue_rejects_sqlite(runner: CliRunner, tmp_path: Path):
+    """Should not share a group stored in SQLite through the work queue."""
+    with runner.isolated_filesystem(temp_dir=tmp_path) as temp_dir:
+        with (Path(temp_dir) / "tegracli.conf.yml").open("w") as config:
+            yaml.dump(
+                {
+                    "api_id": 123456,
+                    "api_hash": "wahgi231kmdma91",
+                    "session_name": "test",
+                },
+                config,
+            )
+        Group(["1234"], "behoerden", {"reverse": True}, backend="sqlite").dump()
+
+        result = runner.invoke(cli, "group run --queue behoerden")
+
+        assert result.exit_code == 127
+        assert not (Path(temp_dir) / "behoerden" / "queue.db").exists()
+
+
 def test_search(runner: CliRunner, tmp_path: Path):
     """Should get search results for specified terms."""
     with runner.isolated_filesystem(temp_dir=tmp_path) as temp_dir:
@@ -227,4 +314,188 @@ def test_hydrate(runner: CliRunner, tmp_path: Path):
     assert result.exit_code == 0
 
 
+def test_stats(runner: CliRunner, group_config: Path, tmp_path: Path):
+    """Should report statistics for a group."""
+    with runner.isolated_filesystem(temp_dir=tmp_path) as temp_dir:
+        conf_file = Path(temp_dir) / "tegracli.conf.yml"
+        r_folder = Path(temp_dir) / "behoerden/"
+        r_folder.mkdir()
+        with (r_folder / "tegracli_group.conf.yml").open("w") as file:
+            yaml.dump(group_config, file)
+        (r_folder / "profiles.jsonl").touch()
+        with (r_folder / "1446651076.jsonl").open("w") as file:
+            file.write('{"id": 1, "date": "2022-01-01 12:00:00"}\n')
+            file.write('{"id": 3, "date": "2022-01-02 12:00:00"}\n')
+
+        with conf_file.open("w") as config:
+            yaml.dump(
+                {
+                    "api_id": 123456,
+                    "api_hash": "wahgi231kmdma91",
+                    "session_name": "test",
+                },
+                config,
+            )
+
+        result = runner.invoke(cli, ["stats", "--format", "json", "behoerden"])
+
+        assert result.exit_code == 0
+        assert '"missing_ids": 1' in result.stdout
+
+
+def test_merge(runner: CliRunner, group_config: Path, tmp_path: Path):
+    """Should merge get outputs into a group and add the channel as member."""
+    with runner.isolated_filesystem(temp_dir=tmp_path) as temp_dir:
+        conf_file = Path(temp_dir) / "tegracli.conf.yml"
+        r_folder = Path(temp_dir) / "behoerden/"
+        r_folder.mkdir()
+        with (r_folder / "tegracli_group.conf.yml").open("w") as file:
+            yaml.dump(group_config, file)
+        (r_folder / "profiles.jsonl").touch()
+        for run, ids in (("first", [3, 2]), ("second", [1, 2])):
+            (Path(temp_dir) / run).mkdir()
+            with (Path(temp_dir) / run / "1234.jsonl").open("w") as file:
+                for message_id in ids:
+                    file.write(f'{{"id": {message_id}, "user": {{"id": 1234}}}}\n')
+
+        with conf_file.open("w") as config:
+            yaml.dump(
+                {
+                    "api_id": 123456,
+                    "api_hash": "wahgi231kmdma91",
+                    "session_name": "test",
+                },
+                config,
+            )
+
+        result = runner.invoke(
+            cli,
+            ["merge", "--group", "behoerden", "first/1234.jsonl", "second/1234.jsonl"],
+        )
+
+        assert result.exit_code == 0
+        conf = Group.load(r_folder / "tegracli_group.conf.yml")
+        assert "1234" in conf.members
+        assert conf.storage.message_ids("1234") == [1, 2, 3]
+        assert conf.get_last_message_for("1234") == 3
+        assert conf.storage.get_profile("1234") == {"id": 1234}
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_backfill_sqlite(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should fill the gaps of a group stored in SQLite through the I/O threads."""
+    monkeypatch.chdir(tmp_path)
+    conf = Group(["1234"], "behoerden", {"reverse": True}, backend="sqlite")
+    with conf.storage.open_member("1234") as writer:
+        for message_id in [1, 2, 5, 9]:
+            writer.write({"id": message_id})
+
+    await _backfill_group(conf, HistoryClient({3, 4, 6, 7, 8}), concurrency=1)
+
+    assert conf.storage.message_ids("1234") == list(range(1, 10))
+    conf.storage.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_backfill_aborted(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should compact the messages written before a backfill was aborted."""
+    monkeypatch.chdir(tmp_path)
+    conf = Group(["1234"], "behoerden", {"reverse": True})
+    with conf.storage.open_member("1234") as writer:
+        for message_id in [1, 40, 130]:
+            writer.write({"id": message_id})
+    client = HistoryClient(set(range(1, 131)), fail={2})
+
+    await _backfill_group(conf, client, concurrency=1)
+
+    assert conf.storage.message_ids("1234") == [*range(1, 41), 130]
+    assert conf.storage.last_message_id("1234") == 130
+    assert not conf.get_missing_ids("1234")
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_backfill_locked(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should skip members that another process is writing."""
+    monkeypatch.chdir(tmp_path)
+    conf = Group(["1234"], "behoerden", {"reverse": True})
+    with conf.storage.open_member("1234") as writer:
+        for message_id in [1, 5]:
+            writer.write({"id": message_id})
+        writer.file.flush()
+
+        await _backfill_group(conf, HistoryClient({2, 3, 4}), concurrency=1)
+
+    assert conf.storage.message_ids("1234") == [1, 5]
+
+
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+@pytest.mark.parametrize(
+    "until,last_id,expected,cached",
+    [
+        (datetime(2020, 1, 1), 41, 42, True),
+        (datetime(2020, 1, 1), None, 1, True),
+        (datetime.now() + timedelta(days=30), 41, 42, False),
+        (datetime.now() + timedelta(days=30), None, None, False),
+    ],
+)
+def test_resolve_until(  # pylint: disable=too-many-arguments
+    until, last_id, expected, cached, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """Should only cache the end date's message id once the end date has passed."""
+    monkeypatch.chdir(tmp_path)
+    conf = Group(["1234"], "behoerden", {"reverse": True}, until=until)
+    calls = []
+
+    async def _resolve_date(client, entity, date):
+        calls.append(date)
+        return last_id
+
+    monkeypatch.setattr(main, "resolve_date", _resolve_date)
+    client = SimpleNamespace(loop=asyncio.new_event_loop())
+    try:
+        assert _resolve_until("1234", conf, client, 1234) == expected
+        assert _resolve_until("1234", conf, client, 1234) == expected
+    finally:
+        client.loop.close()
+
+    assert len(calls) == (1 if cached else 2)
+    assert ("until_id" in conf.get_member_state("1234")) == cached
+
+
+def test_run_queue_journal(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should fold the members' states into the configuration in batches."""
+    monkeypatch.chdir(tmp_path)
+    Group(["h1", "2", "3"], "behoerden", {"reverse": True}).dump()
+    conf_path = Path("behoerden") / "tegracli_group.conf.yml"
+    monkeypatch.setattr(main, "JOURNAL_BATCH", 2)
+    dumps = []
+    monkeypatch.setattr(Group, "dump", _counting(Group.dump, dumps))
+
+    def _handle(member, conf, *args, **kwargs):
+        if member == "h1":
+            conf.update_member(member, "111")
+            member = "111"
+        return member, 10, True
+
+    monkeypatch.setattr(main, "_handle_group_member", _handle)
+
+    main.run_queue(None, ("behoerden",), lease=60)
+
+    conf = Group.load(conf_path)
+    assert sorted(conf.members) == ["111", "2", "3"]
+    assert all(conf.get_member_state(m)["last_success"] for m in conf.members)
+    assert len(dumps) == 2  # one batch of two members and the rest
+
+
+def _counting(function, calls):
+    def _wrapper(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+
+    return _wrapper
+
+
 patcher.stop()
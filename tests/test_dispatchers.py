@@ -9,7 +9,9 @@ This has the implication that we need valid credentials in a valid `tegracli.con
 # pylint: disable=redefined-outer-name
 # pylint: disable=wrong-import-position
 
+from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Dict, List
 
 import pytest
@@ -17,7 +19,7 @@ import ujson
 import yaml
 from telethon import TelegramClient
 
-from tegracli.dispatch import dispatch_hydrate
+from tegracli.dispatch import dispatch_hydrate, dispatch_resolve, resolve_date_bounds
 from tegracli.main import dispatch_get, dispatch_search
 
 
@@ -102,3 +104,79 @@ def test_dispatch_hydrate(params: str, results: int, client: TelegramClient):
                 assert int(res["id"]) == results
             except ValueError:
                 continue
+
+
+class DatedClient:  # pylint: disable=too-few-public-methods
+    """Serves messages sent on the given days of January 2022."""
+
+    def __init__(self, days: Dict[int, int]):
+        self.messages = [
+            SimpleNamespace(id=message_id, date=datetime(2022, 1, day))
+            for message_id, day in sorted(days.items(), reverse=True)
+        ]
+
+    async def iter_messages(self, entity, offset_date=None, limit=None):
+        """Mimic TelegramClient.iter_messages for an offset date, newest first."""
+        del entity
+        older = [message for message in self.messages if message.date < offset_date]
+        for message in older[:limit]:
+            yield message
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+@pytest.mark.parametrize(
+    "since,until,expected",
+    [
+        (None, None, {}),
+        (datetime(2022, 1, 5), None, {"min_id": 2}),
+        (None, datetime(2022, 1, 5), {"max_id": 3}),
+        (datetime(2022, 1, 2), datetime(2022, 1, 9), {"min_id": 1, "max_id": 5}),
+        (None, datetime(2022, 1, 1), None),
+        (datetime(2022, 1, 6), datetime(2022, 1, 8), None),
+    ],
+)
+async def test_resolve_date_bounds(since, until, expected):
+    """Should translate a period into exclusive id bounds."""
+    client = DatedClient({1: 1, 2: 3, 3: 5, 4: 8})
+
+    assert await resolve_date_bounds(client, "entity", since, until) == expected
+
+
+class ResolvingClient:  # pylint: disable=too-few-public-methods
+    """Knows a fixed set of accounts."""
+
+    def __init__(self, known: Dict):
+        self.known = known
+        self.requests = []
+
+    async def get_entity(self, accounts):
+        """Mimic TelegramClient.get_entity for lists, which fails as a whole."""
+        self.requests.append(accounts)
+        if any(account not in self.known for account in accounts):
+            raise ValueError("Could not find the input entity")
+        return [
+            SimpleNamespace(to_dict=lambda account=account: self.known[account])
+            for account in accounts
+        ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_dispatch_resolve():
+    """Should resolve IDs in batches and find the accounts that fail a batch."""
+    client = ResolvingClient(
+        {1: {"id": 1}, 2: {"id": 2}, "handle": {"id": 3, "username": "handle"}}
+    )
+
+    profiles, failures = await dispatch_resolve(
+        client, ["handle", "1", "2", "4", "unknown"], batch_size=3
+    )
+
+    assert profiles == {
+        "handle": {"id": 3, "username": "handle"},
+        "1": {"id": 1},
+        "2": {"id": 2},
+    }
+    assert failures == {"4": "ValueError", "unknown": "ValueError"}
+    assert [1, 2, 4] in client.requests
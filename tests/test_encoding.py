@@ -0,0 +1,46 @@
+"""Encoding Pool Tests.
+
+This test suite tests encoding messages in worker pools.
+"""
+
+import datetime
+import io
+
+import pytest
+from telethon.extensions import BinaryReader
+from telethon.tl import types
+
+from tegracli.dispatch import handle_message
+from tegracli.encoding import EncodingPool
+from tegracli.storage import JSONLWriter
+
+
+def _message(message_id: int) -> types.Message:
+    """A message as it would be read from Telegram's response."""
+    message = types.Message(
+        id=message_id,
+        peer_id=types.PeerChannel(1234),
+        date=datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc),
+        message=f"message number {message_id}",
+    )
+    return BinaryReader(bytes(message)).tgread_object()
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+@pytest.mark.parametrize("threads", [True, False])
+async def test_pooled_handler(threads: bool):
+    """Should write the same lines as handle_message, in order."""
+    messages = [_message(message_id) for message_id in range(1, 8)]
+    expected = io.StringIO()
+    for message in messages:
+        await handle_message(message, expected, injects={"user": {"id": 1234}})
+
+    output = io.StringIO()
+    with EncodingPool(2, batch_size=3, threads=threads) as pool:
+        handler = pool.handler(JSONLWriter(output), injects={"user": {"id": 1234}})
+        for message in messages:
+            await handler(message)
+        await handler.flush()
+
+    assert output.getvalue() == expected.getvalue()
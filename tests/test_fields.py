@@ -0,0 +1,40 @@
+"""Field Selection Tests.
+
+This test suite tests reducing messages to selected fields.
+"""
+
+from tegracli.fields import parse_fields, project
+
+MESSAGE = {
+    "_": "Message",
+    "id": 12,
+    "message": "hello",
+    "media": {"_": "MessageMediaPhoto", "photo": {"_": "Photo", "id": 1}},
+    "entities": [{"_": "MessageEntityBold", "offset": 0, "length": 5}],
+    "replies": {"_": "MessageReplies", "replies": 3, "recent_repliers": []},
+}
+
+
+def test_profiles():
+    """Should resolve profiles and keep everything for full."""
+    assert project(MESSAGE, parse_fields("full")) is MESSAGE
+    assert project(MESSAGE, parse_fields("minimal")) == {
+        "_": "Message",
+        "id": 12,
+        "message": "hello",
+    }
+    research = project(MESSAGE, parse_fields("research"))
+    assert research["media"] == {"_": "MessageMediaPhoto"}
+    assert research["replies"] == {"replies": 3}
+
+
+def test_dotted_paths():
+    """Should select nested fields, also within lists, and always keep the id."""
+    fields = parse_fields("message, entities._, entities.length, media.photo.id")
+
+    assert project(MESSAGE, fields) == {
+        "id": 12,
+        "message": "hello",
+        "entities": [{"_": "MessageEntityBold", "length": 5}],
+        "media": {"photo": {"id": 1}},
+    }
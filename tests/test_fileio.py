@@ -0,0 +1,46 @@
+"""File I/O Tests.
+
+This test suite tests writing files in the I/O executor.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from tegracli.fileio import QueuedWriter, opened, run_io
+from tegracli.storage import JSONLWriter, MessageWriter
+
+
+class FailingWriter(MessageWriter):
+    """Fails to write a message."""
+
+    def write_encoded(self, message_id, date, data):
+        raise OSError("disk is gone")
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_queued_writer(tmp_path: Path):
+    """Should write in order without blocking and wait for all writes on close."""
+    path = tmp_path / "member.jsonl"
+    async with opened(path.open, "a", encoding="utf8") as file:
+        writer = QueuedWriter(JSONLWriter(file), max_pending=2)
+        for message_id in range(10):
+            writer.write_encoded(message_id, None, str(message_id))
+            await writer.drain()
+            assert len(writer._pending) <= 2  # pylint: disable=protected-access
+        writer.write_many([(10, None, "10"), (11, None, "11")])
+        await writer.aclose()
+
+    assert await run_io(path.read_text) == "".join(f"{i}\n" for i in range(12))
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_queued_writer_error():
+    """Should raise a failed write with a later call."""
+    writer = QueuedWriter(FailingWriter())
+    writer.write_encoded(1, None, "1")
+
+    with pytest.raises(OSError):
+        await writer.aclose()
@@ -0,0 +1,78 @@
+"""Gap Detection and Backfill Tests.
+
+This test suite tests finding and filling gaps in message histories.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from tegracli.dispatch import dispatch_backfill
+from tegracli.gaps import find_gaps, id_runs, merge_runs, subtract_runs
+
+
+def test_runs():
+    """Should compress, unite and subtract runs of ids."""
+    assert id_runs([7, 1, 2, 3, 3, 5]) == [[1, 3], [5, 5], [7, 7]]
+    assert merge_runs([[1, 3], [8, 9]], [[4, 5], [9, 12]]) == [[1, 5], [8, 12]]
+    assert subtract_runs([[1, 10]], [[2, 3], [5, 5], [9, 12]]) == [
+        [1, 1],
+        [4, 4],
+        [6, 8],
+    ]
+
+
+def test_find_gaps():
+    """Should find the missing ids, except those known to be unavailable."""
+    assert find_gaps([1, 2, 3, 6, 7, 10, 20], [[4, 4], [12, 15]]) == [
+        [5, 5],
+        [8, 9],
+        [11, 11],
+        [16, 19],
+    ]
+    assert not find_gaps([])
+
+
+class FakeClient:
+    """Serves messages from a fixed set of ids."""
+
+    def __init__(self, available):
+        self.available = available
+        self.requests = []
+
+    async def iter_messages(self, wait_time=None, **params):
+        """Mimic TelegramClient.iter_messages for ids and id ranges."""
+        self.requests.append(params)
+        if "ids" in params:
+            for message_id in params["ids"]:
+                if message_id in self.available:
+                    yield SimpleNamespace(id=message_id)
+                else:
+                    yield None
+            return
+        for message_id in sorted(self.available):
+            if params["min_id"] < message_id < params["max_id"]:
+                yield SimpleNamespace(id=message_id)
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_dispatch_backfill():
+    """Should request small gaps by ids and large gaps by range."""
+    client = FakeClient({5, 8, 400, 401})
+    handled = []
+
+    async def _callback(message):
+        handled.append(message.id)
+
+    received = await dispatch_backfill(
+        client, "entity", [[5, 5], [8, 9], [11, 1000]], _callback
+    )
+
+    assert received == [5, 8, 400, 401]
+    assert handled == received
+    assert [sorted(request) for request in client.requests] == [
+        ["entity", "ids"],
+        ["entity", "ids"],
+        ["entity", "max_id", "min_id", "reverse"],
+    ]
@@ -0,0 +1,188 @@
+"""Account Group Tests.
+
+This test suite tests the account group's state handling.
+"""
+
+# pylint: disable=redefined-outer-name
+
+from pathlib import Path
+
+import pytest
+
+from tegracli.group import CONF_FILE_NAME, Group
+from tegracli.scheduler import budgets, priority, schedule, update_statistics
+
+
+@pytest.fixture
+def group(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Group:
+    """A freshly dumped group in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    _group = Group(["1234", "some_handle"], "test_group", {"limit": 10})
+    _group.dump()
+    return _group
+
+
+def test_load_legacy_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should load configurations written by older versions."""
+    with Path("tests/.stubs/tegracli_group.conf.yml").open("r") as file:
+        legacy = file.read()
+    monkeypatch.chdir(tmp_path)
+    Path("behoerden").mkdir()
+    conf_path = Path("behoerden") / CONF_FILE_NAME
+    conf_path.write_text(legacy)
+
+    _group = Group.load(conf_path)
+
+    assert _group.members == ["1446651076"]
+    assert _group.backend == "jsonl"
+
+
+def test_checkpoint_is_debounced(group: Group):
+    """Should only write state changes once a checkpoint is due."""
+    conf_path = Path("test_group") / CONF_FILE_NAME
+    group.update_member("some_handle", "4321")
+
+    assert "4321" not in conf_path.read_text()
+
+    group.checkpoint(force=True)
+
+    assert "4321" in conf_path.read_text()
+    assert Group.load(conf_path).members == ["1234", "4321"]
+    assert not list(Path("test_group").glob("*.tmp"))
+
+
+def test_update_member_keeps_order(group: Group):
+    """Should replace a handle by its id at the handle's position."""
+    group.add_members(["5678"])
+    group.update_member("some_handle", "4321")
+
+    assert group.members == ["1234", "4321", "5678"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_checkpoint_in_event_loop(group: Group):
+    """Should write checkpoints in the background while the event loop runs."""
+    conf_path = Path("test_group") / CONF_FILE_NAME
+    group.update_member("some_handle", "4321")
+    group._last_dump = 0.0  # pylint: disable=protected-access
+    group.mark_dirty()
+    group.checkpoint(force=True)  # waits for the checkpoint written in the background
+
+    assert Group.load(conf_path).members == ["1234", "4321"]
+
+
+def test_unreachable_members(group: Group):
+    """Should move members to the unreachable list and back."""
+    conf_path = Path("test_group") / CONF_FILE_NAME
+    group.mark_member_unreachable("some_handle", "UsernameNotOccupied")
+    group.mark_member_unreachable("unknown", "ValueError")
+    group.mark_member_run("1234")
+    group.checkpoint(force=True)
+
+    loaded = Group.load(conf_path)
+    assert loaded.members == ["1234"]
+    assert loaded.unreachable_members == [
+        {"member": "some_handle", "reason": "UsernameNotOccupied"}
+    ]
+    assert loaded.get_member_state("1234")["last_run"] is not None
+
+    loaded.add_members(["some_handle", "4321"])  # unreachable members stay so
+
+    assert loaded.members == ["1234", "4321"]
+    with pytest.raises(AttributeError):
+        loaded.members = ["1234"]
+
+    loaded.retry_all_unreachable()
+
+    assert loaded.members == ["1234", "some_handle", "4321"]
+    assert loaded.unreachable_members == []
+
+
+def test_schedule(group: Group):
+    """Should run unknown members first, then stale, active and error-free ones."""
+    group.add_members(["quiet", "busy", "failing"])
+    day = 86400.0
+    for member, messages in [
+        ("1234", 0),
+        ("quiet", 1),
+        ("busy", 500),
+        ("failing", 500),
+    ]:
+        update_statistics(group.get_member_state(member), 0, True, now=0.0)
+        update_statistics(group.get_member_state(member), messages, True, now=day)
+    update_statistics(group.get_member_state("failing"), 0, False, now=day)
+
+    assert schedule(group, now=2 * day) == [
+        "some_handle",
+        "busy",
+        "failing",
+        "quiet",
+        "1234",
+    ]
+
+
+def test_budgets(group: Group):
+    """Should share the group's quota by posting rate, within bounds."""
+    group.add_members(["quiet", "busy", "average", "own"])
+    group.params["limit"] = None
+    for member, messages in [("quiet", 1), ("busy", 10_000), ("average", 100)]:
+        update_statistics(group.get_member_state(member), messages, True, now=0.0)
+        update_statistics(group.get_member_state(member), messages, True, now=86400.0)
+    group.set_quota({"messages": 1000, "requests": 5})
+    group.set_quota({"requests": 20}, member="own")
+
+    assert budgets(group) == {
+        "1234": 500,
+        "some_handle": 500,
+        "quiet": 250,
+        "busy": 2000,
+        "average": 500,
+        "own": 2000,
+    }
+
+    group.params["limit"] = 100
+    group.set_quota(None)
+    record = group.get_member_state("quiet")
+    before = priority(record, now=2 * 86400.0)
+    group.set_member_value("quiet", "backlog", True)
+
+    assert budgets(group)["quiet"] == 50
+    assert priority(record, now=2 * 86400.0) == 2 * before
+
+
+def test_merge_member(group: Group):
+    """Should take over the state of a member retrieved by another worker."""
+    conf_path = Path("test_group") / CONF_FILE_NAME
+    worker = Group.load(conf_path, autosave=False)
+    worker.update_member("some_handle", "4321")
+    worker.record_member_result("4321", 10, True)
+    worker.set_error_state("entities", 60)
+    shared = Group.load(conf_path)
+    shared.mark_member_run("1234")
+
+    shared.merge_member(worker, "some_handle", "4321")
+
+    assert shared.members == ["1234", "4321"]
+    assert shared.get_member_state("4321")["last_success"] is not None
+    assert shared.get_member_state("1234")["last_run"] is not None
+    assert shared.get_error_state("entities")
+    assert "4321" not in conf_path.read_text()  # the worker never wrote it
+
+
+def test_merge_concurrent_renames(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should replace each handle by its own id if workers rename concurrently."""
+    monkeypatch.chdir(tmp_path)
+    Group(["h1", "h2"], "test_group", {}).dump()
+    conf_path = Path("test_group") / CONF_FILE_NAME
+    worker_a = Group.load(conf_path, autosave=False)
+    worker_b = Group.load(conf_path, autosave=False)
+    worker_b.update_member("h2", "222")
+    worker_a.update_member("h1", "111")
+
+    for worker, member, name in [(worker_b, "h2", "222"), (worker_a, "h1", "111")]:
+        shared = Group.load(conf_path)
+        shared.merge_member(worker, member, name)
+        shared.dump()
+
+    assert sorted(Group.load(conf_path).members) == ["111", "222"]
@@ -0,0 +1,36 @@
+"""Id Set Tests.
+
+This test suite tests the compact sets of message ids.
+"""
+
+from io import BytesIO
+
+import pytest
+
+from tegracli import idset
+from tegracli.idset import IdSet
+
+
+def test_id_set(monkeypatch: pytest.MonkeyPatch):
+    """Should keep ids sorted and unique, also when merging buffered ids."""
+    monkeypatch.setattr(idset, "MIN_BUFFER", 2)
+    ids = IdSet([5, 1, 3, 3])
+    ids.update([2, 9, 1])
+    ids.add(4)
+
+    assert list(ids) == [1, 2, 3, 4, 5, 9]
+    assert 4 in ids
+    assert 6 not in ids
+    assert ids.max() == 9
+    assert ids.runs() == [[1, 5], [9, 9]]
+    assert list(ids.difference([10, 6, 1, 6])) == [6, 10]
+    assert IdSet().max() is None
+
+
+def test_id_set_round_trip():
+    """Should write and read the ids."""
+    file = BytesIO()
+    IdSet(range(1000, 0, -3)).write(file)
+    file.seek(0)
+
+    assert list(IdSet.read(file)) == list(range(1, 1001, 3))
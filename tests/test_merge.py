@@ -0,0 +1,31 @@
+"""Merge Tests.
+
+This test suite tests merging message files with bounded memory.
+"""
+
+import io
+from pathlib import Path
+
+from tegracli.merge import merge_messages
+from tegracli.storage import JSONLWriter
+
+
+def test_merge_messages(tmp_path: Path):
+    """Should sort by id across spilled runs and keep the message read last."""
+    first = ['{"id": 5, "v": 1}', '{"id": 3, "v": 1}', "", '{"id": 1, "v": 1}']
+    second = ['{"id": 2, "v": 2}', '{"id": 3, "v": 2}', "broken", '{"id": 6, "v": 2}']
+    output = io.StringIO()
+
+    read, written = merge_messages(
+        [first, second], JSONLWriter(output), run_size=2, temp_dir=tmp_path
+    )
+
+    assert (read, written) == (6, 5)
+    assert output.getvalue().splitlines() == [
+        '{"id": 1, "v": 1}',
+        '{"id": 2, "v": 2}',
+        '{"id": 3, "v": 2}',
+        '{"id": 5, "v": 1}',
+        '{"id": 6, "v": 2}',
+    ]
+    assert not list(tmp_path.iterdir())  # spilled runs are removed
@@ -0,0 +1,77 @@
+"""Pacing Tests.
+
+This test suite tests adapting the pauses between requests to flood waits.
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+from telethon.requestiter import RequestIter
+
+from tegracli.dispatch import dispatch_iter_chunks
+from tegracli.pacing import Pacer, pacer_for
+
+
+class FloodingClient:  # pylint: disable=too-few-public-methods
+    """Serves chunks of messages, running into a flood wait on some of them."""
+
+    def __init__(self, chunks, floods):
+        self.chunks = chunks
+        self.floods = floods
+        self.waits = []
+        self._flood_waited_requests = {}
+
+    def iter_messages(self, wait_time=None, **params):
+        """Mimic TelegramClient.iter_messages."""
+        return ChunkIter(self, None, wait_time=wait_time, **params)
+
+
+class ChunkIter(RequestIter):
+    """Loads the client's chunks one per request."""
+
+    async def _init(self, **kwargs):
+        self.request = 0
+
+    async def _load_next_chunk(self):
+        self.client.waits.append(self.wait_time)
+        if self.request in self.client.floods:
+            # as Telethon does when it sleeps through a flood wait
+            self.client._flood_waited_requests[0] = time.time() + self.request
+        self.buffer.extend(
+            SimpleNamespace(id=message_id)
+            for message_id in self.client.chunks[self.request]
+        )
+        self.request += 1
+        return self.request == len(self.client.chunks)
+
+
+def test_pacer():
+    """Should back off on flood waits and recover without them."""
+    pacer = Pacer(max_wait=4)
+
+    for expected in [1, 2, 4, 4]:
+        pacer.backoff()
+        assert pacer.wait == expected
+    for _ in range(30):
+        pacer.recover()
+
+    assert pacer.wait == 0
+    assert pacer.floods == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_dispatch_iter_chunks():
+    """Should pass messages in batches and pause after flood waits only."""
+    client = FloodingClient([[1, 2, 3], [4, 5, 6], [7]], floods={1})
+    batches = []
+
+    async def _callback(messages):
+        batches.append([message.id for message in messages])
+
+    assert await dispatch_iter_chunks(client, {"entity": "x"}, _callback, batch_size=2)
+
+    assert batches == [[1, 2], [3, 4], [5, 6], [7]]
+    assert client.waits == [0, 0, 1]
+    assert pacer_for(client).floods == 1
@@ -0,0 +1,42 @@
+"""Profiling Tests.
+
+This test suite tests measuring the stages of a run.
+"""
+
+import pytest
+
+from tegracli import profiling
+
+
+async def _count(number: int):
+    for item in range(number):
+        yield item
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_spans():
+    """Should sum up the spans and iterations per stage."""
+    profiler = profiling.enable()
+    try:
+        for _ in range(3):
+            with profiling.span("write"):
+                sum(range(1000))
+        items = [item async for item in profiling.timed(_count(2), "fetch")]
+    finally:
+        assert profiling.disable() is profiler
+
+    assert items == [0, 1]
+    stages = {row["stage"]: row for row in profiler.report()}
+    assert stages["write"]["calls"] == 3
+    assert stages["fetch"]["calls"] == 3  # two items and the end of the iteration
+    assert "write" in profiler.summary()
+
+
+def test_disabled():
+    """Should not measure anything while disabled."""
+    iterable = _count(1)
+
+    assert profiling.timed(iterable, "fetch") is iterable
+    with profiling.span("write"):
+        pass
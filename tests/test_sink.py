@@ -0,0 +1,64 @@
+"""Sink Tests.
+
+This test suite tests streaming messages as NDJSON envelopes.
+"""
+
+from contextlib import AsyncExitStack
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+import ujson
+
+from tegracli.dispatch import _open_output
+from tegracli.fileio import QueuedWriter
+from tegracli.sink import Sink, TeeWriter, open_sink
+from tegracli.storage import JSONLStorage
+
+
+def test_envelopes():
+    """Should wrap messages into envelopes and buffer them."""
+    stream = BytesIO()
+    sink = Sink(stream, buffer_size=100)
+    writer = sink.writer("get", "1234")
+
+    writer.write({"id": 1, "message": "hallo"})
+    assert stream.getvalue() == b""
+    writer.write({"id": 2, "message": "welt"})
+    assert stream.getvalue() != b""
+    sink.close()
+
+    envelopes = [ujson.loads(line) for line in stream.getvalue().splitlines()]
+    assert envelopes == [
+        {"source": "get", "member": "1234", "message": {"id": 1, "message": "hallo"}},
+        {"source": "get", "member": "1234", "message": {"id": 2, "message": "welt"}},
+    ]
+
+
+def test_tee_into_storage(tmp_path: Path):
+    """Should write to the storage and to a file sink."""
+    storage = JSONLStorage(tmp_path)
+    with open_sink(str(tmp_path / "stream.ndjson")) as sink:
+        with storage.open_member("1234") as stored:
+            writer = TeeWriter(stored, sink.writer("my_group", "1234"))
+            writer.write({"id": 1})
+
+    assert storage.message_ids("1234") == [1]
+    with (tmp_path / "stream.ndjson").open("r", encoding="utf8") as file:
+        assert ujson.loads(file.readline())["source"] == "my_group"
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_sink_output_is_queued(tmp_path: Path):
+    """Should write the output of ``get`` and ``search`` to a sink in the background."""
+    stream = BytesIO()
+    sink = Sink(stream, buffer_size=1)
+    async with AsyncExitStack() as stack:
+        writer = await _open_output(stack, tmp_path / "1234.jsonl", sink, "get", "1")
+        assert isinstance(writer, QueuedWriter)
+        writer.write({"id": 1})
+        await writer.drain()
+
+    assert ujson.loads(stream.getvalue())["message"] == {"id": 1}
+    assert not (tmp_path / "1234.jsonl").exists()
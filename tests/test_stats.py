@@ -0,0 +1,71 @@
+"""Group Statistics Tests.
+
+This test suite tests summarizing the messages collected by a group.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from tegracli.group import Group
+from tegracli.stats import CACHE_FILE_NAME, group_summaries, report
+
+
+def _write(path: Path, ids):
+    with path.open("a", encoding="utf8") as file:
+        for message_id in ids:
+            fwd_from = None
+            if message_id % 2 == 0:
+                fwd_from = {"from_id": {"_": "PeerChannel", "channel_id": 42}}
+            record = {
+                "id": message_id,
+                "date": f"2022-01-{message_id:02d} 12:00:00",
+                "fwd_from": fwd_from,
+            }
+            file.write(json.dumps(record) + "\n")
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_group_stats(workers: int, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should report counts, ranges, gaps and forwards, and only read appended data."""
+    monkeypatch.chdir(tmp_path)
+    group = Group(["1234"], "test_group", {})
+    member_file = Path("test_group") / "1234.jsonl"
+    _write(member_file, [1, 2, 3, 6, 7])
+
+    (row,) = report(group_summaries(group, workers=workers))
+    assert row["messages"] == 5
+    assert (row["min_id"], row["max_id"]) == (1, 7)
+    assert (row["gaps"], row["missing_ids"]) == (1, 2)
+    assert row["first_date"] == "2022-01-01 12:00:00"
+    assert row["top_forwards"] == "42 (2)"
+
+    _write(member_file, [8, 10])
+    with member_file.open("a", encoding="utf8") as file:
+        file.write('{"id": 11, "da')  # an unfinished write
+    cache = json.loads((Path("test_group") / CACHE_FILE_NAME).read_text())
+    assert cache["1234"]["summary"]["count"] == 5
+
+    (row,) = report(group_summaries(group, workers=workers))
+    assert row["messages"] == 7
+    assert (row["gaps"], row["missing_ids"]) == (2, 3)
+    assert row["last_date"] == "2022-01-10 12:00:00"
+    assert row["top_forwards"] == "42 (4)"
+
+
+def test_group_stats_replaced_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Should rescan a file that was replaced by a bigger one, e.g. by merge."""
+    monkeypatch.chdir(tmp_path)
+    group = Group(["1234"], "test_group", {})
+    member_file = Path("test_group") / "1234.jsonl"
+    _write(member_file, [2, 1, 2])
+    group_summaries(group)
+
+    replacement = Path("test_group") / "1234.jsonl.tmp"
+    _write(replacement, [1, 2, 3, 4, 5])
+    replacement.replace(member_file)
+
+    (row,) = report(group_summaries(group))
+    assert row["messages"] == 5
+    assert (row["min_id"], row["max_id"]) == (1, 5)
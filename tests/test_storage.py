@@ -0,0 +1,196 @@
+"""Storage Backend Tests.
+
+This test suite tests the storage backends of account groups.
+"""
+
+# pylint: disable=redefined-outer-name
+
+from pathlib import Path
+
+import pytest
+
+from tegracli.fileio import QueuedWriter, opened, run_io
+from tegracli.storage import (
+    JSONLStorage,
+    LockedError,
+    SQLiteStorage,
+    get_storage,
+    migrate,
+    tail_lines,
+    tail_records,
+)
+
+
+@pytest.fixture
+def messages():
+    """Some fake message dicts."""
+    return [
+        {"_": "Message", "id": message_id, "date": f"2022-01-0{message_id} 12:00:00"}
+        for message_id in [3, 1, 2]
+    ]
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_round_trip(backend: str, messages, tmp_path: Path):
+    """Should store and look up messages and profiles."""
+    storage = get_storage(tmp_path, backend)
+    storage.prepare()
+    with storage.open_member("1234") as writer:
+        for message in messages:
+            writer.write(message)
+    storage.add_profile({"id": 1234, "username": "test_channel"})
+
+    assert storage.members() == ["1234"]
+    assert sorted(storage.message_ids("1234")) == [1, 2, 3]
+    assert storage.last_message_id("1234") == 3
+    assert storage.last_message_id("4321") is None
+    assert storage.get_profile("1234")["username"] == "test_channel"
+    assert storage.get_profile("test_channel")["id"] == 1234
+    assert storage.get_profile("unknown") is None
+    storage.close()
+
+
+def test_sqlite_deduplicates(messages, tmp_path: Path):
+    """Should not store a message twice."""
+    storage = SQLiteStorage(tmp_path)
+    for _ in range(2):
+        with storage.open_member("1234") as writer:
+            for message in messages:
+                writer.write(message)
+
+    assert storage.message_ids("1234") == [1, 2, 3]
+    storage.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.enable_socket  # the event loop needs a socket pair
+async def test_sqlite_in_io_threads(messages, tmp_path: Path):
+    """Should use the connection from the I/O threads and the event loop."""
+    storage = SQLiteStorage(tmp_path)
+    storage.prepare()
+    async with opened(storage.open_member, "1234") as stored:
+        writer = QueuedWriter(stored)
+        for message in messages:
+            writer.write(message)
+        await writer.aclose()
+    await run_io(storage.add_profile, {"id": 1234, "username": "test_channel"})
+
+    assert list(await run_io(storage.id_set, "1234")) == [1, 2, 3]
+    assert storage.last_message_id("1234") == 3
+    assert storage.get_profile("test_channel")["id"] == 1234
+    storage.close()
+
+
+def test_migrate(messages, tmp_path: Path):
+    """Should copy messages and profiles from JSONL to SQLite."""
+    source = JSONLStorage(tmp_path)
+    source.prepare()
+    with source.open_member("1234") as writer:
+        for message in messages:
+            writer.write(message)
+    source.add_profile({"id": 1234, "username": "test_channel"})
+
+    target = SQLiteStorage(tmp_path)
+    assert migrate(source, target) == 3
+    assert target.message_ids("1234") == [1, 2, 3]
+    assert target.get_profile("test_channel")["id"] == 1234
+    target.close()
+
+
+def test_migrate_back_and_forth(messages, tmp_path: Path):
+    """Should not duplicate messages when migrating back to JSONL."""
+    jsonl = JSONLStorage(tmp_path)
+    jsonl.prepare()
+    with jsonl.open_member("1234") as writer:
+        for message in messages:
+            writer.write(message)
+    sqlite = SQLiteStorage(tmp_path)
+    migrate(jsonl, sqlite)
+    with sqlite.open_member("1234") as writer:
+        writer.write({"id": 4, "date": "2022-01-04 12:00:00"})
+
+    assert migrate(sqlite, jsonl) == 4
+    assert jsonl.message_ids("1234") == [1, 2, 3, 4]
+    sqlite.close()
+
+
+def test_tail_records(tmp_path: Path):
+    """Should read the last records and skip a torn final line."""
+    path = tmp_path / "1234.jsonl"
+    path.write_text('{"id": 1}\n\n{"id": 2}\n{"id": 3}\n{"id": 4, "mess')
+
+    assert tail_lines(path, 2) == [b'{"id": 3}', b'{"id": 4, "mess']
+    assert tail_records(path, 3) == [{"id": 2}, {"id": 3}]
+
+    empty = tmp_path / "empty.jsonl"
+    empty.touch()
+    assert tail_records(empty, 3) == []
+
+
+@pytest.mark.parametrize(
+    "ids,expected", [([1, 2, 3, 4], 4), ([5, 2, 7, 1], 7), ([], None)]
+)
+def test_last_message_id_jsonl(ids, expected, tmp_path: Path):
+    """Should find the last message of ordered and unordered files."""
+    storage = JSONLStorage(tmp_path)
+    with storage.open_member("1234") as writer:
+        for message_id in ids:
+            writer.write({"id": message_id})
+
+    assert storage.last_message_id("1234") == expected
+
+
+def test_compact_jsonl(tmp_path: Path):
+    """Should sort a member file by id and drop duplicates."""
+    storage = JSONLStorage(tmp_path)
+    with storage.open_member("1234") as writer:
+        for message_id in [1, 4, 2, 4, 3]:
+            writer.write({"id": message_id})
+
+    storage.compact("1234")
+
+    assert storage.message_ids("1234") == [1, 2, 3, 4]
+
+
+def test_compact_locked_jsonl(tmp_path: Path):
+    """Should not compact a member file another process is writing."""
+    storage = JSONLStorage(tmp_path)
+    with storage.open_member("1234") as writer:
+        writer.write({"id": 2})
+        writer.write({"id": 1})
+        writer.file.flush()
+
+        with pytest.raises(LockedError):
+            storage.compact("1234")
+
+    assert storage.message_ids("1234") == [2, 1]
+
+
+def test_id_index_jsonl(tmp_path: Path):
+    """Should read only appended messages and rebuild the index of a replaced file."""
+    storage = JSONLStorage(tmp_path)
+    with storage.open_member("1234") as writer:
+        for message_id in [1, 4, 2]:
+            writer.write({"id": message_id})
+    assert list(storage.id_set("1234")) == [1, 2, 4]
+    assert (tmp_path / "1234.ids").exists()
+
+    with storage.open_member("1234") as writer:
+        writer.write({"id": 3})
+        writer.write({"id": 4})
+    assert list(storage.id_set("1234")) == [1, 2, 3, 4]
+
+    with storage.replace_member("1234") as writer:
+        writer.write({"id": 7})
+    assert list(storage.id_set("1234")) == [7]
+
+
+def test_member_lock(tmp_path: Path):
+    """Should not let two writers append to the same member file."""
+    storage = JSONLStorage(tmp_path)
+    with storage.open_member("1234"):
+        with pytest.raises(LockedError):
+            with storage.open_member("1234"):
+                pass
+    with storage.open_member("1234"):
+        pass
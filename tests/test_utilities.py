@@ -0,0 +1,52 @@
+"""Utility Function Tests.
+
+This test suite tests the client configuration helpers.
+"""
+
+from pathlib import Path
+
+from telethon.sessions import SQLiteSession
+from telethon.tl import types
+
+from tegracli.utilities import (
+    flood_sleep_threshold,
+    memory_session,
+    normalize_accounts,
+)
+
+
+def test_flood_sleep_threshold():
+    """Should prefer per-command thresholds over the global one."""
+    options = {"flood_sleep_threshold": 60, "flood_sleep_thresholds": {"group": 0}}
+
+    assert flood_sleep_threshold(options, "group") == 0
+    assert flood_sleep_threshold(options, "get") == 60
+    assert flood_sleep_threshold({}, "get") == 15 * 60
+
+
+def test_memory_session(tmp_path: Path):
+    """Should copy cached entities from the session file into memory."""
+    stored = SQLiteSession(str(tmp_path / "test"))
+    stored.process_entities([types.InputPeerChannel(channel_id=1234, access_hash=5678)])
+    stored.save()
+    stored.close()
+
+    session = memory_session(str(tmp_path / "test"))
+
+    assert session.get_input_entity(types.PeerChannel(1234)).access_hash == 5678
+
+
+def test_normalize_accounts():
+    """Should reduce handles, URLs and IDs and drop duplicates and invite links."""
+    lines = [
+        "https://t.me/Some_Channel\n",
+        "@some_channel",
+        "t.me/s/other_channel, a comment",
+        "-1001446651076",
+        "1446651076",
+        "https://t.me/joinchat/AAAAAFxyz",
+        "# a comment",
+        "",
+    ]
+
+    assert normalize_accounts(lines) == ["Some_Channel", "other_channel", "1446651076"]
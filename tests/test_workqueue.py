@@ -0,0 +1,59 @@
+"""Work Queue Tests.
+
+This test suite tests distributing group members across workers.
+"""
+
+import time
+from pathlib import Path
+
+from tegracli.workqueue import DONE, FAILED, PENDING, WorkQueue
+
+
+def test_round(tmp_path: Path):
+    """Should hand out each member once and start a new round when done."""
+    queue = WorkQueue(tmp_path / "queue.db")
+    assert queue.enqueue(["a", "b"]) == 2
+    assert queue.enqueue(["a", "b"]) == 0  # the round is still open
+
+    assert queue.lease("one") == "a"
+    assert queue.lease("two") == "b"
+    assert queue.lease("three") is None
+
+    queue.complete("a", "one")
+    queue.release("b", "two", "error")
+    assert queue.counts() == {DONE: 1, PENDING: 1}
+    assert queue.lease("three") == "b"
+    assert not queue.heartbeat("b", "two", 60)
+    assert queue.heartbeat("b", "three", 60)
+    queue.complete("b", "three")
+
+    assert queue.enqueue(["a", "b", "c"]) == 3
+
+
+def test_journal(tmp_path: Path):
+    """Should journal the states of completed members only while leased."""
+    queue = WorkQueue(tmp_path / "queue.db")
+    queue.enqueue(["a", "b"])
+    queue.lease("one")
+    queue.lease("two")
+
+    assert queue.complete("a", "one", {"member": "a"}) == 1
+    assert queue.complete("b", "one", {"member": "b"}) == 1  # leased by two
+    assert queue.complete("b", "two", {"member": "b"}) == 2
+    (seq, _), (last_seq, state) = queue.journal()
+    queue.forget(seq)
+
+    assert queue.journal() == [(last_seq, state)]
+    assert state == {"member": "b"}
+
+
+def test_expired_lease(tmp_path: Path):
+    """Should hand expired leases to other workers until attempts run out."""
+    queue = WorkQueue(tmp_path / "queue.db", max_attempts=2)
+    queue.enqueue(["a"])
+
+    assert queue.lease("one", duration=-1) == "a"
+    assert queue.lease("two", duration=-1) == "a"
+    time.sleep(0.01)
+    assert queue.lease("three") is None
+    assert queue.counts() == {FAILED: 1}